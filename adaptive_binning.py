@@ -0,0 +1,99 @@
+# Adaptive energy band edges, instead of the fixed CUSTOM_INTERVALS / INTERVAL of
+# energy_resolved_pp.py. Everything works on the cumulative counts over PI (one
+# histogram of the PI column, or the prefix sums of an energy-phase cube), so a
+# band's counts or profile is a difference of two rows, and a new binning costs
+# a few array operations instead of another extraction, calibration and fold.
+# Edges are in units of 0.1 keV, like the _E{a}_{b} band files.
+import numpy as np
+
+from energy_phase_cube import N_PI
+
+# 2-12 keV, the range of the energy-resolved pulse profiles
+EMIN, EMAX = 5, 100
+
+
+def cumulative_pi_counts(pi):
+    """cumulative[i]: number of events with PI below i, from the PI column."""
+    counts = np.bincount(np.clip(np.asarray(pi, dtype=np.int64), 0, N_PI - 1), minlength=N_PI)
+    return np.concatenate([[0], np.cumsum(counts)])
+
+
+def band_counts(cumulative, edges):
+    """Counts of the bands between consecutive edges, selected as band_split does (both ends inclusive)."""
+    edges = np.asarray(edges, dtype=np.int64)
+    return cumulative[np.minimum(edges[1:] * 10 + 1, N_PI)] - cumulative[edges[:-1] * 10]
+
+
+def equal_count_edges(cumulative, nbands, emin=EMIN, emax=EMAX):
+    """
+    Edges of nbands bands with (as nearly as the 0.1 keV grid allows) the same counts,
+    from the quantiles of the cumulative counts.
+    Args:
+    - cumulative (array): Cumulative counts over PI, e.g. cumulative_pi_counts(pi) or cube.cumulative.sum(axis=1).
+    - nbands (int): Number of bands.
+
+    Returns:
+    - list: Band edges in 0.1 keV, from emin to emax. Fewer bands come out if the counts are too concentrated.
+    """
+    grid = np.arange(emin, emax + 1)
+    at_edge = cumulative[grid * 10]
+    targets = at_edge[0] + (at_edge[-1] - at_edge[0]) * np.arange(1, nbands) / nbands
+    inner = grid[np.clip(np.searchsorted(at_edge, targets), 1, len(grid) - 2)]
+    return sorted({emin, emax, *inner.tolist()})
+
+
+def pulsed_snr(profiles, nharm=2):
+    """Pulsed signal to noise of binned profiles (one per row), sqrt(Z_n^2 - 2n), 0 below the noise level."""
+    profiles = np.atleast_2d(profiles)
+    spectrum = np.fft.rfft(profiles, axis=1)[:, 1:nharm + 1]
+    total = profiles.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z2 = np.where(total > 0, 2 * (np.abs(spectrum) ** 2).sum(axis=1) / total, 0)
+    return np.sqrt(np.maximum(z2 - 2 * nharm, 0))
+
+
+def equal_snr_edges(cube, target_snr, emin=EMIN, emax=EMAX, nharm=2, min_width=1):
+    """
+    Edges of bands that each reach a pulsed S/N of target_snr, built greedily from emin:
+    every band is grown until its profile reaches the target. The profiles of all the
+    candidate ends of a band come from the cube's prefix sums in one step. A remainder at
+    the top that does not reach the target is merged into the last band.
+    Args:
+    - cube (EnergyPhaseCube): Folded events of the full energy file.
+    - target_snr (float): Pulsed S/N per band (see pulsed_snr).
+    - min_width (int): Narrowest band, in 0.1 keV.
+
+    Returns:
+    - list: Band edges in 0.1 keV, from emin to emax.
+    """
+    edges = [emin]
+    while edges[-1] < emax:
+        start = edges[-1]
+        ends = np.arange(min(start + min_width, emax), emax + 1)
+        profiles = cube.cumulative[np.minimum(ends * 10 + 1, N_PI)] - cube.cumulative[start * 10]
+        reached = np.flatnonzero(pulsed_snr(profiles.astype(np.float64), nharm) >= target_snr)
+        if not len(reached):
+            if len(edges) > 1:
+                edges[-1] = emax
+            else:
+                edges.append(emax)
+            break
+        edges.append(int(ends[reached[0]]))
+    return edges
+
+
+def adaptive_edges(mode, value, cube=None, pi=None, emin=EMIN, emax=EMAX, nharm=2):
+    """
+    Band edges for energy_resolved_pp.
+    Args:
+    - mode (str): 'counts' (value bands of equal counts) or 'snr' (bands of pulsed S/N value, needs the cube).
+    - cube (EnergyPhaseCube): Folded events; for 'counts' the PI column can be given instead.
+    """
+    if mode == 'counts':
+        cumulative = cumulative_pi_counts(pi) if cube is None else cube.cumulative.sum(axis=1)
+        return equal_count_edges(cumulative, int(value), emin, emax)
+    if mode == 'snr':
+        if cube is None:
+            raise ValueError("Equal S/N bands need the energy-phase cube")
+        return equal_snr_edges(cube, float(value), emin, emax, nharm)
+    raise ValueError(f"Unknown adaptive binning mode: {mode}")
@@ -0,0 +1,243 @@
+# Content-addressed cache for derived files (HENreadevents / HENcalibrate outputs
+# and the copies of event and RMF files into the analysis directories).
+# An entry is keyed on the content hash of every input file plus the tool and its
+# arguments, so a changed event file or RMF is never served a stale product and a
+# renamed file is still a hit. Entries live in a shared cache directory, are
+# evicted least-recently-used once the cache grows past its size limit, and are
+# materialised into the analysis directory by hardlink or reflink, not by copy.
+import os
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+import contextlib
+
+CACHE_DIR = os.environ.get('NICER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'nicer_analysis'))
+CACHE_MAX_BYTES = int(os.environ.get('NICER_CACHE_MAX_BYTES', 50 * 1024 ** 3))
+
+# Prefix of the files a store is still writing; eviction leaves them alone
+TMP_PREFIX = '.tmp-'
+
+# FICLONE ioctl (Linux) for copy-on-write reflinks on btrfs/xfs
+FICLONE = 0x40049409
+
+
+def _reflink(src, dest):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+
+
+def clone_file(src, dest):
+    """Independent copy of src at dest: a reflink where the filesystem supports it, else a copy."""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        _reflink(src, dest)
+        return 'reflink'
+    except (OSError, ImportError):
+        if os.path.exists(dest):
+            os.remove(dest)
+    shutil.copy2(src, dest)
+    return 'copy'
+
+
+@contextlib.contextmanager
+def _locked(path):
+    # Exclusive advisory lock on path for the duration of the block (no lock where fcntl is missing)
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return f"{os.path.realpath(path)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _is_current(stamp):
+    # A stamp is stale once its file is gone or has changed
+    path = stamp.rsplit(':', 3)[0]
+    try:
+        return _stamp(path) == stamp
+    except OSError:
+        return False
+
+
+def link_file(src, dest):
+    """Hardlink src to dest, falling back to a reflink and only then to a copy."""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+        return 'hardlink'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    return clone_file(src, dest)
+
+
+class ArtifactCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.digest_index = os.path.join(cache_dir, 'digests.json')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._digests = None
+
+    ### Content hashes
+
+    def _read_digests(self):
+        try:
+            with open(self.digest_index) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_digests(self):
+        if self._digests is None:
+            self._digests = self._read_digests()
+        return self._digests
+
+    def _save_digests(self, new):
+        """
+        Merge the new stamps into the index on disk and drop the stale ones. The read-merge-write
+        runs under a lock, so parallel jobs do not lose each other's updates.
+        """
+        with _locked(self.digest_index + '.lock'):
+            digests = self._read_digests()
+            digests.update(new)
+            digests = {stamp: digest for stamp, digest in digests.items() if _is_current(stamp)}
+            # Atomic replace, so readers never see a half-written index
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(digests, f)
+            os.replace(tmp, self.digest_index)
+        self._digests = digests
+
+    def file_digest(self, path):
+        """SHA-256 of the file content, remembered per (path, inode, size, mtime) to avoid rehashing."""
+        stamp = _stamp(path)
+        digests = self._load_digests()
+        if stamp not in digests:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 22), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            self._save_digests({stamp: digest})
+            return digest
+        return digests[stamp]
+
+    def key(self, tool, args, inputs):
+        """Cache key of running tool with args on the given input files."""
+        description = {'tool': tool, 'args': list(args), 'inputs': [self.file_digest(path) for path in inputs]}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    ### Entries
+
+    def _entry_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def fetch(self, key, dest):
+        """Materialise the entry into dest. Returns False on a miss."""
+        entry = self._entry_path(key)
+        if not os.path.exists(entry):
+            return False
+        os.utime(entry)  # Mark as recently used
+        link_file(entry, dest)
+        return True
+
+    def store(self, key, src, share=True):
+        """
+        Add src to the cache under key. With share, src itself becomes the entry (hardlink),
+        which is right for products the cache owns, and src stays writable; otherwise the entry
+        is an independent clone, made read-only as it is linked into every directory it is fetched to.
+        """
+        entry = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry), prefix=TMP_PREFIX)
+        os.close(fd)
+        if share:
+            link_file(src, tmp)
+        else:
+            clone_file(src, tmp)
+            os.chmod(tmp, 0o444)
+        os.replace(tmp, entry)
+        # Links and copy2 keep the mtime of src; the new entry is the most recently used
+        os.utime(entry)
+        self.evict(keep=entry)
+
+    def evict(self, keep=None):
+        """Drop the least recently used entries, except keep, until the cache fits in max_bytes."""
+        entries = []
+        for root, _, files in os.walk(self.objects_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                # In-flight stores of other jobs are not entries yet
+                if path == keep or name.startswith(TMP_PREFIX):
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Evicted by another job
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries) + (os.path.getsize(keep) if keep and os.path.exists(keep) else 0)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    ### High level helpers
+
+    def run(self, tool, args, inputs, output, execute):
+        """
+        Produce output with the cache in front of it.
+        Args:
+        - tool (str): Name of the tool, part of the key.
+        - args (list): Arguments that change the output, part of the key.
+        - inputs (list): Input files, hashed into the key.
+        - output (str): File the tool produces.
+        - execute (callable): Runs the tool; called only on a miss.
+
+        Returns:
+        - bool: True on a cache hit.
+        """
+        key = self.key(tool, args, inputs)
+        if self.fetch(key, output):
+            print(f"{os.path.basename(output)} restored from cache, skipping {tool}.")
+            return True
+        # Remove a stale product so the tool cannot leave it behind on failure
+        if os.path.lexists(output):
+            os.remove(output)
+        execute()
+        if not os.path.exists(output):
+            raise FileNotFoundError(f"{tool} did not produce {output}")
+        self.store(key, output)
+        return False
+
+    def copy(self, src, dest_dir):
+        """Content-addressed replacement for shutil.copy(src, dest_dir)."""
+        dest = os.path.join(dest_dir, os.path.basename(src))
+        key = self.key('copy', [], [src])
+        if not self.fetch(key, dest):
+            # The source file is not ours, so the entry is a clone and only the copies are links
+            self.store(key, src, share=False)
+            if not self.fetch(key, dest):
+                # Evicted again in the meantime (by a parallel job): plain copy
+                shutil.copy2(src, dest)
+        return dest
@@ -0,0 +1,97 @@
+# In-process replacement for the xselect energy band extraction used by
+# energy_resolved_pp.py. The base event file is opened once (memory-mapped),
+# the PI column is sorted once and every _E{a}_{b}.evt band file is written
+# from that single pass, keeping the GTI and the other extensions untouched.
+import os
+import numpy as np
+
+from instrumentation import instrumented, record, stage
+
+
+def band_pi_range(e1, e2):
+    """PI channel range of an energy band given in units of 0.1 keV.
+    Both ends are inclusive, the same way xselect applies "PI=a:b"."""
+    return e1 * 10, e2 * 10
+
+
+def band_filename(base_filename, e1, e2):
+    return f"{base_filename}_E{e1}_{e2}.evt"
+
+
+def split_by_pi(pi, bands):
+    """
+    Bucket the event rows by PI for every band with a single sort.
+    Args:
+    - pi (array): PI column of the events.
+    - bands (list of tuple): (e1, e2) band edges in units of 0.1 keV.
+
+    Returns:
+    - dict: (e1, e2) -> row indices (in time order) of the events in the band.
+    """
+    pi = np.asarray(pi)
+    order = np.argsort(pi, kind='stable')
+    sorted_pi = pi[order]
+
+    pi_ranges = np.array([band_pi_range(e1, e2) for e1, e2 in bands]).reshape(-1, 2)
+    left = np.searchsorted(sorted_pi, pi_ranges[:, 0], side='left')
+    right = np.searchsorted(sorted_pi, pi_ranges[:, 1], side='right')
+
+    # Sorting the indices back restores the original (time) order of the rows
+    return {tuple(band): np.sort(order[l:r]) for band, l, r in zip(bands, left, right)}
+
+
+def split_events(events, bands):
+    """Split an in-memory event table (anything with a 'PI' field) into bands."""
+    buckets = split_by_pi(events['PI'], bands)
+    return {band: events[idx] for band, idx in buckets.items()}
+
+
+@instrumented()
+def split_event_file(evt_file, bands, out_dir=None, base_filename=None, write=True, return_events=False):
+    """
+    Split an event file into energy bands in one pass, without xselect.
+    Args:
+    - evt_file (str): Path to the base event file.
+    - bands (list of tuple): (e1, e2) band edges in units of 0.1 keV.
+    - out_dir (str): Where the band files go. Defaults to the event file directory.
+    - base_filename (str): Base of the band file names. Defaults to the event file name without '.evt'.
+    - write (bool): Write the _E{a}_{b}.evt files.
+    - return_events (bool): Also return the per-band event tables in memory.
+
+    Returns:
+    - tuple: (paths, events), two dicts keyed on (e1, e2): the written file of each band (empty
+      unless write) and the event table of each band (empty unless return_events).
+    """
+    if out_dir is None:
+        out_dir = os.path.dirname(os.path.abspath(evt_file))
+    if base_filename is None:
+        base_filename = os.path.splitext(os.path.basename(evt_file))[0]
+
+    from astropy.io import fits
+    paths, events = {}, {}
+    with fits.open(evt_file, memmap=True) as hdul:
+        events_index = hdul.index_of('EVENTS')
+        if events_index == 0:
+            raise ValueError(f"{evt_file} has its events in the primary HDU.")
+        events_hdu = hdul[events_index]
+        record(events=events_hdu.header['NAXIS2'])
+        with stage('fits_read'):
+            pi = np.asarray(events_hdu.data['PI'])
+        buckets = split_by_pi(pi, bands)
+
+        for (e1, e2), idx in buckets.items():
+            band_data = events_hdu.data[idx]
+            if write:
+                band_hdu = fits.BinTableHDU(data=band_data, header=events_hdu.header.copy())
+                pi_start, pi_end = band_pi_range(e1, e2)
+                band_hdu.header['HISTORY'] = f"PI={pi_start}:{pi_end} selected by band_split"
+                # Keep the primary, GTI and any other extension exactly as in the base file
+                hdus = [band_hdu if i == events_index else hdu for i, hdu in enumerate(hdul)]
+                out_path = os.path.join(out_dir, band_filename(base_filename, e1, e2))
+                fits.HDUList(hdus).writeto(out_path, overwrite=True)
+                print(f"Saved {len(idx)} events to {out_path}")
+                paths[(e1, e2)] = out_path
+            if return_events:
+                events[(e1, e2)] = np.array(band_data)
+
+    return paths, events
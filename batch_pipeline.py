@@ -0,0 +1,284 @@
+# Non-interactive batch runner for pipeline.py and energy_resolved_pp.py.
+# The stages are a dependency graph, every observation runs its stages in
+# dependency order in its own worker process, and independent observations run
+# concurrently in a bounded pool. Nothing changes the process-wide working
+# directory: subprocesses get their own cwd and everything else uses absolute
+# paths. Each observation logs to <log_dir>/<obsID>.log, and the wall time of
+# every stage goes to <log_dir>/summary.json. With NICER_PROFILE=1 the detailed
+# per-stage profile of an observation goes to <log_dir>/<obsID>_profile.json.
+# The barycentred (_bary_scorr) event file is made outside the batch from the
+# niextract output; the stages reading it check for it before anything runs.
+#
+# Usage: python batch_pipeline.py batch_config.json
+import os
+import sys
+import json
+import time
+import subprocess
+import contextlib
+import graphlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import instrumentation
+from instrumentation import run_command
+
+# The barycentric and orbit correction runs outside the batch, between two batches:
+# the first ends with niextract, the second starts from the corrected event file.
+# band_split (band event files, e.g. for spectra) is optional: fold uses the full energy file.
+PRE_BARYCENTRE_STAGES = ['calmerge_mkf', 'screen', 'nimaketime', 'niextract']
+POST_BARYCENTRE_STAGES = ['calibrate', 'fold']
+
+DEFAULT_CONFIG = {
+    'datapath': '/Users/hongyuzhang/Documents/data/her_x-1/2022_data',
+    'observations': list(range(1, 16)),  # 01 to 15, as in observationalID()
+    'stages': PRE_BARYCENTRE_STAGES,
+    'underonly_range': '0-500',
+    'overonly_range': '0-30',
+    # Suffix of the analysis event file after the (external) barycentric correction
+    'analysis_suffix': '_bary_scorr',
+    'custom_intervals': [5, 8, 14, 100],
+    'pbin': 128,
+    'rmf_file': '/Users/hongyuzhang/Documents/soft/caldb/data/nicer/xti/cpf/rmf/nixtiref20170601v003.rmf',
+    'max_workers': 4,
+    'log_dir': 'batch_logs',
+}
+
+
+def obs_id(observation):
+    # Accept both the short 1-15 numbers and full obsIDs
+    observation = str(observation)
+    return observation if len(observation) == 10 else '360202' + observation.zfill(2) + '01'
+
+
+def range_upper(value_range):
+    return value_range.split('-')[1]
+
+
+class ObsContext:
+    """Paths and settings of one observation, plus the subprocess runner writing to its log."""
+
+    def __init__(self, config, obsID, log):
+        self.config = config
+        self.obsID = obsID
+        self.log = log
+        self.datapath = config['datapath']
+        self.datasetdir = os.path.join(self.datapath, obsID)
+        self.eventcldir = os.path.join(self.datasetdir, 'xti', 'event_cl')
+        self.analysis_dir = os.path.join(self.datasetdir, 'xti', 'analysis')
+        self.mkf = os.path.join(self.datasetdir, 'auxil', f'ni{obsID}.mkf')
+        uo, oo = range_upper(config['underonly_range']), range_upper(config['overonly_range'])
+        self.extracted_base = f"ni{obsID}_0mpu7_cl_uo{uo}_oo{oo}"
+        self.base_filename = self.extracted_base + config['analysis_suffix']
+        self.extracted_evt = os.path.join(self.analysis_dir, f"{self.extracted_base}.evt")
+        self.analysis_evt = os.path.join(self.analysis_dir, f"{self.base_filename}.evt")
+        intervals = config['custom_intervals']
+        self.energy_resolved_dir = os.path.join(
+            self.analysis_dir, f"energy_resolved_pp_E{'-'.join(map(str, intervals))}_bin{config['pbin']}")
+
+    def run(self, command, cwd):
+        self.log.write(f"$ (cd {cwd}) {command}\n")
+        self.log.flush()
+        result = run_command(command, shell=True, cwd=cwd, stdout=self.log, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise RuntimeError(f"Command failed with exit code {result.returncode}: {command}")
+
+
+### Stages
+
+def stage_calmerge_mkf(ctx):
+    ctx.run(f"nicerl2 indir={ctx.obsID} clobber=yes tasks=CALMERGE,MKF", cwd=ctx.datapath)
+
+
+def stage_screen(ctx):
+    config = ctx.config
+    ctx.run(f"nicerl2 {ctx.obsID} clobber=YES tasks=SCREEN overonly_range={config['overonly_range']} "
+            f"underonly_range={config['underonly_range']}", cwd=ctx.datapath)
+
+
+def stage_nimaketime(ctx):
+    config = ctx.config
+    ctx.run(f"nimaketime infile={ctx.mkf} outfile={ctx.mkf}_gti1 cleanup=YES "
+            f"underonly_range={config['underonly_range']} overonly_range={config['overonly_range']} "
+            f"expr=\"SUN_ANGLE>60 && KP<5\" chatter=5 clobber=yes", cwd=ctx.datasetdir)
+
+
+def stage_niextract(ctx):
+    from event_filter import filter_events
+    os.makedirs(ctx.analysis_dir, exist_ok=True)
+    filter_events(os.path.join(ctx.eventcldir, f"ni{ctx.obsID}_0mpu7_cl.evt"), ctx.extracted_evt,
+                  pi_range=(30, 1200), event_flags='bxxx1x000', timefile=f"{ctx.mkf}_gti1")
+
+
+def stage_band_split(ctx):
+    from band_split import split_event_file
+    intervals = ctx.config['custom_intervals']
+    os.makedirs(ctx.energy_resolved_dir, exist_ok=True)
+    split_event_file(ctx.analysis_evt,
+                     [(intervals[i], intervals[i + 1]) for i in range(len(intervals) - 1)],
+                     out_dir=ctx.energy_resolved_dir, base_filename=ctx.base_filename)
+
+
+def stage_calibrate(ctx):
+    # Only the full energy file is needed, the band profiles come from its energy-phase cube
+    from artifact_cache import ArtifactCache
+    from calibrate import calibrate_event_file, calib_filename
+    os.makedirs(ctx.energy_resolved_dir, exist_ok=True)
+    cache = ArtifactCache()
+    evt_file = cache.copy(ctx.analysis_evt, ctx.energy_resolved_dir)
+    calib_file = calib_filename(evt_file)
+    rmf_file = ctx.config['rmf_file']
+    cache.run('calibrate_event_file', [], [evt_file, rmf_file], calib_file,
+              lambda: calibrate_event_file(evt_file, rmf_file, calib_file))
+
+
+def stage_fold(ctx):
+    from ni_utilities import load_timing_parameters
+    from energy_resolved_pp import plot_energy_resolved_pulse_profiles
+    timing_params = load_timing_parameters(ctx.datapath, ctx.obsID)
+    if timing_params is None:
+        raise RuntimeError(f"Timing parameters not found for {ctx.obsID}")
+    plot_energy_resolved_pulse_profiles(ctx.energy_resolved_dir, ctx.base_filename, ctx.config['pbin'],
+                                        timing_params['fr'], timing_params['frdot'], timing_params['tstart'],
+                                        energy_list=ctx.config['custom_intervals'])
+
+
+# Stage name -> (function, stages it depends on)
+STAGES = {
+    'calmerge_mkf': (stage_calmerge_mkf, []),
+    'screen': (stage_screen, ['calmerge_mkf']),
+    'nimaketime': (stage_nimaketime, ['calmerge_mkf']),
+    'niextract': (stage_niextract, ['screen', 'nimaketime']),
+    # Through the external barycentric correction of the niextract output
+    'band_split': (stage_band_split, ['niextract']),
+    'calibrate': (stage_calibrate, ['niextract']),
+    'fold': (stage_fold, ['calibrate']),
+}
+# Stage name -> ObsContext attributes of the files it reads that no stage produces
+EXTERNAL_INPUTS = {
+    'band_split': ['analysis_evt'],
+    'calibrate': ['analysis_evt'],
+}
+
+
+def missing_inputs(ctx, selected):
+    """
+    {stage: reason} for the selected stages whose external input files are missing, or would be
+    stale because niextract runs in the same batch, checked before any stage runs.
+    """
+    missing = {}
+    for name in selected:
+        for attribute in EXTERNAL_INPUTS.get(name, []):
+            path = getattr(ctx, attribute)
+            if 'niextract' in selected:
+                reason = f"needs {path}, made outside the batch from the niextract output"
+            elif not os.path.exists(path):
+                reason = f"needs {path}, which does not exist"
+            else:
+                continue
+            missing[name] = (f"{reason}; barycentre and orbit-correct {os.path.basename(ctx.extracted_evt)} "
+                             f"into it, then run the batch again with the stages from {name} on")
+            break
+    return missing
+
+
+def stage_order(selected):
+    """Selected stages in dependency order. Dependencies that are not selected are assumed done."""
+    unknown = set(selected) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}")
+    graph = {name: [dep for dep in STAGES[name][1] if dep in selected] for name in selected}
+    return list(graphlib.TopologicalSorter(graph).static_order())
+
+
+def run_observation(config, obsID):
+    """Run all selected stages of one observation. Returns {stage: {'status', 'wall_time'}}."""
+    import matplotlib
+    matplotlib.use('Agg')  # Workers have no display
+
+    os.makedirs(config['log_dir'], exist_ok=True)
+    summary = {}
+    failed = set()
+    with open(os.path.join(config['log_dir'], f"{obsID}.log"), 'a') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        ctx = ObsContext(config, obsID, log)
+        missing = missing_inputs(ctx, config['stages'])
+        for name in stage_order(config['stages']):
+            function, deps = STAGES[name]
+            if name in missing:
+                summary[name] = {'status': 'missing_input', 'wall_time': 0.0}
+                failed.add(name)
+                print(f"=== {name}: not run, {missing[name]}")
+                continue
+            if failed.intersection(deps):
+                summary[name] = {'status': 'skipped', 'wall_time': 0.0}
+                failed.add(name)
+                print(f"=== {name}: skipped, a dependency failed")
+                continue
+
+            print(f"=== {name}: started")
+            log.flush()
+            start = time.perf_counter()
+            try:
+                with instrumentation.stage(name):
+                    function(ctx)
+                status = 'done'
+            except Exception as e:
+                status = 'failed'
+                failed.add(name)
+                print(f"=== {name}: {type(e).__name__}: {e}")
+            wall_time = time.perf_counter() - start
+            summary[name] = {'status': status, 'wall_time': round(wall_time, 3)}
+            print(f"=== {name}: {status} in {wall_time:.1f} s")
+            log.flush()
+    if instrumentation.is_enabled():
+        # One report per observation, workers do not run atexit handlers
+        instrumentation.write_report(os.path.join(config['log_dir'], f"{obsID}_profile.json"))
+        instrumentation.reset()
+    return summary
+
+
+def load_config(filename=None):
+    config = dict(DEFAULT_CONFIG)
+    if filename is not None:
+        with open(filename) as f:
+            config.update(json.load(f))
+    config['log_dir'] = os.path.abspath(config['log_dir'])
+    return config
+
+
+def run_batch(config):
+    obsIDs = [obs_id(observation) for observation in config['observations']]
+    # Report missing external inputs now rather than only in the logs once the stages before them ran
+    for obsID in obsIDs:
+        for name, reason in missing_inputs(ObsContext(config, obsID, None), config['stages']).items():
+            print(f"{obsID}: {name} will not run, {reason}")
+    summary = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=config['max_workers']) as pool:
+        futures = {pool.submit(run_observation, config, obsID): obsID for obsID in obsIDs}
+        for future in as_completed(futures):
+            obsID = futures[future]
+            try:
+                summary[obsID] = future.result()
+            except Exception as e:
+                summary[obsID] = {'error': f"{type(e).__name__}: {e}"}
+            print(f"{obsID}: " + ", ".join(f"{stage} {result['status']} ({result['wall_time']:.1f} s)"
+                                          for stage, result in summary[obsID].items() if isinstance(result, dict)))
+
+    report = {'config': config, 'total_wall_time': round(time.perf_counter() - start, 3),
+              'observations': dict(sorted(summary.items()))}
+    summary_file = os.path.join(config['log_dir'], 'summary.json')
+    with open(summary_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Summary written to {summary_file}")
+    if 'niextract' in config['stages'] and not set(POST_BARYCENTRE_STAGES) <= set(config['stages']):
+        example = ObsContext(config, obsIDs[0], None) if obsIDs else None
+        print("Next: barycentre and orbit-correct the niextract output of every observation"
+              + (f" (e.g. {os.path.basename(example.extracted_evt)} -> {os.path.basename(example.analysis_evt)})"
+                 if example else "")
+              + f", then run from calibrate: nicer.py pipeline --stages {' '.join(POST_BARYCENTRE_STAGES)}")
+    return report
+
+
+if __name__ == "__main__":
+    run_batch(load_config(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -0,0 +1,217 @@
+# Benchmarks of the band split, the per-band folding, the f-fdot search and the
+# GTI handling on synthetic event files (see synthetic.py), from 10^5 up to 10^8
+# events. Results are stored per git commit in benchmarks/results/<commit>.json
+# (ignored by git), so a change can be compared with the commit before it.
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py                      # 1e5, 1e6, 1e7 events
+#   python benchmarks/run_benchmarks.py --sizes 1e5 1e8 --only band_split fold
+#   python benchmarks/run_benchmarks.py --sizes 1e7 --only search --max-search-events 1e7
+#   python benchmarks/run_benchmarks.py --compare <commit> [<commit>]
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from artifact_cache import CACHE_DIR  # noqa: E402
+from synthetic import synthetic_event_file, FREQUENCY, FDOT, TSTART  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DATA_DIR = os.path.join(CACHE_DIR, 'benchmarks')
+BANDS = [(5, 8), (8, 14), (14, 100)]  # The CUSTOM_INTERVALS of energy_resolved_pp.py
+PBIN = 128
+# Search grid: 64 frequencies x 8 fdots around the injected signal
+SEARCH_NFREQ, SEARCH_NFDOT = 64, 8
+# The search is skipped on larger event files unless asked for
+MAX_SEARCH_EVENTS = 1e6
+
+
+def _load(evt_file):
+    from astropy.io import fits
+    with fits.open(evt_file, memmap=True) as hdul:
+        data = hdul['EVENTS'].data
+        return np.array(data['TIME']), np.array(data['PI'])
+
+
+### Benchmarks: each takes the event file and returns a callable to time
+
+def bench_band_split(evt_file, workdir):
+    # One event file per energy band, the job xselect scripts used to do
+    from band_split import split_event_file
+    return lambda: split_event_file(evt_file, BANDS, out_dir=workdir)
+
+
+def bench_event_filter(evt_file, workdir):
+    # Role of niextract-events: PI, EVENT_FLAGS and GTI screening, streamed
+    from event_filter import filter_events
+    return lambda: filter_events(evt_file, os.path.join(workdir, 'filtered.evt'))
+
+
+def bench_fold(evt_file, workdir):
+    # Role of plot_energy_resolved_pulse_profiles: fold once, one profile per band
+    from energy_phase_cube import EnergyPhaseCube
+    times, pi = _load(evt_file)
+
+    def run():
+        cube = EnergyPhaseCube.from_events(times, pi, FREQUENCY, FDOT, TSTART, PBIN)
+        return [cube.band_profile(e1, e2) for e1, e2 in BANDS]
+    return run
+
+
+def bench_search(evt_file, workdir, nproc=1):
+    # Role of plotfdotvf.py: Z_2^2 on a fixed (f, fdot) grid around the signal
+    from fdot_search import zn_search_grid
+    times, _ = _load(evt_file)
+    times = times - times[0]
+    length = times[-1]
+    frequencies = FREQUENCY + (np.arange(SEARCH_NFREQ) - SEARCH_NFREQ // 2) / 2 / length
+    fdots = FDOT + (np.arange(SEARCH_NFDOT) - SEARCH_NFDOT // 2) / 2 / length ** 2
+    return lambda: zn_search_grid(times, frequencies, fdots, nharm=2, nproc=nproc)
+
+
+def bench_gti(evt_file, workdir):
+    # GTI algebra on the observation GTIs against many short screening intervals, then the event mask
+    from gti import read_gti, intersection, union, complement, gti_mask
+    times, _ = _load(evt_file)
+    gti = read_gti(evt_file)
+    rng = np.random.default_rng(0)
+    # Screening GTIs every ~10 s, as from an MKF threshold
+    edges = np.sort(rng.uniform(gti[0, 0], gti[-1, 1], 2 * max(int((gti[-1, 1] - gti[0, 0]) / 10), 1)))
+    screening = edges.reshape(-1, 2)
+
+    def run():
+        final = intersection(gti, screening)
+        union(final, complement(final))
+        return gti_mask(times, final)
+    return run
+
+
+BENCHMARKS = {
+    'band_split': bench_band_split,
+    'event_filter': bench_event_filter,
+    'fold': bench_fold,
+    'search': bench_search,
+    'gti': bench_gti,
+}
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    dirty = bool(git('status', '--porcelain', '--untracked-files=no'))
+    return commit, dirty
+
+
+def time_call(func, repeat):
+    # Best of repeat runs: the least disturbed by other load
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes, only=None, repeat=3, max_search_events=MAX_SEARCH_EVENTS, nproc=1, data_dir=DATA_DIR):
+    commit, dirty = git_commit()
+    results = {}
+    for size in sizes:
+        nevents = int(size)
+        print(f"Generating (or reusing) {nevents:.0e} events in {data_dir}")
+        evt_file = synthetic_event_file(data_dir, nevents)
+        for name, bench in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            if name == 'search' and nevents > max_search_events:
+                print(f"  {name:<13} skipped above {max_search_events:.0e} events")
+                continue
+            workdir = tempfile.mkdtemp(prefix='nicer_bench_')
+            try:
+                func = bench(evt_file, workdir, nproc) if name == 'search' else bench(evt_file, workdir)
+                seconds = time_call(func, repeat)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            results.setdefault(name, {})[str(nevents)] = seconds
+            print(f"  {name:<13} {nevents:>11d} events  {seconds:9.3f} s  {nevents / seconds / 1e6:8.2f} Mevt/s")
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'numpy': np.__version__, 'cpus': os.cpu_count()},
+        'settings': {'repeat': repeat, 'nproc': nproc, 'bands': BANDS, 'pbin': PBIN,
+                     'search_grid': [SEARCH_NFREQ, SEARCH_NFDOT], 'max_search_events': max_search_events},
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    filename = os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    # Merge with earlier runs of the same commit (e.g. other sizes)
+    if os.path.exists(filename):
+        with open(filename) as f:
+            previous = json.load(f)['results']
+        for name, timings in previous.items():
+            for n, seconds in timings.items():
+                results.setdefault(name, {}).setdefault(n, seconds)
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {filename}")
+    return report
+
+
+def compare(base, new=None):
+    """Print the timing ratio new / base of every benchmark (new defaults to the current commit)."""
+    def load(commit):
+        # A result name is the short commit, with -dirty for runs on a modified tree
+        for name in (commit, commit + '-dirty'):
+            path = os.path.join(RESULTS_DIR, f"{name}.json")
+            if os.path.exists(path):
+                with open(path) as f:
+                    return json.load(f)
+        raise FileNotFoundError(f"No benchmark results for {commit} in {RESULTS_DIR}")
+
+    if new is None:
+        commit, dirty = git_commit()
+        new = commit + ('-dirty' if dirty else '')
+    old_report, new_report = load(base), load(new)
+    print(f"{'benchmark':<13} {'events':>11} {base:>10} {new:>12} {'ratio':>7}")
+    for name, timings in new_report['results'].items():
+        for n, seconds in sorted(timings.items(), key=lambda item: int(item[0])):
+            old = old_report['results'].get(name, {}).get(n)
+            if old is None:
+                continue
+            flag = '  slower' if seconds > 1.1 * old else ('  faster' if seconds < 0.9 * old else '')
+            print(f"{name:<13} {int(n):>11d} {old:>10.3f} {seconds:>12.3f} {seconds / old:>7.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic NICER event files')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e5, 1e6, 1e7], help='Numbers of events')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='Run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs')
+    parser.add_argument('--max-search-events', type=float, default=MAX_SEARCH_EVENTS,
+                        help='Skip the search above this many events')
+    parser.add_argument('--nproc', type=int, default=1, help='Worker processes for the search')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Where the synthetic event files are kept')
+    parser.add_argument('--compare', nargs='+', metavar='COMMIT', help='Compare stored results instead of running')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare[:2])
+    else:
+        run(args.sizes, args.only, args.repeat, args.max_search_events, args.nproc, args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Synthetic NICER-like event files for the benchmarks.
+# Poisson arrival times inside gapped, orbit-like GTIs, thinned by a two-harmonic
+# Her X-1-like pulse profile at ~0.807 Hz with a spin derivative; PI drawn from a
+# broad continuum plus an iron line; EVENT_FLAGS mostly passing the bxxx1x000
+# screening of pipeline.py. The event table is generated and written in chunks
+# as raw FITS rows, so 10^8-event files do not need the whole list in memory.
+import os
+import numpy as np
+from astropy.io import fits
+
+FREQUENCY = 0.8078
+FDOT = -2e-11
+MJDREFI, MJDREFF = 56658, 7.775925925925930e-04
+TSTART = 2.6e8
+RATE = 250.0  # counts / s of good time
+PULSED_FRACTION = 0.3
+CHUNK_EVENTS = 2_000_000
+
+EVENT_DTYPE = np.dtype([('TIME', '>f8'), ('PI', '>i4'), ('PHA', '>i4'), ('EVENT_FLAGS', 'u1')])
+
+
+def synthetic_gti(exposure, seed=0):
+    """Orbit-like GTIs: 300-1500 s of good time separated by 1000-5000 s gaps, totalling exposure."""
+    rng = np.random.default_rng(seed)
+    nseg = int(exposure / 300) + 2
+    lengths = rng.uniform(300, 1500, nseg)
+    gaps = rng.uniform(1000, 5000, nseg)
+    nseg = int(np.searchsorted(np.cumsum(lengths), exposure)) + 1
+    lengths, gaps = lengths[:nseg], gaps[:nseg]
+    lengths[-1] -= lengths.sum() - exposure
+    starts = TSTART + np.r_[0, np.cumsum(lengths + gaps)[:-1]]
+    return np.column_stack([starts, starts + lengths])
+
+
+def pulse_profile(phase):
+    # Two harmonics with a sharp minimum, normalized to a maximum of 1 for thinning
+    shape = 1 + np.cos(2 * np.pi * phase) + 0.4 * np.cos(4 * np.pi * (phase - 0.3))
+    return (1 - PULSED_FRACTION) + PULSED_FRACTION * shape / 2.4
+
+
+def synthetic_pi(rng, n):
+    # Continuum peaking around 1.5-2 keV plus a 6.4 keV iron line, in 10 eV channels
+    energy = rng.lognormal(np.log(2.5), 0.6, n)
+    line = rng.uniform(size=n) < 0.03
+    energy[line] = rng.normal(6.4, 0.15, line.sum())
+    return np.clip(np.round(energy * 100), 0, 1500).astype(np.int32)
+
+
+def synthetic_flags(rng, n):
+    # 95% of the events pass bxxx1x000, the rest have random flags
+    flags = np.full(n, 0b00010000, dtype=np.uint8)
+    other = rng.uniform(size=n) < 0.05
+    flags[other] = rng.integers(0, 256, other.sum(), dtype=np.uint8)
+    return flags
+
+
+def _good_times(uniform_exposure, gti):
+    # Map times measured in good time since the first GTI start onto the gapped GTIs
+    lengths = gti[:, 1] - gti[:, 0]
+    cumulative = np.r_[0, np.cumsum(lengths)]
+    segment = np.clip(np.searchsorted(cumulative, uniform_exposure, side='right') - 1, 0, len(gti) - 1)
+    return gti[segment, 0] + (uniform_exposure - cumulative[segment])
+
+
+def generate_chunks(nevents, seed=0, chunk_events=CHUNK_EVENTS):
+    """
+    Yields sorted chunks of about nevents synthetic events (structured arrays with EVENT_DTYPE).
+    The GTI of the whole list is synthetic_gti(event_exposure(nevents), seed).
+    """
+    rng = np.random.default_rng(seed + 1)
+    gti = synthetic_gti(event_exposure(nevents), seed)
+    total_exposure = np.sum(gti[:, 1] - gti[:, 0])
+    nchunks = max(int(np.ceil(nevents / chunk_events)), 1)
+    edges = np.linspace(0, total_exposure, nchunks + 1)
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        ncandidates = rng.poisson(RATE * (hi - lo))
+        u = np.sort(rng.uniform(lo, hi, ncandidates))
+        times = _good_times(u, gti)
+        dt = times - TSTART
+        phase = FREQUENCY * dt + 0.5 * FDOT * dt ** 2
+        keep = rng.uniform(size=ncandidates) < pulse_profile(phase - np.floor(phase))
+        times = times[keep]
+        chunk = np.empty(len(times), dtype=EVENT_DTYPE)
+        chunk['TIME'] = times
+        chunk['PI'] = synthetic_pi(rng, len(times))
+        chunk['PHA'] = chunk['PI'] * 2
+        chunk['EVENT_FLAGS'] = synthetic_flags(rng, len(times))
+        yield chunk
+
+
+def event_exposure(nevents):
+    """Good time needed for nevents at RATE after pulse thinning."""
+    acceptance = np.mean(pulse_profile(np.linspace(0, 1, 1000, endpoint=False)))
+    return nevents / (RATE * acceptance)
+
+
+def generate_events(nevents, seed=0):
+    """Whole synthetic event list in memory: (structured events, gti)."""
+    events = np.concatenate(list(generate_chunks(nevents, seed)))
+    return events, synthetic_gti(event_exposure(nevents), seed)
+
+
+def _events_header(nrows):
+    columns = [fits.Column('TIME', 'D', unit='s'), fits.Column('PI', 'J', unit='chan'),
+               fits.Column('PHA', 'J', unit='chan'), fits.Column('EVENT_FLAGS', '8X')]
+    header = fits.BinTableHDU.from_columns(columns, nrows=0, name='EVENTS').header
+    header['NAXIS2'] = nrows
+    header['TELESCOP'] = 'NICER'
+    header['INSTRUME'] = 'XTI'
+    header['MJDREFI'] = MJDREFI
+    header['MJDREFF'] = MJDREFF
+    header['TIMESYS'] = 'TDB'
+    header['TIMEREF'] = 'SOLARSYSTEM'
+    header['TSTART'] = TSTART
+    header['OBJECT'] = 'SYNTHETIC'
+    return header
+
+
+def write_event_file(filename, nevents, seed=0):
+    """
+    Write a synthetic event file (EVENTS + GTI), streaming the rows chunk by chunk.
+    Returns:
+    - int: The number of events written.
+    """
+    gti = synthetic_gti(event_exposure(nevents), seed)
+    fits.HDUList([fits.PrimaryHDU()]).writeto(filename, overwrite=True)
+    nrows = 0
+    with open(filename, 'r+b') as out:
+        out.seek(0, os.SEEK_END)
+        header_offset = out.tell()
+        header = _events_header(0)
+        out.write(header.tostring().encode('ascii'))
+        for chunk in generate_chunks(nevents, seed):
+            out.write(chunk.tobytes())
+            nrows += len(chunk)
+        out.write(b'\0' * (-(nrows * EVENT_DTYPE.itemsize) % 2880))
+        # Same header length, only NAXIS2 changes
+        out.seek(header_offset)
+        out.write(_events_header(nrows).tostring().encode('ascii'))
+
+    gti_hdu = fits.BinTableHDU.from_columns([fits.Column('START', 'D', unit='s', array=gti[:, 0]),
+                                             fits.Column('STOP', 'D', unit='s', array=gti[:, 1])], name='GTI')
+    gti_hdu.header['MJDREFI'] = MJDREFI
+    gti_hdu.header['MJDREFF'] = MJDREFF
+    fits.append(filename, gti_hdu.data, gti_hdu.header)
+    return nrows
+
+
+def synthetic_event_file(data_dir, nevents, seed=0):
+    """Path of the synthetic file with nevents (requested) events in data_dir, generated on first use."""
+    os.makedirs(data_dir, exist_ok=True)
+    filename = os.path.join(data_dir, f"ni_synthetic_n{nevents:.0e}_s{seed}.evt".replace('+', ''))
+    if not os.path.exists(filename):
+        write_event_file(filename + '.tmp', nevents, seed)
+        os.replace(filename + '.tmp', filename)
+    return filename
@@ -0,0 +1,179 @@
+# In-process binary-orbit demodulation of event times.
+# The orbital (Roemer) delay of every event is computed at once: Kepler's equation
+# is solved with vectorized Newton iterations, and for large event lists the delay
+# is evaluated on a coarse time grid and interpolated, with the grid step chosen
+# from the requested accuracy. Orbital parameters come from a versioned JSON file,
+# so folds and searches can try orbit variations on in-memory arrays instead of
+# re-running the external correction and writing new _scorr files.
+# Barycentering itself still needs the NICER orbit file and stays with barycorr.
+import os
+import copy
+import json
+import tempfile
+import numpy as np
+
+ORBIT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "orbit_parameters.json")
+SECONDS_PER_DAY = 86400.0
+# Above this many events the delay is interpolated from a coarse grid
+GRID_MIN_EVENTS = 100_000
+
+
+class BinaryOrbit:
+    def __init__(self, porb, a1sini, t0, ecc=0.0, omega=0.0, pbdot=0.0, version=None):
+        """
+        Args:
+        - porb (float): Orbital period (days).
+        - a1sini (float): Projected semi-major axis (light seconds).
+        - t0 (float): Epoch of periastron (MJD, TDB). For a circular orbit with omega=0, the time of the ascending
+          node (delay 0, increasing), a quarter orbit before the mid-eclipse time T_pi/2 (delay +a1sini).
+        - ecc (float): Eccentricity.
+        - omega (float): Longitude of periastron (degrees).
+        - pbdot (float): Orbital period derivative (s/s).
+        - version: Version of the parameter file entry, for bookkeeping.
+        """
+        self.porb = porb
+        self.a1sini = a1sini
+        self.t0 = t0
+        self.ecc = ecc
+        self.omega = omega
+        self.pbdot = pbdot
+        self.version = version
+
+    def __repr__(self):
+        return (f"BinaryOrbit(porb={self.porb!r}, a1sini={self.a1sini!r}, t0={self.t0!r}, ecc={self.ecc!r}, "
+                f"omega={self.omega!r}, pbdot={self.pbdot!r}, version={self.version!r})")
+
+    def parameters(self):
+        """(porb, a1sini, t0, ecc, omega, pbdot), e.g. to tell products made with different orbits apart."""
+        return (self.porb, self.a1sini, self.t0, self.ecc, self.omega, self.pbdot)
+
+    def varied(self, **changes):
+        """Copy with some parameters changed, for orbit scans."""
+        orbit = copy.copy(self)
+        for name, value in changes.items():
+            if not hasattr(orbit, name):
+                raise AttributeError(f"Unknown orbital parameter: {name}")
+            setattr(orbit, name, value)
+        return orbit
+
+    def mean_anomaly(self, times, mjdref):
+        # Times in seconds since mjdref, as in the event files
+        dt = np.asarray(times, dtype=np.float64) - (self.t0 - mjdref) * SECONDS_PER_DAY
+        orbits = dt / (self.porb * SECONDS_PER_DAY)
+        return 2 * np.pi * (orbits - 0.5 * self.pbdot * orbits ** 2)
+
+    def eccentric_anomaly(self, mean_anomaly, tol=1e-12, max_iter=50):
+        """Solve E - e sin E = M for all M at once with Newton iterations."""
+        mean_anomaly = np.asarray(mean_anomaly, dtype=np.float64)
+        if self.ecc == 0:
+            return mean_anomaly
+        anomaly = mean_anomaly + self.ecc * np.sin(mean_anomaly)
+        for _ in range(max_iter):
+            step = (anomaly - self.ecc * np.sin(anomaly) - mean_anomaly) / (1 - self.ecc * np.cos(anomaly))
+            anomaly -= step
+            if np.max(np.abs(step), initial=0) < tol:
+                break
+        return anomaly
+
+    def delay(self, times, mjdref):
+        """Orbital light travel delay (s) at the given times (s since mjdref)."""
+        anomaly = self.eccentric_anomaly(self.mean_anomaly(times, mjdref))
+        omega = np.radians(self.omega)
+        return self.a1sini * ((np.cos(anomaly) - self.ecc) * np.sin(omega)
+                              + np.sqrt(1 - self.ecc ** 2) * np.sin(anomaly) * np.cos(omega))
+
+    def grid_step(self, tolerance):
+        # Linear interpolation error is at most step^2 / 8 times the largest second derivative of the delay
+        omega_orb = 2 * np.pi / (self.porb * SECONDS_PER_DAY)
+        curvature = self.a1sini * omega_orb ** 2 / (1 - self.ecc) ** 2
+        return np.sqrt(8 * tolerance / curvature)
+
+    def delay_interpolator(self, tmin, tmax, mjdref, tolerance=1e-6):
+        """Delay function interpolated from a coarse grid over [tmin, tmax], accurate to about tolerance (s)."""
+        npoints = max(int(np.ceil((tmax - tmin) / self.grid_step(tolerance))), 1) + 1
+        grid = np.linspace(tmin, tmax, npoints)
+        grid_delay = self.delay(grid, mjdref)
+        return lambda t: np.interp(t, grid, grid_delay)
+
+    def demodulate(self, times, mjdref, tolerance=1e-6, niter=3):
+        """
+        Emission times of the events, t_em = t - delay(t_em), by fixed-point iteration
+        (the delay changes by much less than its own size over one delay).
+        Args:
+        - times (array): Barycentred event times (s since mjdref).
+        - mjdref (float): MJD reference of the times.
+        - tolerance (float): Accuracy of the coarse grid interpolation (s), used above GRID_MIN_EVENTS events.
+        - niter (int): Fixed-point iterations.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        if times.size == 0:
+            return times.copy()
+        if times.size >= GRID_MIN_EVENTS:
+            # Widened by the largest delay, so the grid also covers the emission times
+            delay_of = self.delay_interpolator(times.min() - self.a1sini, times.max() + self.a1sini, mjdref, tolerance)
+        else:
+            delay_of = lambda t: self.delay(t, mjdref)
+        emitted = times - delay_of(times)
+        for _ in range(niter - 1):
+            emitted = times - delay_of(emitted)
+        return emitted
+
+
+def demodulate_events(events, orbit, tolerance=1e-6):
+    """Copy of a stingray EventList with demodulated times and GTIs, ready for fold_events or folding_search."""
+    mjdref = events.mjdref
+    demodulated = copy.copy(events)
+    demodulated.time = orbit.demodulate(events.time, mjdref, tolerance)
+    if getattr(events, 'gti', None) is not None:
+        gti = np.asarray(events.gti, dtype=np.float64)
+        demodulated.gti = orbit.demodulate(gti.ravel(), mjdref, tolerance).reshape(gti.shape)
+    return demodulated
+
+
+### Versioned parameter file
+
+def _read_orbit_file(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def load_orbit(source='herx1', version=None, filename=ORBIT_FILE):
+    """
+    Orbital parameters of a source from the versioned parameter file.
+    Entries of circular orbits may give the published T_pi/2 (mid-eclipse, key t_pi2) instead of t0;
+    it is converted to the ascending node, t0 = T_pi/2 - porb / 4.
+    Args:
+    - source (str): Key of the source in the file.
+    - version (int): Version to load. Defaults to the latest.
+    """
+    entries = _read_orbit_file(filename)[source]
+    if version is None:
+        entry = max(entries, key=lambda e: e['version'])
+    else:
+        entry = next((e for e in entries if e['version'] == version), None)
+        if entry is None:
+            raise KeyError(f"No version {version} of the {source} orbit in {filename}")
+    if 't0' in entry:
+        t0 = entry['t0']
+    elif entry.get('ecc', 0.0) == 0 and entry.get('omega', 0.0) == 0:
+        t0 = entry['t_pi2'] - entry['porb'] / 4
+    else:
+        raise ValueError(f"Version {entry['version']} of the {source} orbit needs t0: t_pi2 is only for circular orbits")
+    return BinaryOrbit(entry['porb'], entry['a1sini'], t0, entry.get('ecc', 0.0), entry.get('omega', 0.0),
+                       entry.get('pbdot', 0.0), version=entry['version'])
+
+
+def add_orbit_version(orbit, source='herx1', reference='', filename=ORBIT_FILE):
+    """Append the parameters of orbit as a new version (earlier versions are kept). Returns the version number."""
+    table = _read_orbit_file(filename) if os.path.exists(filename) else {}
+    entries = table.setdefault(source, [])
+    version = max((e['version'] for e in entries), default=0) + 1
+    entries.append({'version': version, 'reference': reference, 'porb': orbit.porb, 'a1sini': orbit.a1sini,
+                    't0': orbit.t0, 'ecc': orbit.ecc, 'omega': orbit.omega, 'pbdot': orbit.pbdot})
+
+    # Atomic replace, so readers never see a half-written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(table, f, indent=2)
+    os.replace(tmp, filename)
+    return version
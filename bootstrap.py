@@ -0,0 +1,158 @@
+# Resampling uncertainties for pulse profiles and for the best f / fdot.
+# All replicates are drawn at once (one multinomial or Poisson draw over the
+# binned data) and every statistic is evaluated for all replicates with
+# vectorized numpy, instead of re-folding or re-running the folding search.
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+def resample_profiles(profile, nreplicates=500, method='bootstrap', seed=None):
+    """
+    Replicates of a binned pulse profile (counts per bin).
+    Args:
+    - profile (array): Counts per phase bin, e.g. from fold_events or EnergyPhaseCube.profile.
+    - nreplicates (int): Number of replicates.
+    - method (str): 'bootstrap' (multinomial, fixed total counts) or 'poisson' (independent Poisson bins).
+    - seed: Seed or numpy Generator.
+
+    Returns:
+    - array: (nreplicates, nbin) replicate profiles.
+    """
+    rng = np.random.default_rng(seed)
+    profile = np.asarray(profile, dtype=np.float64)
+    if method == 'bootstrap':
+        total = int(round(profile.sum()))
+        return rng.multinomial(total, profile / profile.sum(), size=nreplicates).astype(np.float64)
+    if method == 'poisson':
+        return rng.poisson(profile, size=(nreplicates, profile.size)).astype(np.float64)
+    raise ValueError(f"Unknown resampling method: {method}")
+
+
+def profile_metrics(profiles, nharm=3):
+    """
+    Shape metrics of a stack of profiles (one profile per row).
+    Returns:
+    - dict: pulsed_fraction (max-min)/(max+min), min_phase (bin centre of the minimum),
+      harmonic_amplitudes (nprofiles, nharm) relative to the mean, harmonic_phases (nprofiles, nharm).
+    """
+    profiles = np.atleast_2d(np.asarray(profiles, dtype=np.float64))
+    nbin = profiles.shape[1]
+    pmax, pmin = profiles.max(axis=1), profiles.min(axis=1)
+    spectrum = np.fft.rfft(profiles, axis=1)[:, 1:nharm + 1]
+    return {
+        'pulsed_fraction': (pmax - pmin) / (pmax + pmin),
+        'min_phase': (np.argmin(profiles, axis=1) + 0.5) / nbin,
+        'harmonic_amplitudes': 2 * np.abs(spectrum) / profiles.sum(axis=1, keepdims=True),
+        # Phase of each harmonic's maximum (bin centres), in cycles of the fundamental
+        'harmonic_phases': np.mod(-np.angle(spectrum) / (2 * np.pi * np.arange(1, spectrum.shape[1] + 1)) + 0.5 / nbin, 1),
+    }
+
+
+def circular_mean_std(values, period=1.0, axis=0):
+    """
+    Circular mean and standard deviation of phases that repeat every period (in cycles of the
+    fundamental; 1/k for the phase of harmonic k), so values on both sides of a wrap are not
+    counted as a whole period apart.
+    """
+    resultant = np.mean(np.exp(2j * np.pi * np.asarray(values) / period), axis=axis)
+    mean = np.mod(np.angle(resultant) / (2 * np.pi) * period, period)
+    std = np.sqrt(-2 * np.log(np.abs(resultant))) / (2 * np.pi) * period
+    return mean, std
+
+
+def profile_uncertainties(profile, nreplicates=500, method='bootstrap', nharm=3, seed=None):
+    """
+    Bootstrap (or Poisson) uncertainties of the profile shape metrics.
+    Returns:
+    - dict: metric -> (value of the observed profile, standard deviation over the replicates).
+      The standard deviations of min_phase and harmonic_phases are computed on the circle,
+      for harmonic k on a circle of 1/k cycles.
+    """
+    observed = profile_metrics(profile, nharm)
+    replicated = profile_metrics(resample_profiles(profile, nreplicates, method, seed), nharm)
+    result = {}
+    for name, values in replicated.items():
+        if name == 'min_phase':
+            # Circular spread, so a minimum wrapping around phase 0 is not counted as a full cycle
+            _, spread = circular_mean_std(values)
+        elif name == 'harmonic_phases':
+            _, spread = circular_mean_std(values, 1 / np.arange(1, values.shape[1] + 1))
+        else:
+            spread = np.std(values, axis=0)
+        result[name] = (observed[name][0], spread)
+    return result
+
+
+def _zn_patch(weights, bin_times, bin_phases, df, dfd, nharm):
+    # Z_n^2 on the patch for every row of weights (replicate counts per time x phase bin):
+    # one (nreplicates x nbins) @ (nbins x npoints) product per harmonic
+    phase = bin_phases[:, None] + np.outer(bin_times, df) + np.outer(0.5 * bin_times ** 2, dfd)
+    phasors = np.exp(2j * np.pi * phase)
+    total = weights.sum(axis=1, keepdims=True)
+    stats = np.zeros((weights.shape[0], phasors.shape[1]))
+    harmonic = np.ones_like(phasors)
+    for _ in range(nharm):
+        harmonic *= phasors
+        stats += np.abs(weights @ harmonic) ** 2
+    return 2 / total * stats
+
+
+def _peak_positions(weights, bin_times, bin_phases, df, dfd, nharm):
+    return np.argmax(_zn_patch(weights, bin_times, bin_phases, df, dfd, nharm), axis=1)
+
+
+def _peak_positions_star(peak_args, weights):
+    return _peak_positions(weights, *peak_args)
+
+
+def peak_uncertainties(times, frequencies, fdots, nreplicates=200, nharm=2, time_bins=256, phase_bins=32, seed=None,
+                       nproc=1, chunk=50):
+    """
+    Bootstrap spread of the Z_n^2 peak position over a local (f, fdot) patch.
+    The events are binned once in time and in phase at the patch centre; over a patch a few
+    Fourier widths across, the phase of a bin moves linearly with f and fdot, so Z_n^2 of all
+    replicates (multinomial redraws of the bin counts) on the whole patch is a matrix product.
+    Args:
+    - times (array): Event times relative to the reference time of the search.
+    - frequencies, fdots (array): Axes of the local patch (e.g. from adaptive_zn_search).
+    - nreplicates (int): Number of bootstrap replicates.
+    - nharm (int): Number of harmonics.
+    - time_bins, phase_bins (int): Binning of the events.
+    - nproc (int): Spread the replicates over this many processes (None for all cores).
+    - chunk (int): Replicates per task.
+
+    Returns:
+    - tuple: (f_std, fdot_std, replicate f peaks, replicate fdot peaks)
+    """
+    rng = np.random.default_rng(seed)
+    times = np.asarray(times, dtype=np.float64)
+    frequencies, fdots = np.atleast_1d(frequencies), np.atleast_1d(fdots)
+    f0, fd0 = frequencies[len(frequencies) // 2], fdots[len(fdots) // 2]
+
+    phase = f0 * times + 0.5 * fd0 * times ** 2
+    counts, t_edges, p_edges = np.histogram2d(times, phase - np.floor(phase), bins=[time_bins, phase_bins],
+                                              range=[[times.min(), times.max()], [0, 1]])
+    counts = counts.ravel()
+    nonzero = counts > 0
+    bin_times = np.repeat((t_edges[:-1] + t_edges[1:]) / 2, phase_bins)[nonzero]
+    bin_phases = np.tile((p_edges[:-1] + p_edges[1:]) / 2, time_bins)[nonzero]
+    probabilities = counts[nonzero] / counts.sum()
+
+    ff, fd = np.meshgrid(frequencies, fdots)
+    df, dfd = ff.ravel() - f0, fd.ravel() - fd0
+    peak_args = (bin_times, bin_phases, df, dfd, nharm)
+
+    sizes = [min(chunk, nreplicates - start) for start in range(0, nreplicates, chunk)]
+    draws = [rng.multinomial(int(counts.sum()), probabilities, size=size).astype(np.float64) for size in sizes]
+    nproc = nproc or os.cpu_count() or 1
+    if nproc > 1:
+        with ProcessPoolExecutor(max_workers=nproc) as pool:
+            results = list(pool.map(functools.partial(_peak_positions_star, peak_args), draws))
+    else:
+        results = [_peak_positions(weights, *peak_args) for weights in draws]
+
+    best = np.concatenate(results)
+    f_peaks, fdot_peaks = ff.ravel()[best], fd.ravel()[best]
+    return np.std(f_peaks), np.std(fdot_peaks), f_peaks, fdot_peaks
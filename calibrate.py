@@ -0,0 +1,92 @@
+# In-process replacement for HENreadevents + HENcalibrate.
+# The RMF EBOUNDS table is read once per RMF and kept as a PI -> energy lookup
+# array; calibrating an event list is then a single vectorized take. The result
+# is written as the same _nicer_xti_ev_calib.nc file that hendrics' load_events
+# reads, without launching two subprocesses and rewriting the data twice per band.
+import os
+import functools
+import numpy as np
+
+from gti import read_gti
+from instrumentation import instrumented, record, stage
+
+
+@functools.lru_cache(maxsize=8)
+def _pi_energy_lookup(rmf_file, mtime_ns):
+    from astropy.io import fits
+    with stage('fits_read'), fits.open(rmf_file, memmap=True) as rmf:
+        ebounds = rmf['EBOUNDS'].data
+        channel = np.asarray(ebounds['CHANNEL'], dtype=np.int64)
+        # Same convention as HENcalibrate: the energy of a channel is the middle of its bounds
+        energy = (np.asarray(ebounds['E_MIN'], dtype=np.float64) + np.asarray(ebounds['E_MAX'], dtype=np.float64)) / 2
+    lookup = np.zeros(channel.max() + 2)  # The last entry (0 keV) catches PIs outside the RMF
+    lookup[channel] = energy
+    lookup.flags.writeable = False
+    return lookup
+
+
+def pi_energy_lookup(rmf_file):
+    """PI -> energy (keV) lookup array of an RMF, cached per file (and modification time)."""
+    rmf_file = os.path.realpath(rmf_file)
+    return _pi_energy_lookup(rmf_file, os.stat(rmf_file).st_mtime_ns)
+
+
+def calibrate_pi(pi, rmf_file):
+    """Energies (keV) of an array of PI channels. Channels missing from the RMF get 0, as in HENcalibrate."""
+    lookup = pi_energy_lookup(rmf_file)
+    pi = np.asarray(pi, dtype=np.int64)
+    return lookup.take(np.where((pi >= 0) & (pi < len(lookup) - 1), pi, len(lookup) - 1))
+
+
+def calib_filename(evt_file):
+    return os.path.splitext(evt_file)[0] + '_nicer_xti_ev_calib.nc'
+
+
+def calibrate_events(time, pi, gti, header, rmf_file):
+    """Calibrated stingray EventList from event arrays, with the metadata HENreadevents sets."""
+    from stingray.events import EventList
+    if 'MJDREFI' in header:
+        mjdref = header['MJDREFI'] + header.get('MJDREFF', 0)
+    else:
+        mjdref = header.get('MJDREF', 0)
+    events = EventList(time=np.asarray(time, dtype=np.float64), gti=np.asarray(gti, dtype=np.float64),
+                       pi=np.asarray(pi), energy=calibrate_pi(pi, rmf_file), mjdref=mjdref,
+                       mission=header.get('TELESCOP', 'NICER').lower(), instr=header.get('INSTRUME', 'XTI').lower())
+    events.header = header.tostring() if hasattr(header, 'tostring') else str(header)
+    events.timeref = header.get('TIMEREF', 'SOLARSYSTEM')
+    events.timesys = header.get('TIMESYS', 'TDB')
+    return events
+
+
+@instrumented()
+def calibrate_event_file(evt_file, rmf_file, out_file=None, events=None, gti=None):
+    """
+    Calibrate an event file (or in-memory events from band_split / event_filter) and save it
+    as a _nicer_xti_ev_calib.nc file.
+    Args:
+    - evt_file (str): Event FITS file, used for the data (unless events is given), the GTI and the header.
+    - rmf_file (str): RMF with the EBOUNDS table.
+    - out_file (str): Output file. Defaults to <evt_file without .evt>_nicer_xti_ev_calib.nc.
+    - events (array): Already selected event rows with TIME and PI, instead of reading evt_file.
+    - gti (array): GTI of the in-memory events. Defaults to the GTI of evt_file.
+
+    Returns:
+    - str: The output file.
+    """
+    from astropy.io import fits
+    from hendrics.io import save_events
+    out_file = out_file or calib_filename(evt_file)
+    with stage('fits_read'), fits.open(evt_file, memmap=True) as hdul:
+        header = hdul['EVENTS'].header.copy()
+        if events is None:
+            data = hdul['EVENTS'].data
+            time, pi = np.array(data['TIME']), np.array(data['PI'])
+        else:
+            time, pi = events['TIME'], events['PI']
+    if gti is None:
+        gti = read_gti(evt_file)
+
+    record(events=len(time))
+    save_events(calibrate_events(time, pi, gti, header, rmf_file), out_file)
+    print(f"Calibrated {os.path.basename(evt_file)} to {os.path.basename(out_file)}")
+    return out_file
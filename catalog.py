@@ -0,0 +1,225 @@
+# Persistent catalog of the data and derived files under DATAPATH.
+# Every file is indexed once, in an sqlite database next to timing_parameters.txt,
+# by observation ID, GTI folder, underonly/overonly thresholds, energy band and
+# processing stage, parsed from its name. A refresh only re-lists the directories
+# whose mtime changed (files added, removed or renamed, which includes the atomic
+# os.replace writes used throughout), and walks into the unchanged ones from the
+# stored directory tree, so on a networked disk it costs one stat per directory.
+# The scripts query the catalog instead of scanning directories with os.listdir;
+# from the shell, use `nicer.py catalog <data_path>`.
+import os
+import re
+import sqlite3
+
+CATALOG_FILE = "nicer_catalog.sqlite"
+
+# Processing stage of a file, from its name: the first matching pattern wins
+STAGE_PATTERNS = [
+    ('calibrated', re.compile(r"_nicer_xti_ev_calib\.nc$")),
+    ('events', re.compile(r"_ev\.nc$")),
+    ('cube', re.compile(r"_pi_phase_cube_bin\d+\.npz$")),
+    ('barycentred', re.compile(r"bary_scorr(_E\d+_\d+)?\.evt$")),
+    ('screened', re.compile(r"_cl_(uo|underonly)\d+_(oo|overonly)\d+.*\.evt$")),
+    ('cleaned', re.compile(r"_cl\.evt$")),
+    ('mkf', re.compile(r"\.mkf$")),
+    ('gti', re.compile(r"\.mkf_gti\d*$")),
+    ('rmf', re.compile(r"\.rmf$")),
+    ('plot', re.compile(r"\.(png|pdf)$")),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    obs_id TEXT,
+    gti TEXT,
+    uo INTEGER,
+    oo INTEGER,
+    e1 INTEGER,
+    e2 INTEGER,
+    stage TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS artifacts_obs ON artifacts (obs_id, gti, stage);
+CREATE INDEX IF NOT EXISTS artifacts_directory ON artifacts (directory);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+"""
+
+KEYS = ['obs_id', 'gti', 'uo', 'oo', 'e1', 'e2', 'stage']
+
+
+def parse_artifact(name, directory=''):
+    """
+    Catalog keys of a file from its name (and, for the GTI, its folder).
+    The legacy underonly/overonly spellings are recognized as uo/oo.
+    Returns:
+    - dict: obs_id, gti, uo, oo, e1, e2 (None when absent) and stage.
+    """
+    obs_match = re.search(r"ni(\d{10})", name) or re.search(r"(?:^|/)(\d{10})(?:/|$)", directory)
+    gti_match = re.search(r"_(GTI\d+)_", name) or re.search(r"(?:^|/)(GTI\d+)(?:/|$)", directory)
+    threshold_match = re.search(r"_(?:uo|underonly)(\d+)_(?:oo|overonly)(\d+)", name)
+    band_match = re.search(r"_E(\d+)_(\d+)", name)
+    stage = next((stage for stage, pattern in STAGE_PATTERNS if pattern.search(name)), 'other')
+    return {
+        'obs_id': obs_match.group(1) if obs_match else None,
+        'gti': gti_match.group(1) if gti_match else None,
+        'uo': int(threshold_match.group(1)) if threshold_match else None,
+        'oo': int(threshold_match.group(2)) if threshold_match else None,
+        'e1': int(band_match.group(1)) if band_match else None,
+        'e2': int(band_match.group(2)) if band_match else None,
+        'stage': stage,
+    }
+
+
+class Catalog:
+    def __init__(self, data_path, filename=None):
+        self.data_path = os.path.abspath(data_path)
+        self.filename = filename or os.path.join(self.data_path, CATALOG_FILE)
+        self.db = sqlite3.connect(self.filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ### Refresh
+
+    def _forget(self, directory):
+        # A directory that disappeared, with everything below it
+        below = directory.rstrip(os.sep) + os.sep
+        self.db.execute("DELETE FROM artifacts WHERE directory = ? OR substr(directory, 1, ?) = ?",
+                        (directory, len(below), below))
+        self.db.execute("DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?",
+                        (directory, len(below), below))
+
+    def _index_directory(self, directory, parent, mtime_ns):
+        subdirectories, rows = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name.startswith(CATALOG_FILE):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file():
+                    st = entry.stat()
+                    keys = parse_artifact(entry.name, directory)
+                    rows.append((entry.path, directory, entry.name, *(keys[key] for key in KEYS),
+                                 st.st_size, st.st_mtime_ns))
+        self.db.execute("DELETE FROM artifacts WHERE directory = ?", (directory,))
+        self.db.executemany(f"INSERT INTO artifacts (path, directory, name, {', '.join(KEYS)}, size, mtime_ns) "
+                            f"VALUES ({', '.join('?' * (len(KEYS) + 5))})", rows)
+        for known in self.subdirectories(directory):
+            if known not in subdirectories:
+                self._forget(known)
+        self.db.execute("INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                        (directory, parent, mtime_ns))
+        return subdirectories, len(rows)
+
+    def refresh(self, full=False):
+        """
+        Bring the catalog up to date with the files on disk.
+        Args:
+        - full (bool): Re-list every directory, not only those whose mtime changed.
+
+        Returns:
+        - tuple: (directories re-listed, files indexed in them)
+        """
+        stored = {row['path']: row['mtime_ns'] for row in self.db.execute("SELECT path, mtime_ns FROM directories")}
+        relisted = indexed = 0
+        pending = [(self.data_path, None)]
+        while pending:
+            directory, parent = pending.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                self._forget(directory)
+                continue
+            if not full and stored.get(directory) == mtime_ns:
+                subdirectories = self.subdirectories(directory)
+            else:
+                subdirectories, count = self._index_directory(directory, parent, mtime_ns)
+                relisted += 1
+                indexed += count
+            pending.extend((subdirectory, directory) for subdirectory in subdirectories)
+        self.db.commit()
+        return relisted, indexed
+
+    ### Queries
+
+    def subdirectories(self, directory, prefix=''):
+        rows = self.db.execute("SELECT path FROM directories WHERE parent = ? ORDER BY path", (directory,))
+        return [row['path'] for row in rows if os.path.basename(row['path']).startswith(prefix)]
+
+    def find(self, directory=None, name_like=None, **keys):
+        """
+        Files matching the given keys, sorted by path.
+        A key that is not given matches anything, a key given as None matches only files
+        without it (e.g. e1=None for the full energy files, gti=None outside the GTI folders).
+        Args:
+        - directory (str): Only files directly in this directory.
+        - name_like (str): SQL LIKE pattern on the file name.
+        - keys: Any of obs_id, gti, uo, oo, e1, e2 and stage.
+
+        Returns:
+        - list: sqlite3.Row with path, directory, name, the keys, size and mtime_ns.
+        """
+        unknown = set(keys) - set(KEYS)
+        if unknown:
+            raise ValueError(f"Unknown catalog keys: {sorted(unknown)}")
+        conditions, values = [], []
+        if directory is not None:
+            keys['directory'] = os.path.abspath(directory)
+        if name_like is not None:
+            conditions.append("name LIKE ?")
+            values.append(name_like)
+        for key, value in keys.items():
+            if value is None:
+                conditions.append(f"{key} IS NULL")
+            else:
+                conditions.append(f"{key} = ?")
+                values.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.db.execute(f"SELECT * FROM artifacts{where} ORDER BY path", values).fetchall()
+
+    def paths(self, directory=None, **keys):
+        return [row['path'] for row in self.find(directory, **keys)]
+
+    def bands(self, directory=None, **keys):
+        """Distinct (e1, e2) energy bands of the matching files."""
+        return sorted({(row['e1'], row['e2']) for row in self.find(directory, **keys) if row['e1'] is not None})
+
+    ### Updates
+
+    def rename(self, path, new_path):
+        """Rename a cataloged file on disk and in the catalog, with its keys parsed again."""
+        os.rename(path, new_path)
+        directory, name = os.path.split(new_path)
+        keys = parse_artifact(name, directory)
+        self.db.execute(f"UPDATE artifacts SET path = ?, directory = ?, name = ?, "
+                        f"{', '.join(f'{key} = ?' for key in KEYS)} WHERE path = ?",
+                        (new_path, directory, name, *(keys[key] for key in KEYS), path))
+
+    def commit(self):
+        self.db.commit()
+
+
+def open_catalog(data_path, refresh=True):
+    """The catalog of data_path, brought up to date unless refresh is False."""
+    catalog = Catalog(data_path)
+    if refresh:
+        catalog.refresh()
+    return catalog
+
@@ -0,0 +1,125 @@
+# 2-D (PI x phase) histogram of the calibrated events, folded once and stored
+# with a cumulative sum along the PI axis. The pulse profile of any energy band
+# is then a difference of two rows of the prefix sums, so new band choices do
+# not need another extraction, calibration or fold.
+import os
+import numpy as np
+
+from instrumentation import instrumented, stage, record
+
+# NICER XTI PI channels run from 0 to 1500 (10 eV each)
+N_PI = 1501
+
+
+def pulse_phase(times, fr, frdot, tstart):
+    # Same phase convention as stingray's fold_events(times, fr, frdot, ref_time=tstart)
+    dt = np.asarray(times, dtype=np.float64) - tstart
+    phase = dt * fr + 0.5 * frdot * dt ** 2
+    return phase - np.floor(phase)
+
+
+class EnergyPhaseCube:
+    def __init__(self, cumulative, fr, frdot, tstart, orbit=()):
+        # cumulative[i] holds the summed profile of all PI channels below i
+        self.cumulative = cumulative
+        self.fr = fr
+        self.frdot = frdot
+        self.tstart = tstart
+        # Parameters of the binary orbit removed from the event times before folding, () if none
+        self.orbit = tuple(orbit)
+
+    @property
+    def nbin(self):
+        return self.cumulative.shape[1]
+
+    @property
+    def phase(self):
+        # Bin centres, as returned by fold_events
+        return (np.arange(self.nbin) + 0.5) / self.nbin
+
+    @classmethod
+    @instrumented('fold_events')
+    def from_events(cls, times, pi, fr, frdot, tstart, nbin):
+        """Fold the events once and histogram them in PI and phase."""
+        record(events=len(times))
+        phase_bin = np.minimum((pulse_phase(times, fr, frdot, tstart) * nbin).astype(np.int64), nbin - 1)
+        pi = np.clip(np.asarray(pi, dtype=np.int64), 0, N_PI - 1)
+        cube = np.bincount(pi * nbin + phase_bin, minlength=N_PI * nbin).reshape(N_PI, nbin)
+
+        cumulative = np.zeros((N_PI + 1, nbin), dtype=np.int64)
+        np.cumsum(cube, axis=0, out=cumulative[1:])
+        return cls(cumulative, fr, frdot, tstart)
+
+    def profile(self, pi_start=0, pi_end=N_PI - 1):
+        """
+        Pulse profile and Poisson errors of the PI channels pi_start to pi_end (inclusive).
+        Returns:
+        - tuple: (phase, profile, profile_err), in the same form as fold_events.
+        """
+        pi_start = int(np.clip(pi_start, 0, N_PI))
+        pi_end = int(np.clip(pi_end + 1, pi_start, N_PI))
+        counts = (self.cumulative[pi_end] - self.cumulative[pi_start]).astype(np.float64)
+        return self.phase, counts, np.sqrt(counts)
+
+    def band_profile(self, e1, e2):
+        # Bands in units of 0.1 keV, selected the same way as the _E{e1}_{e2}.evt files
+        return self.profile(e1 * 10, e2 * 10)
+
+    def band_profiles(self, bands):
+        """
+        Profiles of many bands at once, as band_profile for each (e1, e2).
+        Returns:
+        - array: (nbands, nbin) counts.
+        """
+        bands = np.asarray(bands, dtype=np.int64).reshape(-1, 2)
+        pi_start = np.clip(bands[:, 0] * 10, 0, N_PI)
+        pi_end = np.clip(bands[:, 1] * 10 + 1, pi_start, N_PI)
+        return (self.cumulative[pi_end] - self.cumulative[pi_start]).astype(np.float64)
+
+    def save(self, filename):
+        np.savez_compressed(filename, cumulative=self.cumulative, fr=self.fr, frdot=self.frdot, tstart=self.tstart,
+                            orbit=np.array(self.orbit, dtype=np.float64))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            # Cubes saved before the orbit was recorded were folded without one
+            orbit = tuple(data['orbit'].tolist()) if 'orbit' in data.files else ()
+            return cls(data['cumulative'], float(data['fr']), float(data['frdot']), float(data['tstart']), orbit)
+
+    def matches(self, fr, frdot, tstart, nbin, orbit=()):
+        return self.nbin == nbin and (self.fr, self.frdot, self.tstart, self.orbit) == (fr, frdot, tstart, tuple(orbit))
+
+
+def cube_filename(calib_file, nbin):
+    return calib_file.replace('_nicer_xti_ev_calib.nc', '') + f"_pi_phase_cube_bin{nbin}.npz"
+
+
+def load_energy_phase_cube(calib_file, fr, frdot, tstart, nbin, orbit=None):
+    """
+    Energy-phase cube of a calibrated event file, cached next to it.
+    With orbit (a binary_orbit.BinaryOrbit), the orbital delay is removed from the event times
+    before folding, for files barycentred without the orbit correction.
+    The cache is rebuilt if the ephemeris, the orbit or the number of bins changed,
+    or if the event file is newer than the cache.
+    """
+    orbit_parameters = orbit.parameters() if orbit is not None else ()
+    cache_file = cube_filename(calib_file, nbin)
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(calib_file):
+        cube = EnergyPhaseCube.load(cache_file)
+        if cube.matches(fr, frdot, tstart, nbin, orbit_parameters):
+            return cube
+
+    from hendrics.io import load_events
+    with stage('load_events'):
+        events = load_events(calib_file)
+        record(events=len(events.time))
+    times = events.time
+    if orbit is not None:
+        with stage('demodulate'):
+            times = orbit.demodulate(times, events.mjdref)
+    cube = EnergyPhaseCube.from_events(times, events.pi, fr, frdot, tstart, nbin)
+    cube.orbit = orbit_parameters
+    cube.save(cache_file)
+    print(f"Saved energy-phase cube to {cache_file}")
+    return cube
@@ -3,20 +3,24 @@
 # Global paths are used to find other required files and the variables needed 
 # to be changed should be clear below
 import os
-import subprocess
-import shutil
 import re
 import numpy as np
 from ni_utilities import observationalID, load_timing_parameters
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FormatStrFormatter
-from hendrics.io import load_events
-from stingray.pulse.pulsar import fold_events
+from catalog import open_catalog
+from band_split import split_event_file
+from artifact_cache import ArtifactCache
+from calibrate import calibrate_event_file, calib_filename
+from energy_phase_cube import load_energy_phase_cube
+from instrumentation import instrumented, stage
+from pp_render import profile_plot_data, render_profiles, render_stacked
 
 DATAPATH = '/Users/hongyuzhang/Documents/data/her_x-1/2022_data'
 #Used for equal energy intervals, if set to 0, custum intervals will be used
 INTERVAL = 0 
 CUSTOM_INTERVALS = [5,8,14,100] #I belive these are in the units of 0.1 keV so [a,b,c] will be from 0.1 * a to 0.1 * b keV and 0.1 * b keV to 0.1 * c keV
+#Adaptive band edges instead of the intervals above: ('counts', n) for n bands of equal counts or
+#('snr', s) for bands reaching a pulsed S/N of s each (see adaptive_binning.py), None to keep the intervals
+ADAPTIVE_BINNING = None
 RMF_FILE = "nixtiref20170601v003.rmf"
 RMF_DIR = '/Users/hongyuzhang/Documents/soft/caldb/data/nicer/xti/cpf/rmf'
 PULSE_PROFILE_DIR = "pulse_profiles"
@@ -24,53 +28,35 @@ PBIN = 128
 
 
 
-def create_xspec_script(analysis_dir, base_filename, start, end, interval):
-    script_path = os.path.join(analysis_dir, "process_all.xcm")
-    
-    with open(script_path, "w") as f:        
-        # Write the initial commands to load the data
-        f.write("xsel1\n")
-        f.write(f"read events {base_filename}.evt\n")
-        f.write(".\n")
-        f.write("yes\n")
-        
-        if INTERVAL == 0:  # Use custom intervals
-            for i in range(len(CUSTOM_INTERVALS) - 1):
-                pi_start = CUSTOM_INTERVALS[i] * 10
-                pi_end = CUSTOM_INTERVALS[i + 1] * 10
-                new_file = f"{base_filename}_E{CUSTOM_INTERVALS[i]}_{CUSTOM_INTERVALS[i + 1]}.evt"
-                f.write(f'filter column "PI={pi_start}:{pi_end}"\n')
-                f.write("extract events\n")
-                f.write(f"save events {new_file}\n")
-                f.write("no\n")
-                f.write("clear all\n")
-                f.write("yes\n")
-                f.write(f"read events {base_filename}.evt\n")
-                f.write(".\n")
-        else:  # Use equal intervals
-            # Loop over the PI range to filter and save new event files
-            for i in range(start, end + 1, interval):
-                pi_start = i * 10
-                pi_end = (i + interval) * 10
-                new_file = f"{base_filename}_E{i}_{i+interval}.evt"
-                
-                # Filter by the PI range, extract, and save the events
-                f.write(f'filter column "PI={pi_start}:{pi_end}"\n')
-                f.write("extract events\n")
-                f.write(f"save events {new_file}\n")
-                f.write("no\n")  # Respond 'no' to the prompt asking to use filtered events as input
-                
-                # Clear all selections and reload the original events file to start fresh
-                f.write("clear all\n")
-                f.write("yes\n")  # Confirm to clear all data
-                f.write(f"read events {base_filename}.evt\n")
-                f.write(".\n")  # No need for 'yes' after the first time
-
-        # Write the commands to exit xselect
-        f.write("quit\n")
-        f.write("no\n")
-    
-    print(f"Created XSPEC script at: {script_path}")
+def energy_bands(start, end, interval):
+    # Bands of the split event files (band_split.split_event_file), in units of 0.1 keV
+    if interval == 0:
+        return [(CUSTOM_INTERVALS[i], CUSTOM_INTERVALS[i + 1]) for i in range(len(CUSTOM_INTERVALS) - 1)]
+    return [(i, i + interval) for i in range(start, end + 1, interval)]
+
+def adaptive_energy_list(evt_file, mode, value, fr=None, frdot=None, tstart=None, pbin=PBIN, rmf_file=RMF_FILE):
+    # Band edges from the counts (PI column of the event file) or from the pulsed S/N
+    # (energy-phase cube of its calibrated file), without any band extraction
+    from adaptive_binning import adaptive_edges
+    if mode == 'counts':
+        from astropy.io import fits
+        with stage('fits_read'), fits.open(evt_file, memmap=True) as hdul:
+            pi = np.asarray(hdul['EVENTS'].data['PI'])
+        edges = adaptive_edges(mode, value, pi=pi)
+    else:
+        calibrate_cached(evt_file, rmf_file)
+        cube = load_energy_phase_cube(calib_filename(evt_file), fr, frdot, tstart, pbin)
+        edges = adaptive_edges(mode, value, cube=cube)
+    print(f"Adaptive band edges ({mode} {value}, in 0.1 keV): {edges}")
+    return edges
+
+def calibrate_cached(evt_file_path, rmf_file, cache=None):
+    # In-process PI -> energy calibration of one event file, behind the content-addressed cache:
+    # the product is reused only if the event file and the RMF are unchanged
+    cache = cache or ArtifactCache()
+    calib_file_path = calib_filename(evt_file_path)
+    cache.run('calibrate_event_file', [], [evt_file_path, rmf_file], calib_file_path,
+              lambda: calibrate_event_file(evt_file_path, rmf_file, calib_file_path))
 
 def process_energy_resolved_files(base_filename, analysis_dir, rmf_file):
     # Regular expression to match files and extract energy intervals
@@ -80,84 +66,72 @@ def process_energy_resolved_files(base_filename, analysis_dir, rmf_file):
     evt_files = [f for f in os.listdir(analysis_dir) if pattern.match(f)]
 
     print(evt_files)
-    
+
+    cache = ArtifactCache()
     for evt_file in evt_files:
-        # Extract the energy intervals from the filename
-        match = pattern.search(evt_file)
-        if match:
-            start_energy, end_energy = match.groups()
-
-            nicer_xti_file = f'{base_filename}_E{start_energy}_{end_energy}_nicer_xti_ev.nc'
-            calib_file = f'{base_filename}_E{start_energy}_{end_energy}_nicer_xti_ev_calib.nc'
-            full_evt_file_path = os.path.join(analysis_dir, evt_file)
-            full_nicer_xti_file_path = os.path.join(analysis_dir, nicer_xti_file)
-            full_calib_file_path = os.path.join(analysis_dir, calib_file)
-
-            # Check if the NICER XTI file is already there
-            if not os.path.exists(full_nicer_xti_file_path):
-                command1 = f'HENreadevents {full_evt_file_path}'
-                subprocess.run(command1, shell=True)
-                print(f"Processed {evt_file} to {nicer_xti_file}")
-            else:
-                print(f"{nicer_xti_file} already exists, skipping HENreadevents.")
-
-            # Check if the calibrated file is already there
-            if not os.path.exists(full_calib_file_path):
-                command2 = f'HENcalibrate {full_nicer_xti_file_path} -r {rmf_file}'
-                subprocess.run(command2, shell=True)
-                print(f"Calibrated {nicer_xti_file} to {calib_file}")
-            else:
-                print(f"{calib_file} already exists, skipping HENcalibrate.")
-
-def plot_energy_resolved_pulse_profiles(analysis_dir, base_filename, pbin, fr, frdot, tstart):
+        calibrate_cached(os.path.join(analysis_dir, evt_file), rmf_file, cache)
+
+@instrumented()
+def plot_energy_resolved_pulse_profiles(analysis_dir, base_filename, pbin, fr, frdot, tstart, cube=None, energy_list=None,
+                                        nproc=1, stacked=False):
     pulse_profile_path = os.path.join(analysis_dir, PULSE_PROFILE_DIR)
     if not os.path.exists(pulse_profile_path):
         os.makedirs(pulse_profile_path)
 
+    # All band profiles come from one fold of the full energy file
     full_energy_file = os.path.join(analysis_dir, f"{base_filename}_nicer_xti_ev_calib.nc")
-    try:
-        full_energy_events = load_events(full_energy_file)
-        _, full_profile, _ = fold_events(full_energy_events.time, fr, frdot, ref_time=tstart, nbin=pbin)
-        full_min_index = np.argmin(full_profile)
-        full_shift = (pbin // 10) - full_min_index
-    except FileNotFoundError:
-        print(f"File not found: {full_energy_file}")
-        return  # If the full energy file isn't found, exit the function
+    if cube is None:
+        try:
+            cube = load_energy_phase_cube(full_energy_file, fr, frdot, tstart, pbin)
+        except FileNotFoundError:
+            print(f"File not found: {full_energy_file}")
+            return  # If the full energy file isn't found, exit the function
+
+    _, full_profile, _ = cube.profile()
+    full_min_index = np.argmin(full_profile)
+    full_shift = (pbin // 10) - full_min_index
 
-    energy_list = CUSTOM_INTERVALS if INTERVAL == 0 else range(5, 100, INTERVAL)
+    if energy_list is None:
+        energy_list = CUSTOM_INTERVALS if INTERVAL == 0 else range(5, 100, INTERVAL)
 
+    items = []
     for i in range(len(energy_list) - 1):
         e1 = energy_list[i]
         e2 = energy_list[i + 1]
         label_name = f"{e1}-{e2}keV"
-        f_name = f"{base_filename}_E{e1}_{e2}_nicer_xti_ev_calib.nc"
-        full_path = os.path.join(analysis_dir, f_name)
 
-        try:
-            nicer_events = load_events(full_path)
-            ph, profile, profile_err = fold_events(nicer_events.time, fr, frdot, ref_time=tstart, nbin=pbin)
-            mean_rate = np.mean(profile)
-            profile /= mean_rate
-            profile_err /= mean_rate
-            profile_shifted = np.roll(profile, full_shift)
-            profile_err_shifted = np.roll(profile_err, full_shift)
-            profile_extended = np.tile(profile_shifted, 3)
-            profile_err_extended = np.tile(profile_err_shifted, 3)
-
-            plt.figure(figsize=(10, 5))
-            plt.errorbar(np.arange(len(profile_extended)) / pbin, profile_extended, profile_err_extended, color='blue', drawstyle='steps-mid', label=label_name)
-            plt.xlabel("Phase", fontsize=16)
-            plt.ylabel("Normalized Count Rate (cts/s)", fontsize=16)
-            plt.title(f"Her X-1, {base_filename}, Energy: {label_name}", fontsize=16)
-            plt.legend(loc="upper right")
-            plt.tick_params(labelsize=16)
-            plt.gca().yaxis.set_major_formatter(FormatStrFormatter('%.2f'))  # This line sets the y-axis labels to 2 decimal places
-            plt.xlim([0, 2])
-            plt.tight_layout(pad=0.5)
-            plt.savefig(os.path.join(pulse_profile_path, f"herx1_nicer_pp_en_{label_name}.png"))
-            plt.close()
-        except FileNotFoundError:
-            print(f"File not found: {full_path}")
+        _, profile, profile_err = cube.band_profile(e1, e2)
+        if np.mean(profile) == 0:
+            print(f"No events in the {label_name} band, skipping.")
+            continue
+        profile_extended, profile_err_extended = profile_plot_data(profile, profile_err, full_shift)
+        items.append((profile_extended, profile_err_extended, label_name,
+                      f"Her X-1, {base_filename}, Energy: {label_name}",
+                      os.path.join(pulse_profile_path, f"herx1_nicer_pp_en_{label_name}.png")))
+
+    # One reused headless figure per worker; optionally all bands in one stacked figure as well
+    render_profiles(items, pbin, nproc=nproc)
+    if stacked and items:
+        render_stacked(items, pbin, f"Her X-1, {base_filename}",
+                       os.path.join(pulse_profile_path, f"herx1_nicer_pp_stacked_E{'-'.join(map(str, energy_list))}.png"))
+
+
+def energy_resolved_lags(analysis_dir, base_filename, pbin, fr, frdot, tstart, energy_list=None, nharm=3, show=False):
+    """Phase lags and harmonic spectra of the bands against the full energy profile, as a table and a plot."""
+    from phase_lags import energy_lags, write_lag_table, plot_phase_lags
+    if energy_list is None:
+        energy_list = CUSTOM_INTERVALS if INTERVAL == 0 else range(5, 100, INTERVAL)
+    full_energy_file = os.path.join(analysis_dir, f"{base_filename}_nicer_xti_ev_calib.nc")
+    cube = load_energy_phase_cube(full_energy_file, fr, frdot, tstart, pbin)
+    bands, result = energy_lags(cube, list(energy_list), nharm)
+
+    pulse_profile_path = os.path.join(analysis_dir, PULSE_PROFILE_DIR)
+    os.makedirs(pulse_profile_path, exist_ok=True)
+    name = os.path.join(pulse_profile_path, f"herx1_nicer_lags_E{'-'.join(map(str, energy_list))}")
+    write_lag_table(name + ".csv", bands, result)
+    plot_phase_lags(bands, result, title=f"Her X-1, {base_filename}", savefile=name + ".pdf", show=show)
+    print(f"Phase lags written to {name}.csv and {name}.pdf")
+    return bands, result
 
 
 def main():
@@ -168,8 +142,11 @@ def main():
     analysis_dir = os.path.join(xtidir, 'analysis')
     
 
+    # GTI folders and event files come from the catalog of the data directory, not from listing directories
+    catalog = open_catalog(nicerdir)
+
     # List all GTI folders and ask the user to select one
-    gti_folders = [f for f in os.listdir(analysis_dir) if f.startswith("GTI")]
+    gti_folders = [os.path.basename(f) for f in catalog.subdirectories(analysis_dir, prefix="GTI")]
 
     # If GTI folders are found, let the user choose one
     if gti_folders:
@@ -182,15 +159,15 @@ def main():
             gti_folder = gti_folders[gti_choice]
             analysis_dir = os.path.join(analysis_dir, gti_folder)
             gti_number = re.search(r'GTI(\d+)', gti_folder).group(1)  # Extracting the number from the folder name
-            gti_pattern = f"_GTI{gti_number}_"
+            gti_key = f"GTI{gti_number}"
             obs_id_gti = f"{obsID}_GTI{gti_number}"
         else:
             print("Invalid GTI folder selection. Proceeding with the default analysis directory.")
-            gti_pattern = "_"
+            gti_key = None
             obs_id_gti = obsID  # Use the obsID alone if GTI is not applicable
     else:
         print("No GTI folders found. Proceeding with the default analysis directory.")
-        gti_pattern = "_"
+        gti_key = None
         obs_id_gti = obsID
 
 
@@ -205,20 +182,17 @@ def main():
         return  # Exit if parameters are not found
 
 
-    # Adjust the event file pattern based on whether a GTI folder is selected
-    evt_pattern = rf'ni\d+_0mpu7_cl_uo\d+_oo\d+{gti_pattern}bary_scorr\.evt'
-
-    # Find the actual event files matching the adjusted pattern
-    evt_files = [f for f in os.listdir(analysis_dir) if re.search(evt_pattern, f)]
+    # Full energy barycentred event files of the selected GTI (or of no GTI), with their uo/oo thresholds
+    evt_files = catalog.find(analysis_dir, obs_id=obsID, gti=gti_key, stage='barycentred', e1=None)
+    catalog.close()
     if not evt_files:
         raise FileNotFoundError("No event file found matching the pattern.")
     
     # Assume the first matching file is the file to use
     actual_evt_file = evt_files[0]
-    match = re.search(r"uo(\d+)_oo(\d+)", actual_evt_file)
-    if match:
-        underonly_num = match.group(1)
-        overonly_num = match.group(2)
+    if actual_evt_file['uo'] is not None:
+        underonly_num = actual_evt_file['uo']
+        overonly_num = actual_evt_file['oo']
         if gti_folders: 
             base_filename = f"ni{obsID}_0mpu7_cl_uo{underonly_num}_oo{overonly_num}_{gti_folder}_bary_scorr"
         else: 
@@ -227,7 +201,11 @@ def main():
         raise ValueError("Filename pattern does not match expected format.")
     
     # Decision point to call specific functions based on whether custom ranges are used
-    if INTERVAL == 0:
+    if ADAPTIVE_BINNING:
+        mode, value = ADAPTIVE_BINNING
+        energy_resolved_analysis_dir = os.path.join(analysis_dir, f"energy_resolved_pp_{mode}{value}_bin{PBIN}")
+
+    elif INTERVAL == 0:
         # Call functions to handle custom energy ranges
         custom_folder_name = f"energy_resolved_pp_E{'-'.join(map(str, CUSTOM_INTERVALS))}_bin{PBIN}"
         energy_resolved_analysis_dir = os.path.join(analysis_dir, custom_folder_name)
@@ -241,65 +219,58 @@ def main():
     if not os.path.exists(energy_resolved_analysis_dir):
         os.makedirs(energy_resolved_analysis_dir)
 
-    # Copy the base event file and the RMF file to the analysis directory
-    shutil.copy(os.path.join(analysis_dir, f"{base_filename}.evt"), energy_resolved_analysis_dir)
-    shutil.copy(os.path.join(RMF_DIR, RMF_FILE), energy_resolved_analysis_dir)
-
-    # Ask user if they want to generate the XSPEC script
-    generate_script = input("Do you want to generate the XSPEC script now? [yes/no]: ").strip().lower()
-    if generate_script == 'yes':
-        create_xspec_script(energy_resolved_analysis_dir, base_filename, 5, 100, INTERVAL)
-    else:
-        print("XSPEC script generation skipped.")
-
-    # Ask user if they want to execute the XSPEC script
-    execute_script = input("Do you want to execute the XSPEC script now? [yes/no]: ").strip().lower()
-    if execute_script == 'yes':
-        os.chdir(energy_resolved_analysis_dir)  # Change to the correct directory
-        command = f"xselect @process_all.xcm"
-        subprocess.run(command, shell=True)
-        print("XSPEC script executed successfully.")
+    # Link the base event file and the RMF file into the analysis directory through the cache
+    cache = ArtifactCache()
+    cache.copy(os.path.join(analysis_dir, f"{base_filename}.evt"), energy_resolved_analysis_dir)
+    cache.copy(os.path.join(RMF_DIR, RMF_FILE), energy_resolved_analysis_dir)
+
+    # Adaptive band edges come straight from the base event file (or its energy-phase cube)
+    energy_list = None
+    if ADAPTIVE_BINNING:
+        energy_list = adaptive_energy_list(os.path.join(energy_resolved_analysis_dir, f"{base_filename}.evt"),
+                                           *ADAPTIVE_BINNING, fr, frdot, tstart, PBIN,
+                                           os.path.join(energy_resolved_analysis_dir, RMF_FILE))
+    bands = energy_bands(5, 100, INTERVAL) if energy_list is None else list(zip(energy_list[:-1], energy_list[1:]))
+
+    # Ask user if they want to split the event file into energy bands
+    split_bands = input("Do you want to split the event file into energy bands now? [yes/no]: ").strip().lower()
+    if split_bands == 'yes':
+        # Single pass over the base event file, replaces the xselect script
+        split_event_file(os.path.join(energy_resolved_analysis_dir, f"{base_filename}.evt"),
+                         bands, out_dir=energy_resolved_analysis_dir,
+                         base_filename=base_filename)
     else:
-        os.chdir(energy_resolved_analysis_dir)  # Change to the correct directory
-        print(f"Now at: {energy_resolved_analysis_dir}")
+        print("Energy band splitting skipped.")
 
-    # Ask user if they want to calibrate using HENDRICS
-    HENDRICS = input("Do you want to use HENDRICS to calibrate? [yes/no]: ").strip().lower()
-    if HENDRICS == 'yes':
-        # First calibrate the full energy event file
-        full_energy_evt_file = f"{base_filename}.evt"
-        full_energy_nicer_xti_file = f"{base_filename}_nicer_xti_ev.nc"
-        full_energy_calib_file = f"{base_filename}_nicer_xti_ev_calib.nc"
-        
-        # Check if the NICER XTI file is already there
-        if not os.path.exists(full_energy_nicer_xti_file):
-            command1_full = f'HENreadevents {full_energy_evt_file}'
-            subprocess.run(command1_full, shell=True)
-            print(f"Processed {full_energy_evt_file} to {full_energy_nicer_xti_file}")
-        else:
-            print(f"{full_energy_nicer_xti_file} already exists, skipping HENreadevents.")
+    os.chdir(energy_resolved_analysis_dir)  # Change to the correct directory
+    print(f"Now at: {energy_resolved_analysis_dir}")
 
-        # Check if the calibrated file is already there
-        if not os.path.exists(full_energy_calib_file):
-            command2_full = f'HENcalibrate {full_energy_nicer_xti_file} -r {RMF_FILE}'
-            subprocess.run(command2_full, shell=True)
-            print(f"Calibrated {full_energy_nicer_xti_file} to {full_energy_calib_file}")
-        else:
-            print(f"{full_energy_calib_file} already exists, skipping HENcalibrate.")
+    # Ask user if they want to calibrate (in-process, same output as HENreadevents + HENcalibrate)
+    calibrate = input("Do you want to calibrate the event files? [yes/no]: ").strip().lower()
+    if calibrate == 'yes':
+        # First calibrate the full energy event file
+        calibrate_cached(os.path.join(energy_resolved_analysis_dir, f"{base_filename}.evt"), RMF_FILE, cache)
 
         # Then proceed with energy-resolved calibration
         process_energy_resolved_files(base_filename, energy_resolved_analysis_dir, RMF_FILE)
     else:
-        print("HENDRICS not executed")
+        print("Calibration not executed")
 
 
 
     # Ask user if they want to plot pulse profile
     plot_pp = input("Do you want to plot pulse profiles now? [yes/no]: ").strip().lower()
     if plot_pp == 'yes':
-        plot_energy_resolved_pulse_profiles(energy_resolved_analysis_dir, base_filename, PBIN, fr, frdot, tstart)
+        stacked = input("Also plot all bands in one stacked figure? [yes/no] (default: no): ").strip().lower() == 'yes'
+        plot_energy_resolved_pulse_profiles(energy_resolved_analysis_dir, base_filename, PBIN, fr, frdot, tstart,
+                                            energy_list=energy_list, nproc=None, stacked=stacked)
     else:
         print("PP not plotted")
 
+    # Ask user if they want the energy-dependent phase lags
+    lags = input("Do you want to compute the energy-dependent phase lags? [yes/no]: ").strip().lower()
+    if lags == 'yes':
+        energy_resolved_lags(energy_resolved_analysis_dir, base_filename, PBIN, fr, frdot, tstart, energy_list, show=True)
+
 if __name__ == "__main__":
     main()
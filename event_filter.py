@@ -0,0 +1,155 @@
+# In-process, chunked replacement for the niextract-events step of pipeline.py:
+#   niextract-events filename='evt[PI=30:1200,EVENT_FLAGS=bxxx1x000]' timefile=mkf_gti1 gti=GTI
+# The event table is memory-mapped as raw FITS rows and streamed in fixed-size
+# chunks; the PI range, the EVENT_FLAGS bitmask and the GTI mask (searchsorted
+# on the sorted GTI edges) are applied as vectorized operations and the selected
+# rows are copied byte for byte to the output, so memory stays flat no matter
+# how large the event file is.
+import os
+import numpy as np
+
+from gti import read_gti, union, intersection, gti_mask, exposure
+from instrumentation import instrumented, record
+
+CHUNK_ROWS = 1_000_000
+
+
+def parse_bitmask(pattern):
+    """
+    (mask, value) of an FTOOLS bit pattern such as 'bxxx1x000' (most significant bit first):
+    rows pass if flags & mask == value.
+    """
+    bits = pattern[1:] if pattern.startswith('b') else pattern
+    mask = value = 0
+    for bit in bits:
+        mask <<= 1
+        value <<= 1
+        if bit in '01':
+            mask |= 1
+            value |= int(bit)
+        elif bit not in 'xX':
+            raise ValueError(f"Invalid bit pattern: {pattern}")
+    return mask, value
+
+
+def _flags_as_int(flags):
+    # X (bit) columns come as raw bytes, most significant bit first
+    flags = np.asarray(flags)
+    if flags.ndim == 1:
+        return flags.astype(np.int64)
+    value = np.zeros(len(flags), dtype=np.int64)
+    for byte in range(flags.shape[1]):
+        value = (value << 8) | flags[:, byte]
+    return value
+
+
+def _column(rows, column):
+    values = rows[column.name]
+    if column.bscale not in (None, 1) or column.bzero not in (None, 0):
+        values = values * (column.bscale or 1) + (column.bzero or 0)
+    return values
+
+
+def _clean_header(header):
+    header = header.copy()
+    for keyword in ('CHECKSUM', 'DATASUM'):
+        header.remove(keyword, ignore_missing=True)
+    return header
+
+
+@instrumented()
+def filter_events(evt_file, out_file=None, pi_range=(30, 1200), event_flags='bxxx1x000', timefile=None, gti=None,
+                  chunk_rows=CHUNK_ROWS, return_events=False):
+    """
+    Filter an event file on PI, EVENT_FLAGS and GTI, streaming it in chunks.
+    Args:
+    - evt_file (str): Input event file.
+    - out_file (str): Filtered event file to write (None to skip writing).
+    - pi_range (tuple): Inclusive PI range, as in [PI=30:1200]. None to skip.
+    - event_flags (str): EVENT_FLAGS bit pattern. None to skip.
+    - timefile (str): GTI file (e.g. the nimaketime .mkf_gti1) intersected with the event file GTI.
+    - gti (array): Extra (n, 2) GTI to intersect with.
+    - chunk_rows (int): Rows per chunk.
+    - return_events (bool): Also return the selected rows in memory.
+
+    Returns:
+    - tuple: (selected rows as a structured array or None, final GTI)
+    """
+    from astropy.io import fits
+    # Raw GTI extensions need not be sorted or disjoint, which gti_mask relies on
+    final_gti = union(read_gti(evt_file))
+    if timefile is not None:
+        final_gti = intersection(final_gti, read_gti(timefile, extname=None))
+    if gti is not None:
+        final_gti = intersection(final_gti, gti)
+    flag_mask, flag_value = parse_bitmask(event_flags) if event_flags else (0, 0)
+
+    with fits.open(evt_file, memmap=True) as hdul:
+        events_index = hdul.index_of('EVENTS')
+        events_hdu = hdul[events_index]
+        columns = events_hdu.columns
+        nrows = events_hdu.header['NAXIS2']
+        # Raw FITS rows, memory-mapped: selected rows are written out byte for byte
+        raw_dtype = columns.dtype.newbyteorder('>')
+        raw = np.memmap(evt_file, dtype=raw_dtype, mode='r', offset=events_hdu.fileinfo()['datLoc'], shape=(nrows,))
+
+        out = None
+        if out_file is not None:
+            header = _clean_header(events_hdu.header)
+            header['HISTORY'] = (f"Filtered by event_filter: PI={pi_range}, EVENT_FLAGS={event_flags}, "
+                                 f"timefile={os.path.basename(timefile) if timefile else None}")
+            fits.HDUList([fits.PrimaryHDU(header=_clean_header(hdul[0].header))]).writeto(out_file, overwrite=True)
+            out = open(out_file, 'r+b')
+            out.seek(0, os.SEEK_END)
+            header_offset = out.tell()
+            out.write(header.tostring().encode('ascii'))
+
+        selected = []
+        nselected = 0
+        try:
+            for start in range(0, nrows, chunk_rows):
+                rows = raw[start:start + chunk_rows]
+                keep = gti_mask(_column(rows, columns['TIME']), final_gti)
+                if pi_range is not None:
+                    pi = _column(rows, columns['PI'])
+                    keep &= (pi >= pi_range[0]) & (pi <= pi_range[1])
+                if flag_mask:
+                    keep &= (_flags_as_int(rows['EVENT_FLAGS']) & flag_mask) == flag_value
+                kept = rows[keep]
+                nselected += len(kept)
+                if out is not None:
+                    out.write(kept.tobytes())
+                if return_events:
+                    selected.append(np.array(kept))
+
+            if out is not None:
+                # Pad the data to a whole FITS block and fix NAXIS2 in place (same header length)
+                data_bytes = nselected * raw_dtype.itemsize
+                out.write(b'\0' * (-data_bytes % 2880))
+                header['NAXIS2'] = nselected
+                out.seek(header_offset)
+                out.write(header.tostring().encode('ascii'))
+                out.close()
+                out = None
+
+                # Updated GTI extension, then every other extension of the input
+                gti_hdu = fits.BinTableHDU.from_columns(
+                    [fits.Column('START', 'D', unit='s', array=final_gti[:, 0]),
+                     fits.Column('STOP', 'D', unit='s', array=final_gti[:, 1])], name='GTI')
+                for keyword in ('MJDREFI', 'MJDREFF', 'TIMESYS', 'TIMEREF', 'TIMEUNIT', 'TELESCOP', 'INSTRUME'):
+                    if keyword in events_hdu.header:
+                        gti_hdu.header[keyword] = events_hdu.header[keyword]
+                fits.append(out_file, gti_hdu.data, gti_hdu.header)
+                for i, hdu in enumerate(hdul):
+                    if i not in (0, events_index) and hdu.name != 'GTI':
+                        fits.append(out_file, hdu.data, _clean_header(hdu.header))
+        finally:
+            if out is not None:
+                out.close()
+
+    record(events=nrows, selected_events=nselected)
+    print(f"Kept {nselected} of {nrows} events, {exposure(final_gti):.1f} s of good time")
+    events = None
+    if return_events:
+        events = np.concatenate(selected) if selected else np.empty(0, dtype=raw_dtype)
+    return events, final_gti
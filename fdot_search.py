@@ -0,0 +1,244 @@
+# Multi-core Z_n^2 search over frequency and frequency derivative.
+# The (f, fdot) grid is sharded by fdot row across a process pool; inside a
+# row, the phases of a block of frequencies are built in one batched numpy
+# operation, so no Python-level loop runs per grid point.
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from instrumentation import instrumented, record
+
+# Target size (in complex numbers) of one block of phasors, ~32 MB
+BLOCK_ELEMENTS = 2 ** 21
+
+_worker_times = None
+
+
+def search_grid(times, fmin, fmax, step=None, oversample=2, fdotmin=0, fdotmax=0, fdotstep=None):
+    """
+    Trial frequencies and fdots, as in hendrics' folding_search: times are relative to the start
+    of the first GTI (see relative_times), the length is the time of the last event, and both
+    grids include their upper end.
+    Returns:
+    - tuple: (frequencies, fdots, step, fdotstep, length)
+    """
+    length = times[-1]
+    if step is None:
+        step = 1 / oversample / length
+    if fdotstep is None:
+        fdotstep = 1 / oversample / length ** 2
+    # Same tolerances as folding_search, so fmax (and fdotmax) on the grid are kept
+    frequencies = np.arange(fmin, fmax + 1e-8 * step, step)
+    fdots = np.arange(fdotmin, fdotmax + 1e-2 * fdotstep, fdotstep)
+    return frequencies, fdots, step, fdotstep, length
+
+
+def zn_row(times, frequencies, fdot, nharm=2):
+    """
+    Z_n^2 of the events for a row of equally spaced frequencies at one fdot.
+    The phasors of a block of frequencies are exp(2 pi i (f0 t + fdot t^2 / 2)) * exp(2 pi i df t)^j,
+    so each block costs one complex multiplication per event instead of one exp per grid point.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    nev = times.size
+    stats = np.zeros(frequencies.size)
+    if nev == 0 or frequencies.size == 0:
+        return stats
+
+    df = frequencies[1] - frequencies[0] if frequencies.size > 1 else 0.0
+    block = int(max(1, min(frequencies.size, BLOCK_ELEMENTS // nev)))
+    # exp(2 pi i j df t) for j = 0 .. block-1, shared by every block of this row
+    ladder = np.exp(2j * np.pi * np.outer(np.arange(block) * df, times))
+    base_phase = 0.5 * fdot * times ** 2
+
+    for start in range(0, frequencies.size, block):
+        nf = min(block, frequencies.size - start)
+        phase = frequencies[start] * times + base_phase
+        phasors = np.exp(2j * np.pi * (phase - np.floor(phase))) * ladder[:nf]
+        harmonic = phasors.copy()
+        total = np.zeros(nf)
+        for k in range(1, nharm + 1):
+            if k > 1:
+                harmonic *= phasors
+            total += np.abs(harmonic.sum(axis=1)) ** 2
+        stats[start:start + nf] = 2 / nev * total
+    return stats
+
+
+def _init_worker(times):
+    global _worker_times
+    _worker_times = times
+
+
+def _zn_rows(frequencies, fdots, rows, nharm):
+    return rows, [zn_row(_worker_times, frequencies, fdots[row], nharm) for row in rows]
+
+
+@instrumented('folding_search')
+def zn_search_grid(times, frequencies, fdots, nharm=2, nproc=None, rows=None, on_row=None, rows_per_task=1):
+    """
+    Z_n^2 over the (fdot, frequency) grid, sharded by fdot row over a process pool.
+    Args:
+    - times (array): Event times, relative to the reference time of the search.
+    - frequencies (array): Equally spaced trial frequencies.
+    - fdots (array): Trial frequency derivatives.
+    - nharm (int): Number of harmonics of the Z_n^2 statistic.
+    - nproc (int): Number of worker processes. Defaults to all cores; 1 runs in this process.
+    - rows (iterable): Only compute these fdot rows (the others stay NaN).
+    - on_row (callable): Called as on_row(row, stats_row) as soon as a row is done.
+    - rows_per_task (int): Rows sent to a worker at once.
+
+    Returns:
+    - array: stats with shape (len(fdots), len(frequencies)).
+    """
+    times = np.asarray(times, dtype=np.float64)
+    stats = np.full((len(fdots), len(frequencies)), np.nan)
+    rows = list(range(len(fdots))) if rows is None else list(rows)
+    nproc = nproc or os.cpu_count() or 1
+    record(events=len(times), trials=len(rows) * len(frequencies))
+
+    def collect(done_rows, results):
+        for row, stats_row in zip(done_rows, results):
+            stats[row] = stats_row
+            if on_row is not None:
+                on_row(row, stats_row)
+
+    if nproc == 1 or len(rows) <= 1:
+        for row in rows:
+            collect([row], [zn_row(times, frequencies, fdots[row], nharm)])
+        return stats
+
+    tasks = [rows[i:i + rows_per_task] for i in range(0, len(rows), rows_per_task)]
+    with ProcessPoolExecutor(max_workers=nproc, initializer=_init_worker, initargs=(times,)) as pool:
+        futures = [pool.submit(_zn_rows, frequencies, fdots, task, nharm) for task in tasks]
+        for future in as_completed(futures):
+            collect(*future.result())
+    return stats
+
+
+def relative_times(events):
+    # Times relative to the start of the first GTI, the reference time folding_search uses
+    times = np.asarray(events.time, dtype=np.float64)
+    ref_time = events.gti[0, 0] if getattr(events, 'gti', None) is not None else times[0]
+    return times - ref_time
+
+
+def folding_search_parallel(events, fmin, fmax, step=None, oversample=2, fdotmin=0, fdotmax=0, nharm=2, nproc=None):
+    """
+    Drop-in replacement for folding_search(events, ..., func=z_n_search).
+    Returns:
+    - tuple: (ff, fd, stats, step, fdotstep, length), with ff, fd and stats of shape (nfdot, nfreq).
+    """
+    times = relative_times(events)
+    frequencies, fdots, step, fdotstep, length = search_grid(times, fmin, fmax, step, oversample, fdotmin, fdotmax)
+    print(f"Searching {len(frequencies)} frequencies and {len(fdots)} fdots on {nproc or os.cpu_count()} processes")
+    stats = zn_search_grid(times, frequencies, fdots, nharm=nharm, nproc=nproc)
+    ff, fd = np.meshgrid(frequencies, fdots)
+    return ff, fd, stats, step, fdotstep, length
+
+
+def zn_points(times, frequencies, fdots, nharm=2):
+    """Z_n^2 at arbitrary (frequency, fdot) points, evaluated in vectorized blocks."""
+    times = np.asarray(times, dtype=np.float64)
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+    fdots = np.broadcast_to(np.asarray(fdots, dtype=np.float64), frequencies.shape)
+    nev = times.size
+    stats = np.zeros(frequencies.size)
+    if nev == 0:
+        return stats
+
+    block = int(max(1, BLOCK_ELEMENTS // nev))
+    half_t2 = 0.5 * times ** 2
+    for start in range(0, frequencies.size, block):
+        stop = min(start + block, frequencies.size)
+        phase = np.outer(frequencies[start:stop], times) + np.outer(fdots[start:stop], half_t2)
+        phasors = np.exp(2j * np.pi * (phase - np.floor(phase)))
+        harmonic = phasors.copy()
+        total = np.zeros(stop - start)
+        for k in range(1, nharm + 1):
+            if k > 1:
+                harmonic *= phasors
+            total += np.abs(harmonic.sum(axis=1)) ** 2
+        stats[start:stop] = 2 / nev * total
+    return stats
+
+
+@instrumented()
+def adaptive_zn_search(events, fmin, fmax, step=None, oversample=10, fdotmin=0, fdotmax=0,
+                       nharm=2, coarse_oversample=1, top_k=8, patch_halfwidth=None, nproc=None):
+    """
+    Coarse-to-fine Z_n^2 search. A coarse grid (coarse_oversample, i.e. about one trial per
+    independent Fourier frequency) is searched in full; the top_k cells are then refined by
+    halving the steps and keeping the best of the 3x3 neighbours, down to the resolution the
+    uniform search with the given oversample would have. Finally a uniform patch is evaluated
+    around the best point, wide enough for the 2-D Gaussian fit of the errors.
+    Args:
+    - events: Event list with .time (and .gti).
+    - fmin, fmax, fdotmin, fdotmax (float): Search window, as for folding_search.
+    - step (float): Final frequency step. Defaults to 1 / oversample / length.
+    - oversample (int): Oversampling of the final resolution.
+    - nharm (int): Number of harmonics of the Z_n^2 statistic.
+    - coarse_oversample (int): Oversampling of the coarse grid.
+    - top_k (int): Number of candidates followed through the refinement.
+    - patch_halfwidth (int): Half width of the final patch in fine cells. Defaults to 2 * oversample.
+    - nproc (int): Worker processes for the coarse grid.
+
+    Returns:
+    - tuple: (best_f, best_fdot, (ff, fd, stats) of the local patch, number of Z_n^2 evaluations)
+    """
+    times = relative_times(events)
+    length = times[-1]
+    fine_step = step if step is not None else 1 / oversample / length
+    fine_fdotstep = 1 / oversample / length ** 2
+    search_fdot = fdotmax > fdotmin
+    if patch_halfwidth is None:
+        patch_halfwidth = 2 * oversample
+
+    # Coarse pass over the whole window
+    frequencies, fdots, fstep, fdotstep, _ = search_grid(times, fmin, fmax, None, coarse_oversample, fdotmin, fdotmax)
+    fstep = max(fstep, fine_step)
+    frequencies = np.arange(fmin, fmax + 1e-8 * fstep, fstep)
+    stats = zn_search_grid(times, frequencies, fdots, nharm=nharm, nproc=nproc)
+    nevals = stats.size
+
+    ff, fd = np.meshgrid(frequencies, fdots)
+    best = np.argsort(stats, axis=None)[::-1][:top_k]
+    cand_f, cand_fd, cand_stats = ff.ravel()[best], fd.ravel()[best], stats.ravel()[best]
+
+    # Refine only around the candidates until the requested resolution is reached
+    offsets = np.array([-1, 0, 1])
+    while fstep > fine_step or (search_fdot and fdotstep > fine_fdotstep):
+        fstep = max(fstep / 2, fine_step)
+        if search_fdot:
+            fdotstep = max(fdotstep / 2, fine_fdotstep)
+        df, dfd = np.meshgrid(offsets * fstep, offsets * fdotstep if search_fdot else [0.0])
+        trial_f = (cand_f[:, None] + df.ravel()).ravel()
+        trial_fd = (cand_fd[:, None] + dfd.ravel()).ravel()
+        trial_stats = zn_points(times, trial_f, trial_fd, nharm).reshape(len(cand_f), -1)
+        nevals += trial_stats.size
+
+        best_in_cell = np.argmax(trial_stats, axis=1)
+        rows = np.arange(len(cand_f))
+        cand_f = trial_f.reshape(len(cand_f), -1)[rows, best_in_cell]
+        cand_fd = trial_fd.reshape(len(cand_fd), -1)[rows, best_in_cell]
+        cand_stats = trial_stats[rows, best_in_cell]
+
+        # Candidates that converged onto the same point are followed only once
+        _, unique = np.unique(np.round(np.column_stack([cand_f / fstep, cand_fd / (fdotstep or 1)])), axis=0, return_index=True)
+        cand_f, cand_fd, cand_stats = cand_f[unique], cand_fd[unique], cand_stats[unique]
+
+    winner = np.argmax(cand_stats)
+    best_f, best_fdot = cand_f[winner], cand_fd[winner]
+
+    # Uniform high-resolution patch around the peak, for the error fit and the plot
+    patch_offsets = np.arange(-patch_halfwidth, patch_halfwidth + 1)
+    patch_f = best_f + patch_offsets * fine_step
+    patch_fd = best_fdot + patch_offsets * fine_fdotstep if search_fdot else np.array([best_fdot])
+    patch_stats = np.vstack([zn_row(times, patch_f, fdot, nharm) for fdot in patch_fd])
+    nevals += patch_stats.size
+    patch_ff, patch_fdd = np.meshgrid(patch_f, patch_fd)
+
+    uniform_f, uniform_fd, *_ = search_grid(times, fmin, fmax, fine_step, oversample, fdotmin, fdotmax, fine_fdotstep)
+    print(f"Adaptive search: {nevals} Z_n^2 evaluations instead of {uniform_f.size * uniform_fd.size}")
+    return best_f, best_fdot, (patch_ff, patch_fdd, patch_stats), nevals
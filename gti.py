@@ -0,0 +1,131 @@
+# Good Time Interval algebra on sorted numpy (start, stop) arrays.
+# A GTI is an (n, 2) float array of [start, stop] rows. Every operation is
+# vectorized (sorts, cumulative maxima and searchsorted, no Python loops over
+# intervals), so observations with thousands of short GTIs stay cheap, and GTI
+# combination no longer has to go through nimaketime / niextract-events.
+import numpy as np
+
+from instrumentation import stage
+
+
+def as_gti(starts, stops=None):
+    """(n, 2) float GTI array from an (n, 2) array or from separate start and stop arrays."""
+    if stops is None:
+        gti = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    else:
+        gti = np.column_stack([np.asarray(starts, dtype=np.float64), np.asarray(stops, dtype=np.float64)])
+    return gti
+
+
+def read_gti(evt_file, extname='GTI'):
+    """GTI of a FITS file. With extname=None the first table with START and STOP
+    columns is used (e.g. the STDGTI extension nimaketime writes)."""
+    from astropy.io import fits
+    with stage('fits_read'), fits.open(evt_file, memmap=True) as hdul:
+        if extname is None:
+            extname = next(i for i, hdu in enumerate(hdul)
+                           if isinstance(hdu, fits.BinTableHDU) and {'START', 'STOP'} <= set(hdu.columns.names))
+        data = hdul[extname].data
+        return as_gti(data['START'], data['STOP'])
+
+
+def write_gti(filename, gti, header=None):
+    """Write a GTI as a FITS file with a single GTI extension (START, STOP), usable as an niextract timefile."""
+    from astropy.io import fits
+    gti = as_gti(gti)
+    gti_hdu = fits.BinTableHDU.from_columns(
+        [fits.Column('START', 'D', unit='s', array=gti[:, 0]),
+         fits.Column('STOP', 'D', unit='s', array=gti[:, 1])], name='GTI')
+    for keyword, value in (header or {}).items():
+        gti_hdu.header[keyword] = value
+    fits.HDUList([fits.PrimaryHDU(), gti_hdu]).writeto(filename, overwrite=True)
+    return filename
+
+
+def union(*gtis):
+    """Union of any number of GTIs, as sorted, non-overlapping intervals."""
+    gti = np.concatenate([as_gti(g) for g in gtis]) if gtis else np.empty((0, 2))
+    gti = gti[gti[:, 1] > gti[:, 0]]
+    if len(gti) == 0:
+        return gti
+    gti = gti[np.argsort(gti[:, 0], kind='stable')]
+    # An interval starts a new merged block if it begins after every earlier interval ended
+    reach = np.maximum.accumulate(gti[:, 1])
+    new_block = np.r_[True, gti[1:, 0] > reach[:-1]]
+    block_starts = np.flatnonzero(new_block)
+    return np.column_stack([gti[block_starts, 0], np.maximum.reduceat(gti[:, 1], block_starts)])
+
+
+def intersection(*gtis):
+    """Intersection of any number of GTIs."""
+    if not gtis:
+        return np.empty((0, 2))
+    merged = [union(g) for g in gtis]
+    edges = np.concatenate([g.ravel() for g in merged])
+    # +1 at every start, -1 at every stop; stops sort before starts at equal times,
+    # so touching intervals do not produce zero-length overlaps
+    delta = np.tile([1, -1], len(edges) // 2)
+    order = np.lexsort((delta, edges))
+    edges, delta = edges[order], delta[order]
+    depth = np.cumsum(delta)
+    inside = depth == len(merged)
+    starts = edges[inside]
+    # The edge right after reaching full depth is where the overlap ends
+    stops = edges[np.flatnonzero(inside) + 1]
+    return as_gti(starts, stops)
+
+
+def complement(gti, tstart=None, tstop=None):
+    """Gaps of a GTI within [tstart, tstop] (defaults to the GTI's own span)."""
+    gti = union(gti)
+    if tstart is None:
+        tstart = gti[0, 0] if len(gti) else 0.0
+    if tstop is None:
+        tstop = gti[-1, 1] if len(gti) else 0.0
+    gaps = as_gti(np.r_[tstart, gti[:, 1]], np.r_[gti[:, 0], tstop])
+    gaps = np.clip(gaps, tstart, tstop)
+    return gaps[gaps[:, 1] > gaps[:, 0]]
+
+
+def filter_min_length(gti, min_length):
+    gti = as_gti(gti)
+    return gti[(gti[:, 1] - gti[:, 0]) >= min_length]
+
+
+def exposure(gti):
+    gti = as_gti(gti)
+    return float(np.sum(gti[:, 1] - gti[:, 0]))
+
+
+def gti_mask(times, gti):
+    """
+    Boolean mask of the times that fall in the GTI (start <= t < stop).
+    The GTI must be sorted and non-overlapping, as returned by union().
+    """
+    index = np.searchsorted(np.asarray(gti, dtype=np.float64).ravel(), times, side='right')
+    return (index & 1).astype(bool)
+
+
+def span_collection(starts, stops, colors, alpha=0.3, **kwargs):
+    """Vertical spans from starts to stops as a single PolyCollection (y in axes fraction
+    when given transform=ax.get_xaxis_transform())."""
+    from matplotlib.collections import PolyCollection
+    starts, stops = np.asarray(starts, dtype=float), np.asarray(stops, dtype=float)
+    verts = np.empty((len(starts), 4, 2))
+    verts[:, [0, 1], 0] = starts[:, None]
+    verts[:, [2, 3], 0] = stops[:, None]
+    verts[:, [0, 3], 1] = 0
+    verts[:, [1, 2], 1] = 1
+    return PolyCollection(verts, facecolors=colors, alpha=alpha, edgecolors='none', **kwargs)
+
+
+def plot_gti_spans(ax, gti, tstart=None, tstop=None, offset=0.0, good_color='blue', bad_color='red', alpha=0.5):
+    """Draw good and bad time spans as one collection. Returns the collection."""
+    gti = union(gti)
+    gaps = complement(gti, tstart, tstop)
+    starts = np.r_[gti[:, 0], gaps[:, 0]] - offset
+    stops = np.r_[gti[:, 1], gaps[:, 1]] - offset
+    colors = [good_color] * len(gti) + [bad_color] * len(gaps)
+    collection = span_collection(starts, stops, colors, alpha=alpha, transform=ax.get_xaxis_transform())
+    ax.add_collection(collection)
+    return collection
@@ -0,0 +1,217 @@
+# Per-stage instrumentation of the analysis scripts.
+# Stages are nested context managers (or decorated functions) that record wall
+# time, CPU time (own and of child processes such as nicerl2), peak RSS, bytes
+# read and any counts the stage reports (e.g. events). At the end of the run a
+# JSON report is written, optionally with a flame-style summary in the folded
+# stack format ("a;b;c <ms>") that flamegraph.pl and speedscope read.
+#
+# Enabled with NICER_PROFILE=1 (report in the current directory) or
+# NICER_PROFILE=<report.json>; NICER_PROFILE_FLAME=1 adds the folded stacks.
+# When disabled, stage() returns a shared no-op context manager and the
+# decorator is a single flag check, so the instrumented code runs at full speed.
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import functools
+import contextlib
+import subprocess
+
+_enabled = False
+_report_file = None
+_flame = False
+_records = []
+_stack = []
+_null_stage = contextlib.nullcontext()
+
+
+def _read_proc_io():
+    # rchar: bytes read through read() calls; read_bytes: bytes fetched from storage (includes memmap page-ins)
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':') for line in f)
+        return int(fields['rchar']), int(fields['read_bytes'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    scale = 1 / 1024 ** 2 if sys.platform == 'darwin' else 1 / 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_inblock
+
+
+class _Stage:
+    def __init__(self, name, counts):
+        self.name = name
+        self.counts = dict(counts)
+
+    def __enter__(self):
+        _stack.append(self)
+        self.path = ';'.join(stage.name for stage in _stack)
+        self.children_cpu0, self.children_blocks0 = _children_cpu()
+        self.rchar0, self.read_bytes0 = _read_proc_io()
+        self.cpu0 = time.process_time()
+        self.wall0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall0
+        cpu = time.process_time() - self.cpu0
+        rchar, read_bytes = _read_proc_io()
+        children_cpu, children_blocks = _children_cpu()
+        peak_rss, children_peak_rss = _peak_rss_mb()
+        _stack.pop()
+        _records.append({
+            'stage': self.name,
+            'path': self.path,
+            'wall_time': wall,
+            'cpu_time': cpu,
+            'children_cpu_time': children_cpu - self.children_cpu0,
+            'peak_rss_mb': peak_rss,
+            'children_peak_rss_mb': children_peak_rss,
+            'bytes_read': rchar - self.rchar0,
+            'storage_bytes_read': (read_bytes - self.read_bytes0) + 512 * (children_blocks - self.children_blocks0),
+            'counts': self.counts,
+            'failed': exc_type is not None,
+        })
+        return False
+
+
+def stage(name, **counts):
+    """Context manager timing a stage. Extra keyword arguments are recorded as counts."""
+    if not _enabled:
+        return _null_stage
+    return _Stage(name, counts)
+
+
+def record(**counts):
+    """Add counts (e.g. events=len(times)) to the innermost running stage."""
+    if _enabled and _stack:
+        current = _stack[-1].counts
+        for key, value in counts.items():
+            current[key] = current.get(key, 0) + value
+
+
+def instrumented(name=None):
+    """Decorator running the function as a stage (named after the function by default)."""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_command(command, name=None, **kwargs):
+    """subprocess.run as a stage named after the program (e.g. nicerl2, nimaketime)."""
+    if not _enabled:
+        return subprocess.run(command, **kwargs)
+    if name is None:
+        program = command.split()[0] if isinstance(command, str) else command[0]
+        name = os.path.basename(program)
+    with _Stage(f"subprocess:{name}", {}):
+        return subprocess.run(command, **kwargs)
+
+
+### Report
+
+def summary():
+    """Totals per stage path: calls, wall and CPU time, self wall time (without nested stages), bytes and counts."""
+    totals = {}
+    for rec in _records:
+        total = totals.setdefault(rec['path'], {'calls': 0, 'wall_time': 0.0, 'self_time': 0.0, 'cpu_time': 0.0,
+                                                'children_cpu_time': 0.0, 'bytes_read': 0, 'storage_bytes_read': 0,
+                                                'peak_rss_mb': 0.0, 'counts': {}})
+        total['calls'] += 1
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], rec['peak_rss_mb'])
+        for key in ('wall_time', 'self_time', 'cpu_time', 'children_cpu_time', 'bytes_read', 'storage_bytes_read'):
+            total[key] += rec.get(key, rec['wall_time'] if key == 'self_time' else 0)
+        for key, value in rec['counts'].items():
+            total['counts'][key] = total['counts'].get(key, 0) + value
+    # Self time: subtract the wall time of the direct children
+    for rec in _records:
+        parent = rec['path'].rpartition(';')[0]
+        if parent in totals:
+            totals[parent]['self_time'] -= rec['wall_time']
+    return totals
+
+
+def folded_stacks(totals=None):
+    """Flame-style summary: one 'a;b;c <self time in ms>' line per stage path."""
+    totals = summary() if totals is None else totals
+    return [f"{path} {max(int(round(total['self_time'] * 1000)), 0)}" for path, total in sorted(totals.items())]
+
+
+def write_report(filename=None, flame=None):
+    """Write the JSON report (and the folded stacks next to it). Returns the report file name."""
+    filename = filename or _report_file or f"nicer_profile_{os.getpid()}_{time.strftime('%Y%m%dT%H%M%S')}.json"
+    totals = summary()
+    report = {
+        'argv': sys.argv,
+        'pid': os.getpid(),
+        'peak_rss_mb': _peak_rss_mb()[0],
+        'stages': totals,
+        'records': _records,
+    }
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=1)
+    if _flame if flame is None else flame:
+        with open(os.path.splitext(filename)[0] + '.folded', 'w') as f:
+            f.write('\n'.join(folded_stacks(totals)) + '\n')
+    return filename
+
+
+def print_summary(file=sys.stderr, limit=15):
+    totals = summary()
+    print(f"{'stage':<60} {'calls':>5} {'wall s':>9} {'self s':>9} {'cpu s':>9} {'MB read':>9}", file=file)
+    for path, total in sorted(totals.items(), key=lambda item: -item[1]['self_time'])[:limit]:
+        print(f"{path[-60:]:<60} {total['calls']:>5} {total['wall_time']:>9.2f} {total['self_time']:>9.2f} "
+              f"{total['cpu_time'] + total['children_cpu_time']:>9.2f} {total['bytes_read'] / 1e6:>9.1f}", file=file)
+
+
+def reset():
+    _records.clear()
+
+
+def enable(report_file=None, flame=False, at_exit=True):
+    """Turn the instrumentation on (the NICER_PROFILE environment variable does this at import)."""
+    global _enabled, _report_file, _flame
+    first = not _enabled
+    _enabled, _report_file, _flame = True, report_file, flame
+    if at_exit and first:
+        atexit.register(_write_at_exit)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def _write_at_exit():
+    if _records:
+        filename = write_report()
+        print_summary()
+        print(f"Profile report written to {filename}", file=sys.stderr)
+
+
+_setting = os.environ.get('NICER_PROFILE', '')
+if _setting and _setting != '0':
+    enable(_setting if _setting.endswith('.json') else None, flame=os.environ.get('NICER_PROFILE_FLAME', '') not in ('', '0'))
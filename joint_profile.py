@@ -0,0 +1,165 @@
+# Joint pulse profile of every observation and GTI.
+# Each full-energy _nicer_xti_ev_calib.nc file is folded with its own ephemeris
+# from timing_parameters.txt (one file's events in memory at a time, through the
+# cached energy-phase cube), aligned to the running joint profile by FFT
+# cross-correlation and added to it. The per-file aligned histograms are kept in
+# a JSON checkpoint, so a new observation is folded and added without refolding
+# the earlier ones, and a file whose data or ephemeris changed is swapped out.
+import os
+import json
+import tempfile
+import numpy as np
+
+from energy_phase_cube import load_energy_phase_cube
+from phaseogram import min_phase_shift, normalize_profiles
+from timing_store import timing_store
+from catalog import open_catalog
+from instrumentation import instrumented
+
+CHECKPOINT_FILE = "joint_profile_bin{nbin}.json"
+CALIB_SUFFIX = "_nicer_xti_ev_calib.nc"
+
+
+def find_calib_files(data_path):
+    """
+    Full-energy calibrated event files of every observation: the analysis directory and
+    its GTI folders (energy band files and the energy_resolved_pp folders are left out).
+    Returns:
+    - list: (obs_id_gti, file path) pairs, sorted.
+    """
+    found = []
+    with open_catalog(data_path) as catalog:
+        for row in catalog.find(stage='calibrated', e1=None):
+            folder = os.path.basename(row['directory'])
+            if row['obs_id'] is None or not (folder == 'analysis' or folder.startswith('GTI')):
+                continue
+            obs_id_gti = f"{row['obs_id']}_{row['gti']}" if row['gti'] else row['obs_id']
+            found.append((obs_id_gti, row['path']))
+    return found
+
+
+def align_shift(profile, template):
+    """Cyclic shift (in bins) for np.roll(profile, shift) to best match the template, from the FFT cross-correlation."""
+    correlation = np.fft.irfft(np.fft.rfft(template) * np.conj(np.fft.rfft(profile)), n=len(profile))
+    return int(np.argmax(correlation))
+
+
+class JointProfileAccumulator:
+    def __init__(self, checkpoint, nbin=128):
+        self.checkpoint = checkpoint
+        self.nbin = nbin
+        # file path -> {obs_id_gti, ephemeris, file stamp, shift, aligned profile}
+        self.entries = {}
+        if os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state['nbin'] == nbin:
+                self.entries = state['entries']
+
+    @property
+    def profile(self):
+        """Joint (summed, aligned) profile."""
+        total = np.zeros(self.nbin, dtype=np.int64)
+        for entry in self.entries.values():
+            total += np.asarray(entry['profile'], dtype=np.int64)
+        return total
+
+    def save(self):
+        # Atomic replace, so an interrupted run keeps the previous checkpoint
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'nbin': self.nbin, 'entries': self.entries}, f)
+        os.replace(tmp, self.checkpoint)
+
+    @staticmethod
+    def _stamp(calib_file):
+        st = os.stat(calib_file)
+        return [st.st_mtime_ns, st.st_size]
+
+    def is_current(self, calib_file, params):
+        entry = self.entries.get(calib_file)
+        ephemeris = [params['fr'], params['frdot'], params['tstart']]
+        return entry is not None and entry['ephemeris'] == ephemeris and entry['stamp'] == self._stamp(calib_file)
+
+    def add(self, obs_id_gti, calib_file, params):
+        """Fold one file, align it to the joint profile of the other files and add it (replacing an older version)."""
+        self.entries.pop(calib_file, None)
+        cube = load_energy_phase_cube(calib_file, params['fr'], params['frdot'], params['tstart'], self.nbin)
+        _, counts, _ = cube.profile()
+        counts = counts.astype(np.int64)
+        template = self.profile
+        # The first file sets the reference: minimum at phase 0.1, as in plotpp.py
+        shift = align_shift(counts, template) if template.any() else min_phase_shift(counts)
+        self.entries[calib_file] = {
+            'obs_id_gti': obs_id_gti,
+            'ephemeris': [params['fr'], params['frdot'], params['tstart']],
+            'stamp': self._stamp(calib_file),
+            'shift': shift,
+            'profile': np.roll(counts, shift).tolist(),
+        }
+
+    def update(self, data_path):
+        """
+        Add every new or changed file under data_path, checkpointing after each one.
+        Files without timing parameters are skipped, files that disappeared are dropped.
+        Returns:
+        - list: The obs_id_gti of the files that were (re)folded.
+        """
+        store = timing_store(data_path)
+        files = find_calib_files(data_path)
+        for calib_file in set(self.entries) - {path for _, path in files}:
+            del self.entries[calib_file]
+
+        added = []
+        for obs_id_gti, calib_file in files:
+            params = store.get(obs_id_gti) or store.get(obs_id_gti.split('_')[0])
+            if params is None:
+                print(f"Timing parameters not found for {obs_id_gti}, skipping.")
+                continue
+            if self.is_current(calib_file, params):
+                continue
+            self.add(obs_id_gti, calib_file, params)
+            self.save()
+            added.append(obs_id_gti)
+            print(f"Added {obs_id_gti} (shift {self.entries[calib_file]['shift']} bins)")
+        self.save()
+        return added
+
+
+@instrumented('plot')
+def plot_joint_profile(profile, title="Her X-1, joint pulse profile", savefile=None, show=True):
+    import matplotlib.pyplot as plt
+    nbin = len(profile)
+    profile = np.asarray(profile, dtype=np.float64)
+    profile_norm, profile_err = normalize_profiles(profile, np.sqrt(profile))
+    # The joint profile is already aligned, tile it over three cycles as in plotpp.py
+    profile_extended = np.tile(profile_norm, 3)
+    profile_err_extended = np.tile(profile_err, 3)
+
+    plt.figure(figsize=(10, 5))
+    plt.errorbar(np.arange(len(profile_extended)) / nbin, profile_extended, profile_err_extended, color='blue', drawstyle='steps-mid', label="Joint")
+    plt.xlabel("Phase", fontsize=16)
+    plt.ylabel("Normalized Count Rate (cts/s)", fontsize=16)
+    plt.title(title, fontsize=16)
+    plt.legend(loc="upper right")
+    plt.tick_params(labelsize=16)
+    plt.xlim([0, 2])
+    plt.tight_layout(pad=0.5)
+    if savefile:
+        plt.savefig(savefile)
+    if show:
+        plt.show()
+
+
+def main():
+    data_path = input('Data directory with the observations and timing_parameters.txt: ').strip()
+    nbin = int(input('Number of phase bins (default: 128): ').strip() or 128)
+    accumulator = JointProfileAccumulator(os.path.join(data_path, CHECKPOINT_FILE.format(nbin=nbin)), nbin)
+    added = accumulator.update(data_path)
+    print(f"{len(added)} files folded, {len(accumulator.entries)} files in the joint profile")
+    plot_joint_profile(accumulator.profile, savefile=os.path.join(data_path, f"herx1_nicer_joint_pp_bin{nbin}.png"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Fast viewer for MKF filter-file columns.
+# Only the requested columns are touched (the MKF is memory-mapped), and every
+# panel draws a per-pixel min/max envelope of its column instead of every row.
+# The envelope is recomputed for the visible range whenever the view is zoomed
+# or panned, so full-orbit MKF files stay interactive.
+import numpy as np
+from astropy.io import fits
+import matplotlib.pyplot as plt
+from gti import span_collection
+from instrumentation import stage
+
+
+def read_mkf_columns(mkf_file, columns):
+    """
+    Memory-map the MKF and return TIME plus the requested columns, without reading the others.
+    Returns:
+    - tuple: (HDUList kept open for the memory map, time, {column: values})
+    """
+    with stage('fits_read'):
+        hdul = fits.open(mkf_file, memmap=True)
+        prefilter = hdul[1].data
+        time = prefilter.field('TIME')
+        return hdul, time, {column: prefilter.field(column) for column in columns}
+
+
+def minmax_decimate(x, y, xmin, xmax, npix):
+    """
+    Per-pixel min/max envelope of y(x) over [xmin, xmax] for a plot npix pixels wide.
+    x must be sorted. Returns at most 2 * npix points that keep every extreme value visible.
+    """
+    lo, hi = np.searchsorted(x, [xmin, xmax])
+    lo, hi = max(lo - 1, 0), min(hi + 1, len(x))
+    x, y = x[lo:hi], y[lo:hi]
+    if len(x) <= 2 * npix:
+        return x, y
+
+    pixel = np.clip(((x - xmin) * (npix / (xmax - xmin))).astype(np.int64), 0, npix - 1)
+    starts = np.flatnonzero(np.r_[True, pixel[1:] != pixel[:-1]])
+    # fmin/fmax skip the NaN rows the MKF has during SAA passages
+    ymin = np.fmin.reduceat(y, starts)
+    ymax = np.fmax.reduceat(y, starts)
+    return np.repeat(x[starts], 2), np.column_stack([ymin, ymax]).ravel()
+
+
+class MKFViewer:
+    def __init__(self, mkf_file, columns, thresholds=None, gti=None, colors=None):
+        """
+        Args:
+        - mkf_file (str): MKF filter file.
+        - columns (list): Columns to plot, one panel each.
+        - thresholds (dict): column -> threshold (or list of thresholds) drawn as horizontal lines.
+        - gti (array): (n, 2) GTI start/stop times shaded in every panel.
+        - colors (dict): column -> marker color.
+        """
+        self.hdul, time, self.columns = read_mkf_columns(mkf_file, columns)
+        self.time = np.asarray(time, dtype=np.float64)
+        if np.any(np.diff(self.time) < 0):
+            order = np.argsort(self.time, kind='stable')
+            self.time = self.time[order]
+            self.columns = {column: values[order] for column, values in self.columns.items()}
+        thresholds = thresholds or {}
+        colors = colors or {}
+
+        self.fig, axs = plt.subplots(len(columns), figsize=(12, 4 * len(columns)), sharex=True, squeeze=False)
+        self.axes = axs[:, 0]
+        self.lines = {}
+        for ax, column in zip(self.axes, columns):
+            self.lines[column], = ax.plot([], [], 'o', color=colors.get(column, 'r'), markersize=1)
+            for threshold in np.atleast_1d(thresholds.get(column, [])):
+                ax.axhline(threshold, color='k', linestyle='--', linewidth=1)
+            if gti is not None and len(gti):
+                gti = np.asarray(gti)
+                ax.add_collection(span_collection(gti[:, 0], gti[:, 1], 'green', alpha=0.15,
+                                                  transform=ax.get_xaxis_transform()))
+            ax.set_title(column)
+            values = np.asarray(self.columns[column])
+            finite = values[np.isfinite(values)]
+            if finite.size:
+                margin = 0.05 * max(finite.max() - finite.min(), 1)
+                ax.set_ylim(finite.min() - margin, finite.max() + margin)
+
+        self.axes[-1].set_xlabel('TIME (s)')
+        self.axes[0].set_xlim(self.time[0], self.time[-1])
+        self.redraw()
+        self.axes[0].callbacks.connect('xlim_changed', lambda ax: self.redraw())
+
+    def redraw(self):
+        xmin, xmax = self.axes[0].get_xlim()
+        for ax, (column, line) in zip(self.axes, self.lines.items()):
+            npix = max(int(ax.bbox.width), 1)
+            line.set_data(*minmax_decimate(self.time, self.columns[column], xmin, xmax, npix))
+        self.fig.canvas.draw_idle()
+
+    def show(self):
+        plt.show()
+        self.hdul.close()
@@ -1,23 +1,75 @@
 import os
-# A legacy code for 
-
-def rename_files(directory):
-    # Change to the specified directory
-    os.chdir(directory)
-    
-    # List all files in the directory
-    files = os.listdir('.')
-    
-    # Loop through the files
-    for filename in files:
-        # Replace 'underonly' with 'uo' and 'overonly' with 'oo'
-        new_filename = filename.replace('underonly', 'uo').replace('overonly', 'oo')
-        
-        # Rename the file if there is a change
-        if new_filename != filename:
-            os.rename(filename, new_filename)
-            print(f"Renamed '{filename}' to '{new_filename}'")
-
-# Usage example
-directory = '/Users/hongyuzhang/Documents/data/her_x-1/2022_data/3602020601/xti/analysis/GTI1'
-rename_files(directory)
+import argparse
+from catalog import Catalog
+# A legacy code for renaming the underonly/overonly file names of the early
+# reductions to the uo/oo names the scripts use. The files to rename come from
+# the catalog of the whole data directory, and nothing is renamed unless --apply
+# is given: by default the planned renames are only printed.
+
+
+def new_name(filename):
+    # Replace 'underonly' with 'uo' and 'overonly' with 'oo'
+    return filename.replace('underonly', 'uo').replace('overonly', 'oo')
+
+
+def planned_renames(catalog):
+    """
+    (old path, new path) of every cataloged file with a legacy name.
+    Renames onto an existing file are left out and reported.
+    """
+    renames = []
+    rows = catalog.find(name_like='%underonly%') + catalog.find(name_like='%overonly%')
+    for path in sorted({row['path'] for row in rows}):
+        directory, filename = os.path.split(path)
+        new_path = os.path.join(directory, new_name(filename))
+        if new_path == path:
+            continue
+        if os.path.exists(new_path):
+            print(f"Skipping '{path}': '{os.path.basename(new_path)}' already exists")
+            continue
+        renames.append((path, new_path))
+    return renames
+
+
+def migrate_names(data_path, dry_run=True):
+    """
+    Rename every legacy underonly/overonly file under data_path, keeping the catalog in step.
+    Returns:
+    - list: The (old path, new path) renames, done or (dry run) planned.
+    """
+    with Catalog(data_path) as catalog:
+        catalog.refresh()
+        renames = planned_renames(catalog)
+        for path, new_path in renames:
+            if dry_run:
+                print(f"Would rename '{path}' to '{os.path.basename(new_path)}'")
+            else:
+                catalog.rename(path, new_path)
+                print(f"Renamed '{path}' to '{os.path.basename(new_path)}'")
+        catalog.commit()
+    print(f"{len(renames)} files {'to rename (dry run, use --apply to rename)' if dry_run else 'renamed'}")
+    return renames
+
+
+def rename_files(directory, dry_run=False):
+    # Rename the files of a single directory only
+    renames = [f for f in sorted(os.listdir(directory)) if new_name(f) != f]
+    for filename in renames:
+        if dry_run:
+            print(f"Would rename '{filename}' to '{new_name(filename)}'")
+        else:
+            os.rename(os.path.join(directory, filename), os.path.join(directory, new_name(filename)))
+            print(f"Renamed '{filename}' to '{new_name(filename)}'")
+    return renames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rename underonly/overonly files to uo/oo across a data directory')
+    parser.add_argument('data_path', help='e.g. /Users/hongyuzhang/Documents/data/her_x-1/2022_data')
+    parser.add_argument('--apply', action='store_true', help='Rename the files (default: dry run)')
+    args = parser.parse_args()
+    migrate_names(args.data_path, dry_run=not args.apply)
+
+
+if __name__ == "__main__":
+    main()
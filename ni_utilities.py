@@ -1,5 +1,4 @@
-import csv
-import os
+from timing_store import timing_store
 
 def observationalID():
     while True:  # Keep looping until we get a valid input
@@ -13,15 +12,5 @@ def observationalID():
 
     
 def load_timing_parameters(data_path, obs_id_gti):
-    filename = os.path.join(data_path, "timing_parameters.txt")
-    with open(filename, mode='r') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip the header
-        for row in reader:
-            if row[0] == obs_id_gti:
-                return {
-                    'tstart': float(row[1]),
-                    'fr': float(row[2]),
-                    'frdot': float(row[3])
-                }
-    return None  # Return None if the specific ID is not found
\ No newline at end of file
+    # Served from the indexed, lazily loaded store instead of re-reading the file every call
+    return timing_store(data_path).get(obs_id_gti)  # None if the specific ID is not found
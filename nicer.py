@@ -0,0 +1,455 @@
+# Single command-line entry point for the NICER Her X-1 analysis.
+# Every subcommand imports what it needs only when it runs, so `--help` and the
+# orchestration commands start without loading astropy, stingray, hendrics or
+# matplotlib.
+#
+# Usage: python nicer.py <command> --help
+#   pipeline   run pipeline stages (batch, or the interactive pipeline.py)
+#   filter     niextract-style PI / EVENT_FLAGS / GTI screening of an event file
+#   split      split an event file into energy bands
+#   calibrate  PI -> energy calibration to a _nicer_xti_ev_calib.nc file
+#   fold       fold a calibrated file into its (cached) energy-phase cube
+#   search     Z_n^2 search over f and fdot
+#   plot       pulse profile, energy-resolved, phase lag, power spectrum, search, phaseogram or joint profile plots
+#   screen     sweep the underonly/overonly thresholds over the MKF
+#   catalog    refresh and query the catalog of the data directory
+#   rename     migrate the legacy underonly/overonly file names to uo/oo
+import os
+import sys
+import argparse
+
+DEFAULT_BANDS = [5, 8, 14, 100]  # CUSTOM_INTERVALS of energy_resolved_pp.py, in 0.1 keV
+
+
+def _bands(edges):
+    return [(edges[i], edges[i + 1]) for i in range(len(edges) - 1)]
+
+
+def _add_ephemeris(parser):
+    group = parser.add_argument_group('ephemeris', 'Given explicitly, or looked up in timing_parameters.txt')
+    group.add_argument('--fr', type=float, help='Spin frequency (Hz)')
+    group.add_argument('--frdot', type=float, default=None, help='Spin frequency derivative (Hz/s)')
+    group.add_argument('--tstart', type=float, default=None, help='Reference time of the ephemeris (s)')
+    group.add_argument('--data-path', default='.', help='Directory with timing_parameters.txt')
+
+
+def _ephemeris(args, filename):
+    if args.fr is not None:
+        return {'fr': args.fr, 'frdot': args.frdot or 0.0, 'tstart': args.tstart or 0.0}
+    from plotpp import timing_parameters_for
+    params = timing_parameters_for(filename, args.data_path)
+    if params is None:
+        sys.exit(f"No timing parameters for {os.path.basename(filename)} in {args.data_path}; give --fr/--frdot/--tstart")
+    return params
+
+
+def _add_orbit(parser):
+    group = parser.add_argument_group('orbit', 'For files barycentred without the orbit correction')
+    group.add_argument('--orbit', action='store_true',
+                       help='Remove the binary orbit of orbit_parameters.json from the event times first')
+    group.add_argument('--orbit-version', type=int, help='Version of the orbit (default: the latest)')
+
+
+def _orbit(args):
+    if not args.orbit:
+        return None
+    from binary_orbit import load_orbit
+    orbit = load_orbit(version=args.orbit_version)
+    print(f"Removing the orbit: {orbit}")
+    return orbit
+
+
+def _add_adaptive(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--equal-counts', type=int, metavar='N', help='N bands of equal counts instead of --bands')
+    group.add_argument('--target-snr', type=float, metavar='S', help='Bands of pulsed S/N S each instead of --bands')
+
+
+def _energy_edges(args, cube=None, pi=None):
+    if args.equal_counts is None and getattr(args, 'target_snr', None) is None:
+        return args.bands
+    from adaptive_binning import adaptive_edges
+    mode, value = ('counts', args.equal_counts) if args.equal_counts is not None else ('snr', args.target_snr)
+    edges = adaptive_edges(mode, value, cube=cube, pi=pi)
+    print(f"Adaptive band edges (0.1 keV): {' '.join(map(str, edges))}")
+    return edges
+
+
+### Commands
+
+def cmd_pipeline(args):
+    if args.interactive:
+        import pipeline
+        pipeline.main()
+        return
+    import batch_pipeline
+    config = batch_pipeline.load_config(args.config)
+    if args.obs:
+        config['observations'] = args.obs
+    if args.stages:
+        config['stages'] = args.stages
+    if args.workers:
+        config['max_workers'] = args.workers
+    report = batch_pipeline.run_batch(config)
+    failed = [obsID for obsID, stages in report['observations'].items()
+              if 'error' in stages or any(result['status'] != 'done' for result in stages.values())]
+    return 1 if failed else 0
+
+
+def cmd_filter(args):
+    from event_filter import filter_events
+    filter_events(args.evt_file, args.out_file, pi_range=tuple(args.pi) if args.pi else None,
+                  event_flags=args.flags or None, timefile=args.timefile)
+
+
+def cmd_split(args):
+    from band_split import split_event_file
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    edges = args.bands
+    if args.equal_counts is not None:
+        import numpy as np
+        from astropy.io import fits
+        from instrumentation import stage
+        with stage('fits_read'), fits.open(args.evt_file, memmap=True) as hdul:
+            pi = np.asarray(hdul['EVENTS'].data['PI'])
+        edges = _energy_edges(args, pi=pi)
+    written, _ = split_event_file(args.evt_file, _bands(edges), out_dir=args.out_dir)
+    for path in written.values():
+        print(path)
+
+
+def cmd_calibrate(args):
+    from calibrate import calibrate_event_file, calib_filename
+    out_file = args.out or calib_filename(args.evt_file)
+    if args.no_cache:
+        calibrate_event_file(args.evt_file, args.rmf, out_file)
+        return
+    from artifact_cache import ArtifactCache
+    hit = ArtifactCache().run('calibrate_event_file', [], [args.evt_file, args.rmf], out_file,
+                              lambda: calibrate_event_file(args.evt_file, args.rmf, out_file))
+    print(f"{out_file} ({'from the cache' if hit else 'calibrated'})")
+
+
+def cmd_fold(args):
+    from energy_phase_cube import load_energy_phase_cube, cube_filename
+    params = _ephemeris(args, args.calib_file)
+    cube = load_energy_phase_cube(args.calib_file, params['fr'], params['frdot'], params['tstart'], args.pbin,
+                                  orbit=_orbit(args))
+    print(f"Cube: {cube_filename(args.calib_file, args.pbin)}")
+    for e1, e2 in _bands(_energy_edges(args, cube=cube)):
+        _, profile, _ = cube.band_profile(e1, e2)
+        total = profile.sum()
+        fraction = (profile.max() - profile.min()) / (profile.max() + profile.min()) if total else float('nan')
+        print(f"  {e1}-{e2} (0.1 keV): {int(total)} events, pulsed fraction {fraction:.3f}")
+
+
+def cmd_search(args):
+    from plotfdotvf import fdotvf_search, best_point, plot_fdotvf, observation_id_of
+    ff, fd, stats, *_ = fdotvf_search(args.calib_file, args.fmin, args.fmax, args.fdotmin, args.fdotmax, args.oversample,
+                                      args.nharm, adaptive=args.adaptive, result_file=args.out, nproc=args.nproc,
+                                      bootstrap=args.bootstrap, seed=args.seed, orbit=_orbit(args))
+    best_f, best_fdot = best_point(ff, fd, stats)
+    print("Best f:", best_f)
+    print("Best fdot:", best_fdot)
+    if args.plot:
+        plot_fdotvf(ff, fd, stats, observation_id_of(args.calib_file), savefile=args.plot, show=False)
+
+
+def cmd_plot_pp(args):
+    import matplotlib
+    if args.save:
+        matplotlib.use('Agg')
+    from plotpp import fold_pulse_profile, plot_pulse_profile, file_labels
+    params = _ephemeris(args, args.calib_file)
+    profile, profile_err, _ = fold_pulse_profile(args.calib_file, params['fr'], params['frdot'], params['tstart'], args.pbin)
+    observation_id, gti_label = file_labels(args.calib_file)
+    plot_pulse_profile(profile, profile_err, observation_id, gti_label, savefile=args.save, show=not args.save)
+
+
+def cmd_plot_energy(args):
+    from energy_resolved_pp import plot_energy_resolved_pulse_profiles
+    from energy_phase_cube import load_energy_phase_cube
+    calib_file = os.path.join(args.analysis_dir, f"{args.base_filename}_nicer_xti_ev_calib.nc")
+    params = _ephemeris(args, calib_file)
+    cube = load_energy_phase_cube(calib_file, params['fr'], params['frdot'], params['tstart'], args.pbin)
+    plot_energy_resolved_pulse_profiles(args.analysis_dir, args.base_filename, args.pbin, params['fr'], params['frdot'],
+                                        params['tstart'], cube=cube, energy_list=_energy_edges(args, cube=cube),
+                                        nproc=args.nproc, stacked=args.stacked)
+
+
+def cmd_plot_lags(args):
+    import matplotlib
+    if args.save:
+        matplotlib.use('Agg')
+    from energy_phase_cube import load_energy_phase_cube
+    from phase_lags import energy_lags, write_lag_table, plot_phase_lags
+    params = _ephemeris(args, args.calib_file)
+    cube = load_energy_phase_cube(args.calib_file, params['fr'], params['frdot'], params['tstart'], args.pbin)
+    bands, result = energy_lags(cube, _energy_edges(args, cube=cube), args.nharm)
+    for (e1, e2), lag, lag_error in zip(bands, result['lag'], result['lag_error']):
+        print(f"  {e1 / 10:g}-{e2 / 10:g} keV: lag {lag:+.4f} +/- {lag_error:.4f} cycles")
+    if args.table:
+        write_lag_table(args.table, bands, result)
+    plot_phase_lags(bands, result, title=os.path.basename(args.calib_file), savefile=args.save, show=not args.save)
+
+
+def cmd_plot_psd(args):
+    import matplotlib
+    if args.save:
+        matplotlib.use('Agg')
+    from hendrics.io import load_events
+    from power_spectrum import PowerSpectrum, plot_power_spectrum
+    events = load_events(args.calib_file)
+    spectrum = PowerSpectrum.from_events(events.time, events.gti, args.segment, args.fmin, args.fmax, args.nharm)
+    candidates = spectrum.candidates(args.candidates)
+    for frequency, power, significance in candidates:
+        print(f"  {frequency:.6f} Hz: power {power:.1f} ({significance:.0f} sigma)")
+    fmin, fmax, fdotmin, fdotmax = spectrum.search_window(events.gti[0, 0])
+    print(f"Search window: f {fmin:.6f}-{fmax:.6f} Hz, fdot {fdotmin} to {fdotmax} Hz/s")
+    plot_power_spectrum(spectrum, candidates, title=os.path.basename(args.calib_file), savefile=args.save,
+                        show=not args.save)
+
+
+def cmd_plot_search(args):
+    import matplotlib
+    if args.save:
+        matplotlib.use('Agg')
+    from search_store import load_search_result
+    from plotfdotvf import plot_fdotvf, observation_id_of, RESULT_FILE, ADAPTIVE_RESULT_FILE
+    result_file = args.result_file
+    if result_file is None:
+        existing = [f for f in (RESULT_FILE, ADAPTIVE_RESULT_FILE) if os.path.exists(f)]
+        if not existing:
+            raise SystemExit(f"Neither {RESULT_FILE} nor {ADAPTIVE_RESULT_FILE} found, give the result file")
+        result_file = max(existing, key=os.path.getmtime)
+    ff, fd, stats, meta = load_search_result(result_file)
+    plot_fdotvf(ff, fd, stats, observation_id_of(meta.get('event_file', '')), savefile=args.save, show=not args.save)
+
+
+def cmd_plot_phaseogram(args):
+    import matplotlib
+    if args.save:
+        matplotlib.use('Agg')
+    from hendrics.io import load_events
+    from phaseogram import Phaseogram, plot_phaseogram
+    params = _ephemeris(args, args.calib_file)
+    events = load_events(args.calib_file)
+    phaseogram = Phaseogram.from_events(events.time, params['fr'], params['frdot'], params['tstart'], nbin=args.pbin,
+                                        time_resolution=min(args.width, args.step) / 4)
+    centres, profiles, errors = phaseogram.sliding(args.width, args.step)
+    plot_phaseogram(centres, profiles, errors, title=os.path.basename(args.calib_file), savefile=args.save,
+                    show=not args.save)
+
+
+def cmd_plot_joint(args):
+    import matplotlib
+    if args.save:
+        matplotlib.use('Agg')
+    from joint_profile import JointProfileAccumulator, CHECKPOINT_FILE, plot_joint_profile
+    accumulator = JointProfileAccumulator(os.path.join(args.data_path, CHECKPOINT_FILE.format(nbin=args.pbin)), args.pbin)
+    added = accumulator.update(args.data_path)
+    print(f"{len(added)} files folded, {len(accumulator.entries)} files in the joint profile")
+    plot_joint_profile(accumulator.profile, savefile=args.save, show=not args.save)
+
+
+def cmd_screen(args):
+    import matplotlib
+    if args.save:
+        matplotlib.use('Agg')
+    from screening_explorer import explore_thresholds
+    sweep, recommendation = explore_thresholds(args.mkf_file, evt_file=args.evt, min_fraction=args.min_fraction,
+                                               savefile=args.save, show=not args.save, sunshine=args.sunshine)
+    if args.gti_out:
+        from gti import write_gti
+        uo_max = float(recommendation['underonly_range'].split('-')[1])
+        oo_max = float(recommendation['overonly_range'].split('-')[1])
+        write_gti(args.gti_out, sweep.gti(uo_max, oo_max))
+        print(f"GTI of the recommended thresholds written to {args.gti_out}")
+
+
+def cmd_catalog(args):
+    from catalog import Catalog
+    with Catalog(args.data_path) as catalog:
+        relisted, indexed = catalog.refresh(full=args.full)
+        print(f"Re-listed {relisted} directories, {indexed} files indexed in them")
+        keys = {}
+        if args.obs:
+            keys['obs_id'] = args.obs
+        if args.gti:
+            keys['gti'] = None if args.gti.lower() == 'none' else args.gti
+        if args.stage:
+            keys['stage'] = args.stage
+        if args.band:
+            keys['e1'], keys['e2'] = args.band
+        for path in catalog.paths(**keys):
+            print(path)
+
+
+def cmd_rename(args):
+    from name_change import migrate_names
+    migrate_names(args.data_path, dry_run=not args.apply)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='nicer', description='NICER Her X-1 analysis')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('pipeline', help='Run pipeline stages for a set of observations')
+    p.add_argument('--config', help='JSON batch configuration (see batch_pipeline.DEFAULT_CONFIG)')
+    p.add_argument('--obs', type=int, nargs='+', help='Observation numbers (01 to 15)')
+    p.add_argument('--stages', nargs='+', help='Stages to run: calmerge_mkf, screen, nimaketime, niextract, '
+                                               'band_split, calibrate, fold (default: up to niextract; after the '
+                                               'barycentric correction, run calibrate fold)')
+    p.add_argument('--workers', type=int, help='Observations processed at once')
+    p.add_argument('--interactive', action='store_true', help='Run the interactive pipeline.py instead')
+    p.set_defaults(func=cmd_pipeline)
+
+    p = commands.add_parser('filter', help='Screen an event file on PI, EVENT_FLAGS and GTI')
+    p.add_argument('evt_file')
+    p.add_argument('out_file')
+    p.add_argument('--pi', type=int, nargs=2, default=[30, 1200], metavar=('MIN', 'MAX'), help='Inclusive PI range')
+    p.add_argument('--flags', default='bxxx1x000', help="EVENT_FLAGS bit pattern ('' to skip)")
+    p.add_argument('--timefile', help='Extra GTI file, e.g. the nimaketime .mkf_gti1')
+    p.set_defaults(func=cmd_filter)
+
+    p = commands.add_parser('split', help='Split an event file into energy bands')
+    p.add_argument('evt_file')
+    p.add_argument('--bands', type=int, nargs='+', default=DEFAULT_BANDS, help='Band edges in 0.1 keV')
+    p.add_argument('--equal-counts', type=int, metavar='N', help='N bands of equal counts instead of --bands')
+    p.add_argument('--out-dir', help='Output directory (default: next to the event file)')
+    p.set_defaults(func=cmd_split)
+
+    p = commands.add_parser('calibrate', help='Calibrate an event file to a _nicer_xti_ev_calib.nc file')
+    p.add_argument('evt_file')
+    p.add_argument('--rmf', required=True, help='RMF with the EBOUNDS table')
+    p.add_argument('--out', help='Output file')
+    p.add_argument('--no-cache', action='store_true', help='Do not use the artifact cache')
+    p.set_defaults(func=cmd_calibrate)
+
+    p = commands.add_parser('fold', help='Fold a calibrated file into its energy-phase cube')
+    p.add_argument('calib_file')
+    p.add_argument('--pbin', type=int, default=128)
+    p.add_argument('--bands', type=int, nargs='+', default=DEFAULT_BANDS, help='Band edges in 0.1 keV')
+    _add_adaptive(p)
+    _add_ephemeris(p)
+    _add_orbit(p)
+    p.set_defaults(func=cmd_fold)
+
+    p = commands.add_parser('search', help='Z_n^2 search over frequency and frequency derivative')
+    p.add_argument('calib_file')
+    p.add_argument('--fmin', type=float, default=0.805)
+    p.add_argument('--fmax', type=float, default=0.81)
+    p.add_argument('--fdotmin', type=float, default=-5e-7)
+    p.add_argument('--fdotmax', type=float, default=5e-7)
+    p.add_argument('--oversample', type=int, default=10)
+    p.add_argument('--nharm', type=int, default=2)
+    p.add_argument('--adaptive', action='store_true', help='Adaptive coarse-to-fine search instead of the full '
+                                                           '(resumable) grid')
+    p.add_argument('--seed', action='store_true', help='Narrow the window around the power spectrum candidate first')
+    p.add_argument('--bootstrap', action='store_true', help='Bootstrap errors of the adaptive search peak')
+    p.add_argument('--nproc', type=int, help='Worker processes (default: all cores)')
+    p.add_argument('--out', help='Search result file (default: foldingsearch.fits, '
+                                 'foldingsearch_adaptive.fits with --adaptive)')
+    p.add_argument('--plot', metavar='FILE', help='Also save the f-fdot plot')
+    _add_orbit(p)
+    p.set_defaults(func=cmd_search)
+
+    p = commands.add_parser('plot', help='Plots')
+    plots = p.add_subparsers(dest='plot', required=True)
+
+    q = plots.add_parser('pp', help='Pulse profile of one file, aligned to its minimum (plotpp.py)')
+    q.add_argument('calib_file')
+    q.add_argument('--pbin', type=int, default=128)
+    q.add_argument('--save', metavar='FILE', help='Save instead of showing')
+    _add_ephemeris(q)
+    q.set_defaults(func=cmd_plot_pp)
+
+    q = plots.add_parser('energy', help='Energy-resolved pulse profiles (energy_resolved_pp.py)')
+    q.add_argument('analysis_dir', help='energy_resolved_pp_* directory')
+    q.add_argument('base_filename', help='Base name of the full energy file, without extension')
+    q.add_argument('--pbin', type=int, default=128)
+    q.add_argument('--bands', type=int, nargs='+', default=DEFAULT_BANDS, help='Band edges in 0.1 keV')
+    _add_adaptive(q)
+    q.add_argument('--stacked', action='store_true', help='Also draw all bands in one stacked figure')
+    q.add_argument('--nproc', type=int, default=1, help='Rendering processes')
+    _add_ephemeris(q)
+    q.set_defaults(func=cmd_plot_energy)
+
+    q = plots.add_parser('lags', help='Energy-dependent phase lags and harmonic spectra of one file')
+    q.add_argument('calib_file', help='Full energy _nicer_xti_ev_calib.nc file')
+    q.add_argument('--bands', type=int, nargs='+', default=DEFAULT_BANDS, help='Band edges in 0.1 keV')
+    _add_adaptive(q)
+    q.add_argument('--nharm', type=int, default=3)
+    q.add_argument('--pbin', type=int, default=128)
+    q.add_argument('--table', metavar='FILE', help='Also write the CSV table')
+    q.add_argument('--save', metavar='FILE', help='Save instead of showing')
+    _add_ephemeris(q)
+    q.set_defaults(func=cmd_plot_lags)
+
+    q = plots.add_parser('psd', help='Averaged power spectrum, candidate frequencies and search window')
+    q.add_argument('calib_file')
+    q.add_argument('--segment', type=float, default=512.0, help='Segment length (s)')
+    q.add_argument('--fmin', type=float, default=0.5)
+    q.add_argument('--fmax', type=float, default=1.2)
+    q.add_argument('--nharm', type=int, default=2)
+    q.add_argument('--candidates', type=int, default=3)
+    q.add_argument('--save', metavar='FILE', help='Save instead of showing')
+    q.set_defaults(func=cmd_plot_psd)
+
+    q = plots.add_parser('search', help='f-fdot map of a search result file')
+    q.add_argument('result_file', nargs='?',
+                   help='Default: the newer of foldingsearch.fits and foldingsearch_adaptive.fits')
+    q.add_argument('--save', metavar='FILE', help='Save instead of showing')
+    q.set_defaults(func=cmd_plot_search)
+
+    q = plots.add_parser('phaseogram', help='Sliding-window phaseogram of one file')
+    q.add_argument('calib_file')
+    q.add_argument('--width', type=float, default=1000.0, help='Window width (s)')
+    q.add_argument('--step', type=float, default=250.0, help='Window step (s)')
+    q.add_argument('--pbin', type=int, default=64)
+    q.add_argument('--save', metavar='FILE', help='Save instead of showing')
+    _add_ephemeris(q)
+    q.set_defaults(func=cmd_plot_phaseogram)
+
+    q = plots.add_parser('joint', help='Joint pulse profile of every observation and GTI')
+    q.add_argument('data_path')
+    q.add_argument('--pbin', type=int, default=128)
+    q.add_argument('--save', metavar='FILE', help='Save instead of showing')
+    q.set_defaults(func=cmd_plot_joint)
+
+    p = commands.add_parser('screen', help='Exposure of a grid of underonly/overonly thresholds, from the MKF')
+    p.add_argument('mkf_file')
+    p.add_argument('--evt', help='Event file (e.g. the _ufa.evt) for the retained counts')
+    p.add_argument('--min-fraction', type=float, default=0.9,
+                   help='Recommended thresholds keep at least this fraction of the exposure')
+    p.add_argument('--sunshine', type=int, choices=[0, 1], help='Keep only SUNSHINE == this value')
+    p.add_argument('--gti-out', metavar='FILE', help='Write the GTI of the recommended thresholds')
+    p.add_argument('--save', metavar='FILE', help='Save the heat map instead of showing it')
+    p.set_defaults(func=cmd_screen)
+
+    p = commands.add_parser('catalog', help='Refresh and query the catalog of a data directory')
+    p.add_argument('data_path')
+    p.add_argument('--full', action='store_true', help='Re-list every directory, not only the changed ones')
+    p.add_argument('--obs', help='Observation ID')
+    p.add_argument('--gti', help="GTI folder, e.g. GTI1 ('none' for files outside the GTI folders)")
+    p.add_argument('--stage', help='calibrated, events, cube, barycentred, screened, cleaned, mkf, gti, rmf, plot '
+                                   'or other')
+    p.add_argument('--band', type=int, nargs=2, metavar=('E1', 'E2'), help='Energy band in 0.1 keV')
+    p.set_defaults(func=cmd_catalog)
+
+    p = commands.add_parser('rename', help='Rename underonly/overonly files to uo/oo across a data directory')
+    p.add_argument('data_path')
+    p.add_argument('--apply', action='store_true', help='Rename the files (default: dry run)')
+    p.set_defaults(func=cmd_rename)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# Energy-dependent phase lags of the pulse profiles.
+# All band profiles are stacked in one (nprofiles, nbin) matrix and transformed
+# with one batched real FFT. The cross spectrum with the full-energy reference
+# gives, per band, the cross-correlation peak (whole bins) and the phases of the
+# harmonics, which refine the lag below one bin. The same spectra give the
+# amplitude and phase of each harmonic versus energy. Profiles of many
+# observations can go in the same call, each row with its own reference.
+import os
+import csv
+import tempfile
+import numpy as np
+
+from instrumentation import instrumented, record
+
+
+def harmonic_spectra(profiles, errors=None, nharm=3):
+    """
+    Fractional amplitude and phase of the first nharm harmonics of every profile, with errors.
+    The phases are those of bootstrap.profile_metrics: the phase of each harmonic's maximum,
+    in cycles of the fundamental.
+    Args:
+    - profiles (array): (nprofiles, nbin) counts per phase bin.
+    - errors (array): Errors of the profiles, Poisson (sqrt of the counts) if None.
+
+    Returns:
+    - dict: amplitudes, amplitude_errors, phases, phase_errors, all (nprofiles, nharm).
+    """
+    profiles = np.atleast_2d(np.asarray(profiles, dtype=np.float64))
+    errors = np.sqrt(profiles) if errors is None else np.atleast_2d(np.asarray(errors, dtype=np.float64))
+    nbin = profiles.shape[1]
+    spectrum = np.fft.rfft(profiles, axis=1)
+    harmonics = spectrum[:, 1:nharm + 1]
+    k = np.arange(1, harmonics.shape[1] + 1)
+    total = spectrum[:, :1].real
+    # Error of the real and of the imaginary part of every harmonic
+    sigma = np.sqrt((errors ** 2).sum(axis=1, keepdims=True) / 2)
+    modulus = np.abs(harmonics)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'amplitudes': 2 * modulus / total,
+            'amplitude_errors': np.repeat(2 * sigma / total, modulus.shape[1], axis=1),
+            'phases': np.mod(-np.angle(harmonics) / (2 * np.pi * k) + 0.5 / nbin, 1),
+            'phase_errors': sigma / modulus / (2 * np.pi * k),
+        }
+
+
+@instrumented()
+def phase_lags(profiles, reference, errors=None, reference_errors=None, nharm=3):
+    """
+    Phase lag of every profile with respect to its reference, in cycles (positive: the
+    profile arrives later). The lag starts from the peak of the FFT cross-correlation and is
+    refined by the error-weighted mean of the cross spectrum phases of the first nharm harmonics.
+    The errors treat profile and reference as independent; for a band that is part of the
+    reference they are therefore slightly conservative.
+    Args:
+    - profiles (array): (nprofiles, nbin) counts per phase bin.
+    - reference (array): (nbin,) reference profile for all rows, or (nprofiles, nbin), one per row.
+    - errors, reference_errors (array): Errors of the profiles, Poisson if None.
+    - nharm (int): Harmonics used for the refinement (and returned per harmonic).
+
+    Returns:
+    - dict: lag and lag_error (nprofiles,), correlation_lag (nprofiles,), harmonic_lags and
+      harmonic_lag_errors (nprofiles, nharm), and the harmonic_spectra of the profiles.
+    """
+    profiles = np.atleast_2d(np.asarray(profiles, dtype=np.float64))
+    reference = np.broadcast_to(np.asarray(reference, dtype=np.float64), profiles.shape)
+    errors = np.sqrt(profiles) if errors is None else np.broadcast_to(errors, profiles.shape)
+    reference_errors = np.sqrt(reference) if reference_errors is None else np.broadcast_to(reference_errors, profiles.shape)
+    nprofiles, nbin = profiles.shape
+    nharm = min(nharm, nbin // 2)
+    record(profiles=nprofiles)
+
+    # One batched transform of profiles and references
+    spectra = np.fft.rfft(np.concatenate([profiles, reference]), axis=1)
+    spectrum, reference_spectrum = spectra[:nprofiles], spectra[nprofiles:]
+    cross = spectrum * np.conj(reference_spectrum)
+
+    # Whole-bin lag from the cross-correlation peak, in [-0.5, 0.5)
+    correlation = np.fft.irfft(cross, n=nbin, axis=1)
+    correlation_lag = np.mod(np.argmax(correlation, axis=1) / nbin + 0.5, 1) - 0.5
+
+    # Sub-bin residuals from the harmonic phases, after removing the correlation lag
+    k = np.arange(1, nharm + 1)
+    harmonics = cross[:, 1:nharm + 1] * np.exp(2j * np.pi * np.outer(correlation_lag, k))
+    residuals = -np.angle(harmonics) / (2 * np.pi * k)
+    sigma = np.sqrt((errors ** 2).sum(axis=1, keepdims=True) / 2)
+    reference_sigma = np.sqrt((reference_errors ** 2).sum(axis=1, keepdims=True) / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phase_error = np.hypot(sigma / np.abs(spectrum[:, 1:nharm + 1]),
+                               reference_sigma / np.abs(reference_spectrum[:, 1:nharm + 1]))
+        residual_errors = phase_error / (2 * np.pi * k)
+        weights = np.where(np.isfinite(residual_errors), 1 / residual_errors ** 2, 0)
+        weight = weights.sum(axis=1)
+        lag = correlation_lag + (weights * residuals).sum(axis=1) / weight
+        lag_error = 1 / np.sqrt(weight)
+
+    result = {
+        'lag': np.mod(lag + 0.5, 1) - 0.5,
+        'lag_error': lag_error,
+        'correlation_lag': correlation_lag,
+        # Each harmonic on its own, defined modulo 1/k
+        'harmonic_lags': np.mod(correlation_lag[:, None] + residuals + 0.5, 1) - 0.5,
+        'harmonic_lag_errors': residual_errors,
+    }
+    result.update(harmonic_spectra(profiles, errors, nharm))
+    return result
+
+
+def energy_lags(cube, energy_edges, nharm=3):
+    """
+    Phase lags of the bands between consecutive energy_edges (0.1 keV) of an energy-phase cube,
+    against the full-energy profile of the same cube.
+    Returns:
+    - tuple: (bands (nbands, 2), phase_lags result)
+    """
+    edges = np.asarray(energy_edges, dtype=np.int64)
+    bands = np.column_stack([edges[:-1], edges[1:]])
+    _, reference, _ = cube.profile()
+    return bands, phase_lags(cube.band_profiles(bands), reference, nharm=nharm)
+
+
+def write_lag_table(filename, bands, result):
+    """CSV table of the lags and harmonic spectra, one row per band (energies in keV), written atomically."""
+    nharm = result['harmonic_lags'].shape[1]
+    header = ['e_min_kev', 'e_max_kev', 'lag', 'lag_error', 'correlation_lag']
+    for k in range(1, nharm + 1):
+        header += [f'lag_h{k}', f'lag_h{k}_error', f'amplitude_h{k}', f'amplitude_h{k}_error',
+                   f'phase_h{k}', f'phase_h{k}_error']
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    with os.fdopen(fd, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for i, (e1, e2) in enumerate(np.asarray(bands).reshape(-1, 2)):
+            row = [e1 / 10, e2 / 10, result['lag'][i], result['lag_error'][i], result['correlation_lag'][i]]
+            for k in range(nharm):
+                row += [result['harmonic_lags'][i, k], result['harmonic_lag_errors'][i, k],
+                        result['amplitudes'][i, k], result['amplitude_errors'][i, k],
+                        result['phases'][i, k], result['phase_errors'][i, k]]
+            writer.writerow([f"{value:.6g}" for value in row])
+    os.replace(tmp, filename)
+    return filename
+
+
+@instrumented('plot')
+def plot_phase_lags(bands, result, title=None, savefile=None, show=True):
+    """Lag versus energy, with the fractional amplitude of every harmonic below."""
+    import matplotlib.pyplot as plt
+    bands = np.asarray(bands).reshape(-1, 2) / 10
+    energy = bands.mean(axis=1)
+    half_width = (bands[:, 1] - bands[:, 0]) / 2
+
+    fig, (ax_lag, ax_amplitude) = plt.subplots(2, 1, sharex=True, figsize=(8, 8))
+    ax_lag.errorbar(energy, result['lag'], result['lag_error'], half_width, fmt='o', color='blue')
+    ax_lag.axhline(0, color='grey', linestyle=':')
+    ax_lag.set_ylabel("Phase lag (cycles)", fontsize=16)
+    for k in range(result['amplitudes'].shape[1]):
+        ax_amplitude.errorbar(energy, result['amplitudes'][:, k], result['amplitude_errors'][:, k], half_width,
+                              fmt='o', label=f"harmonic {k + 1}")
+    ax_amplitude.set_ylabel("Fractional amplitude", fontsize=16)
+    ax_amplitude.set_xlabel("Energy (keV)", fontsize=16)
+    ax_amplitude.legend(loc="upper right")
+    if len(energy) > 1 and bands[-1, 1] / bands[0, 0] > 5:
+        ax_amplitude.set_xscale('log')
+    for ax in (ax_lag, ax_amplitude):
+        ax.tick_params(labelsize=14)
+    if title:
+        ax_lag.set_title(title, fontsize=16)
+    fig.tight_layout(pad=0.5)
+    if savefile:
+        fig.savefig(savefile)
+    if show:
+        plt.show()
+    return fig
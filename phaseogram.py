@@ -0,0 +1,170 @@
+# Dynamic phaseogram: pulse profiles resolved in time within one observation.
+# The events are folded once (same ephemeris convention as fold_events: fr, frdot,
+# tstart) into a 2-D (time x phase) histogram stored as a cumulative sum along
+# time. The profile of any time window is a difference of two rows of the prefix
+# sums, so sliding windows of any width and step come without folding again.
+import os
+import re
+import numpy as np
+
+from energy_phase_cube import pulse_phase
+from instrumentation import instrumented, stage, record
+
+
+def min_phase_shift(profile):
+    # Same alignment as plotpp.py: the minimum of the profile goes to phase 0.1
+    nbin = len(profile)
+    return (nbin // 10) - int(np.argmin(profile))
+
+
+def normalize_profiles(profiles, errors):
+    """Divide each profile (row) and its errors by its mean, as in plotpp.py. Empty rows become NaN."""
+    mean_rate = np.mean(profiles, axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(mean_rate > 0, 1 / mean_rate, np.nan)
+    return profiles * scale, errors * scale
+
+
+class Phaseogram:
+    def __init__(self, cumulative, time_edges, fr, frdot, tstart):
+        # cumulative[i] holds the summed profile of all time bins before i
+        self.cumulative = cumulative
+        self.time_edges = time_edges
+        self.fr = fr
+        self.frdot = frdot
+        self.tstart = tstart
+
+    @property
+    def nbin(self):
+        return self.cumulative.shape[1]
+
+    @property
+    def time_resolution(self):
+        return self.time_edges[1] - self.time_edges[0]
+
+    @property
+    def phase(self):
+        return (np.arange(self.nbin) + 0.5) / self.nbin
+
+    @classmethod
+    @instrumented('fold_events')
+    def from_events(cls, times, fr, frdot, tstart, nbin=128, time_resolution=100.0):
+        """
+        Fold the events once and histogram them in time and phase.
+        Args:
+        - times (array): Event times (s).
+        - fr, frdot, tstart (float): Ephemeris, as passed to fold_events.
+        - nbin (int): Number of phase bins.
+        - time_resolution (float): Width of the time bins (s). Windows are whole numbers of time bins.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        record(events=len(times))
+        ntime = max(int(np.ceil((times.max() - times.min()) / time_resolution)), 1)
+        time_edges = times.min() + time_resolution * np.arange(ntime + 1)
+        time_bin = np.minimum(((times - time_edges[0]) / time_resolution).astype(np.int64), ntime - 1)
+        phase_bin = np.minimum((pulse_phase(times, fr, frdot, tstart) * nbin).astype(np.int64), nbin - 1)
+        histogram = np.bincount(time_bin * nbin + phase_bin, minlength=ntime * nbin).reshape(ntime, nbin)
+
+        cumulative = np.zeros((ntime + 1, nbin), dtype=np.int64)
+        np.cumsum(histogram, axis=0, out=cumulative[1:])
+        return cls(cumulative, time_edges, fr, frdot, tstart)
+
+    def profile(self, tmin=None, tmax=None):
+        """Profile and Poisson errors of the events between tmin and tmax (rounded to time bins)."""
+        start = 0 if tmin is None else int(np.clip(np.searchsorted(self.time_edges, tmin), 0, len(self.time_edges) - 1))
+        stop = len(self.time_edges) - 1 if tmax is None else int(np.clip(np.searchsorted(self.time_edges, tmax), start, len(self.time_edges) - 1))
+        counts = (self.cumulative[stop] - self.cumulative[start]).astype(np.float64)
+        return self.phase, counts, np.sqrt(counts)
+
+    def sliding(self, width, step=None):
+        """
+        Profiles of sliding time windows.
+        Args:
+        - width (float): Window width (s), rounded to whole time bins.
+        - step (float): Window step (s), rounded to whole time bins. Defaults to width (no overlap).
+
+        Returns:
+        - tuple: (window centre times, profiles (nwindows, nbin), errors (nwindows, nbin))
+        """
+        ntime = len(self.time_edges) - 1
+        width_bins = int(np.clip(round(width / self.time_resolution), 1, ntime))
+        step_bins = width_bins if step is None else max(int(round(step / self.time_resolution)), 1)
+        starts = np.arange(0, ntime - width_bins + 1, step_bins)
+        profiles = (self.cumulative[starts + width_bins] - self.cumulative[starts]).astype(np.float64)
+        centres = (self.time_edges[starts] + self.time_edges[starts + width_bins]) / 2
+        return centres, profiles, np.sqrt(profiles)
+
+
+@instrumented('plot')
+def plot_phaseogram(centres, profiles, errors=None, title=None, savefile=None, show=True):
+    """
+    Normalized phaseogram, aligned with the minimum of the summed profile at phase 0.1
+    and shown over two cycles, as the profiles of plotpp.py.
+    Returns:
+    - tuple: (figure, normalized aligned profiles (nwindows, nbin))
+    """
+    import matplotlib.pyplot as plt
+    if errors is None:
+        errors = np.sqrt(profiles)
+    nbin = profiles.shape[1]
+    shift = min_phase_shift(profiles.sum(axis=0))
+    normalized, _ = normalize_profiles(profiles, errors)
+    aligned = np.roll(normalized, shift, axis=1)
+
+    # Cell edges in time, from the window centres
+    if len(centres) > 1:
+        mid = (centres[1:] + centres[:-1]) / 2
+        time_edges = np.r_[2 * centres[0] - mid[0], mid, 2 * centres[-1] - mid[-1]]
+    else:
+        time_edges = np.array([centres[0] - 0.5, centres[0] + 0.5])
+    phase_edges = np.arange(2 * nbin + 1) / nbin
+
+    fig = plt.figure(figsize=(8, 8))
+    plt.pcolormesh(phase_edges, time_edges - time_edges[0], np.tile(aligned, 2), shading='flat')
+    plt.xlabel("Phase", fontsize=16)
+    plt.ylabel(f"Time since {time_edges[0]:.1f} (s)", fontsize=16)
+    plt.colorbar(label="Normalized Count Rate")
+    if title:
+        plt.title(title, fontsize=16)
+    plt.tick_params(labelsize=14)
+    plt.xlim([0, 2])
+    plt.tight_layout(pad=0.5)
+    if savefile:
+        plt.savefig(savefile)
+    if show:
+        plt.show()
+    return fig, aligned
+
+
+def main():
+    from hendrics.io import load_events
+    from ni_utilities import load_timing_parameters
+
+    filename = input('Input of the nicer_xti_ev_calib.nc file: ')
+    data_path = input('Directory with timing_parameters.txt (default: current directory): ').strip() or '.'
+    obs_id_match = re.search(r"ni(\d{10})", filename)
+    observation_id = obs_id_match.group(1) if obs_id_match else "unknown"
+    gti_match = re.search(r"(GTI\d+)", filename)
+    obs_id_gti = f"{observation_id}_{gti_match.group(1)}" if gti_match else observation_id
+
+    timing_params = load_timing_parameters(data_path, obs_id_gti)
+    if not timing_params:
+        print(f"Timing parameters not found for {obs_id_gti}.")
+        return
+
+    width = float(input('Window width in seconds (default: 1000): ').strip() or 1000)
+    step = float(input(f'Window step in seconds (default: {width / 4:g}): ').strip() or width / 4)
+    pbin = 64
+
+    with stage('load_events'):
+        events = load_events(filename)
+    phaseogram = Phaseogram.from_events(events.time, timing_params['fr'], timing_params['frdot'],
+                                        timing_params['tstart'], nbin=pbin, time_resolution=min(width, step) / 4)
+    centres, profiles, errors = phaseogram.sliding(width, step)
+    savefile = os.path.splitext(os.path.basename(filename))[0] + f"_phaseogram_w{width:g}_s{step:g}.pdf"
+    np.savez(savefile.replace('.pdf', '.npz'), time=centres, phase=phaseogram.phase, profiles=profiles, errors=errors)
+    plot_phaseogram(centres, profiles, errors, title=f"Her X-1, {obs_id_gti}, Aligned to Min Phase", savefile=savefile)
+
+
+if __name__ == "__main__":
+    main()
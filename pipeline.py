@@ -4,12 +4,14 @@
 # specifically for the 2022 data. 
 
 
-import subprocess
 import os
 import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
 import numpy as np
 from astropy.io import fits
+from mkf_viewer import MKFViewer
+from gti import read_gti, exposure, plot_gti_spans
+from event_filter import filter_events
+from instrumentation import run_command, stage
 
 DATAPATH = '/Users/hongyuzhang/Documents/data/her_x-1/nicerl3_attempt'
 
@@ -54,81 +56,54 @@ def run_nicerl2_with_screen(obsID, nicerdir, underonly_range, overonly_range):
     os.chdir(nicerdir)
     nicerl2_command = f"nicerl2 {obsID} clobber=YES tasks=SCREEN overonly_range={overonly_range} underonly_range={underonly_range}"
     print(f"Running nicerl2 with command: {nicerl2_command}")
-    subprocess.run(nicerl2_command, shell=True)
+    run_command(nicerl2_command, shell=True)
 
 
     
 ### Read GTI fork and plot it out visually
 def plot_GTI(eventcldir, obsID):
-    os.chdir(eventcldir)
-    with fits.open(f'ni{obsID}_0mpu7_cl.evt') as evt:
-        GTI = evt[3].data
-        print(GTI)
-        height = 10  # A constant to maintain line height in the plot
-
-        # Extract start and end times from GTI data
-        starts = GTI['START']
-        stops = GTI['STOP']
-
-        # Find the total observation period
-        min_time = np.min(starts)
-        max_time = np.max(stops)
-
-        # Create line segments for GTI periods
-        lines = [[(start - min_time, height), (stop - min_time, height)] for start, stop in zip(starts, stops)]
-        lc = LineCollection(lines, colors='blue', linewidths=2)
-
-        # Initialize plot
-        fig, ax = plt.subplots(figsize=(12, 6))
-        ax.add_collection(lc)
-
-        # Plot non-GTI regions
-        # Start with the first non-GTI region before the first GTI
-        if min_time < starts[0]:
-            ax.axvspan(min_time - min_time, starts[0] - min_time, facecolor='red', alpha=0.5)
-        
-        # Plot intermediate non-GTI regions
-        for i in range(len(stops) - 1):
-            if starts[i+1] > stops[i]:
-                ax.axvspan(stops[i] - min_time, starts[i+1] - min_time, facecolor='red', alpha=0.5)
-        
-        # Plot the last non-GTI region after the last GTI
-        if max_time > stops[-1]:
-            ax.axvspan(stops[-1] - min_time, max_time - min_time, facecolor='red', alpha=0.5)
-
-        # Set plot limits and labels
-        ax.set_xlim(min_time - min_time, max_time - min_time)
-        ax.set_ylim(0, height * 1.2)
-        ax.set_xlabel("Time since start (s)")
-        ax.set_ylabel("GTI Status")
-        ax.set_title(f"GTI Visualization for OBSID {obsID}")
-
-        plt.show()
-
-
-
-def plot_over_underonly(obsID):
-    path = os.getcwd()
-    os.chdir(path + '/auxil/')
-    mkf_name = 'ni' + obsID + '.mkf'
-    with fits.open(mkf_name) as mkf:
-        # mkf.info()
-        prefilter = mkf[1].data
-        time = prefilter.field('TIME')
-        sunshine = prefilter.field('SUNSHINE')
-        num_fpm_on = prefilter.field('NUM_FPM_ON')
-        overonly = prefilter.field("FPM_OVERONLY_COUNT")
-        underonly = prefilter.field('FPM_UNDERONLY_COUNT')
-        kp = prefilter.field('KP')
-    fig, axs = plt.subplots(2, figsize=(12, 8))  # Adjust the figsize as needed
-    # fig.suptitle('Overonly and Underonly')
-    axs[0].plot(time,overonly,'ro',markersize = 1)
-    axs[0].set_title('Overonly')
-    axs[1].plot(time,underonly,'bo',markersize = 1)
-    axs[1].set_title('Underonly')
-    # plt.plot(time,overonly,'ro',time,underonly,'bo',markersize = 1)
+    # Good spans in blue and gaps in red, drawn as a single collection
+    evt_file = os.path.join(eventcldir, f'ni{obsID}_0mpu7_cl.evt')
+    gti = read_gti(evt_file)
+    print(f"{len(gti)} GTIs, total exposure {exposure(gti):.1f} s")
+
+    # Find the total observation period
+    min_time = np.min(gti[:, 0])
+    max_time = np.max(gti[:, 1])
+
+    # Initialize plot
+    fig, ax = plt.subplots(figsize=(12, 6))
+    plot_gti_spans(ax, gti, min_time, max_time, offset=min_time)
+
+    # Set plot limits and labels
+    ax.set_xlim(0, max_time - min_time)
+    ax.set_yticks([])
+    ax.set_xlabel("Time since start (s)")
+    ax.set_ylabel("GTI Status")
+    ax.set_title(f"GTI Visualization for OBSID {obsID}")
+
     plt.show()
 
+
+
+def plot_over_underonly(obsID, underonly_range='0-500', overonly_range='0-30'):
+    # Memory-mapped, min/max decimated view of the two columns, with the current
+    # thresholds and (if SCREEN already ran) the GTIs of the cleaned event file
+    path = os.getcwd()
+    mkf_name = os.path.join(path, 'auxil', 'ni' + obsID + '.mkf')
+    cl_evt = os.path.join(path, 'xti', 'event_cl', f'ni{obsID}_0mpu7_cl.evt')
+    gti = None
+    if os.path.exists(cl_evt):
+        with stage('fits_read'), fits.open(cl_evt, memmap=True) as evt:
+            gti = np.column_stack([evt['GTI'].data['START'], evt['GTI'].data['STOP']])
+    thresholds = {'FPM_OVERONLY_COUNT': [float(v) for v in overonly_range.split('-')],
+                  'FPM_UNDERONLY_COUNT': [float(v) for v in underonly_range.split('-')]}
+    viewer = MKFViewer(mkf_name, ['FPM_OVERONLY_COUNT', 'FPM_UNDERONLY_COUNT'], thresholds=thresholds, gti=gti,
+                       colors={'FPM_OVERONLY_COUNT': 'r', 'FPM_UNDERONLY_COUNT': 'b'})
+    viewer.axes[0].set_title('Overonly')
+    viewer.axes[1].set_title('Underonly')
+    viewer.show()
+
 def main():
     nicerdir = DATAPATH
     obsID = observationalID()
@@ -150,7 +125,7 @@ def main():
         # nicerl2 = "nicerl2 indir=" + obsID +  """ geomag_columns="kp_noaa.fits(KP)" clobber=yes > """ + obsID + "nicerl2.log"
         nicerl2 = "nicerl2 indir=" + obsID +  """ clobber=yes tasks=CALMERGE,MKF > """ + obsID + "nicerl2.log"
         print(nicerl2)
-        subprocess.run(nicerl2, shell = True)
+        run_command(nicerl2, shell = True)
 
     ### ploting the overonly and underonly ranges
     view_mkf = input('Viewing overonly and underonly range? [yes]')
@@ -166,6 +141,16 @@ def main():
     underonly_range = '0-500'
     overonly_range = '0-30'
 
+    # Exposure of a whole grid of ranges from the MKF, so SCREEN only has to run once
+    sweep = input('Sweep the OVER_ONLY and UNDER_ONLY thresholds over the MKF? [yes]: ')
+    if sweep == '' or sweep.lower() == 'yes':
+        from screening_explorer import explore_thresholds
+        ufa_evt = eventcldir + 'ni' + obsID + '_0mpu7_ufa.evt'
+        _, recommendation = explore_thresholds(datasetdir + '/auxil/ni' + obsID + '.mkf',
+                                               evt_file=ufa_evt if os.path.exists(ufa_evt) else None)
+        underonly_range = recommendation['underonly_range']
+        overonly_range = recommendation['overonly_range']
+
     # Ask the user if they want to change the defaults
     change_ranges = input("Do you want to change the range for OVER_ONLY and UNDER_ONLY counts? [yes/no] (default: yes): ").strip().lower()
     if change_ranges == '' or change_ranges == 'yes':
@@ -195,7 +180,7 @@ def main():
     if kp_index_choice == 'yes':
         filter_kp = 'nimaketime infile=' + datasetdir + '/auxil/ni' + obsID + '.mkf outfile=' + datasetdir + '/auxil/ni' + obsID + '.mkf_gti1 cleanup=YES underonly_range=' + underonly_range + ' overonly_range="' + overonly_range + ' expr="SUN_ANGLE>60 && KP<5" chatter=5 clobber=yes'
         print(filter_kp)
-        subprocess.run(filter_kp, shell = True)
+        run_command(filter_kp, shell = True)
 
     ### creating an analysis folder in the /xti/ folder
     mkdir = input('make analysis file? [yes]')
@@ -203,7 +188,7 @@ def main():
         mkdir = 'yes'
     if mkdir == 'yes': 
         os.chdir(xtidir)
-        subprocess.run('mkdir analysis', shell = True)
+        run_command('mkdir analysis', shell = True)
 
     ### copying event file over to analysis
     cpevt = input('Copy event file to analysis dir? [yes]')
@@ -212,17 +197,20 @@ def main():
     if cpevt == 'yes':
         os.chdir(eventcldir)
         copy_evt = 'cp ni' + obsID + '_0mpu7_cl.evt ' + xtidir + 'analysis/'
-        subprocess.run(copy_evt,shell = True)
-
-    #TODO
-    ### niextract 
-    niextract = "niextract-events filename='" + xtidir + "/analysis/ni" + obsID + "_0mpu7_cl.evt[PI=30:1200,EVENT_FLAGS=bxxx1x000]' eventsout=" + datasetdir + "/xti/analysis/ni" + obsID + "_0mpu7_cl_underonly" + underonly_num + "_overonly" + overonly_num+ ".evt timefile=" + datasetdir + "/auxil/ni" + obsID + ".mkf_gti1 gti=GTI chatter=5"
+        run_command(copy_evt,shell = True)
+
+    ### niextract, done in-process: PI=30:1200, EVENT_FLAGS=bxxx1x000 and the .mkf_gti1 timefile
+    underonly_num = underonly_range.split('-')[1]
+    overonly_num = overonly_range.split('-')[1]
+    evt_in = xtidir + "analysis/ni" + obsID + "_0mpu7_cl.evt"
+    evt_out = xtidir + "analysis/ni" + obsID + "_0mpu7_cl_uo" + underonly_num + "_oo" + overonly_num + ".evt"
+    timefile = datasetdir + "/auxil/ni" + obsID + ".mkf_gti1"
     niextract_choice = input('Run niextract? [yes]')
-    print(niextract)
+    print(f"Filtering {evt_in} to {evt_out} with timefile {timefile}")
     if niextract_choice == '':
         niextract_choice = 'yes'
     if niextract_choice == 'yes': 
-        subprocess.run(niextract, shell = True)
+        filter_events(evt_in, evt_out, pi_range=(30, 1200), event_flags='bxxx1x000', timefile=timefile)
 
 
 if __name__ == "__main__":
@@ -1,68 +1,162 @@
 #Hongyu Zhang 04/13/2024
 #Python script to run folding search over frequency and frequency dot
 #for Her X-1 stray light data
+#Importing this module has no side effects: run it as a script (or through `nicer.py search`)
+#to do the search, or call fdotvf_search / plot_fdotvf from other code
 
 #first import everything
 ######################################
-import pickle
-import matplotlib.pyplot as plt
 import re
 
 import numpy as np
 
-from hendrics.io import load_events
-
-from hendrics.efsearch import folding_search, z_n_search
-from hendrics.efsearch import z_n_search
+from instrumentation import stage
 #########################################
 
-# User input filename:
-filename = input('Input the event_nicer_xti_ev_calib.nc file: ')
-
-#Load in both NuSTAR event files
-events = load_events(filename)
-
-#do folding search. Scale the f and fdot range to focus in on your area of interest
-results = folding_search(events, 0.805, 0.81, step=None, func=z_n_search, oversample=10, fdotmin=-5e-7, fdotmax=5e-7)
-
-# Use a regular expression to find the observation ID
-match = re.search(r"ni(\d{10})", filename)
-
-# Check if a match was found and extract the observation ID
-if match:
-    observation_id = match.group(1)
-    print("Observation ID:", observation_id)
-else:
-    print("No observation ID found in the filename.")
-
-#assign results to variables
-ff,fd,stats,step,fdotsteps,length = results
-print("Done")
-
-#print the maximum Z statistic for F and Fdot
-indexfmax=np.where(stats == np.amax(stats))
-print("Best f:", ff[indexfmax] )
-print("Best fdot:", fd[indexfmax] )
-
-#Save the output of the folding search to separate data files. This is useful if you plan to do the 2-D Gaussian
-#fit for errors, but don't want to rerun the time consuming folding search over and over. Here I saved using the
-#pickle file format 
-with open('foldingsearch_ff.data', 'wb') as fp:
- 	pickle.dump(ff,fp)
-# 	
-with open('foldingsearch_fd.data', 'wb') as fp1:
- 	pickle.dump(fd,fp1)
-# 	
-with open('foldingsearch_stats.data', 'wb') as fp2:
- 	pickle.dump(stats,fp2)
-
-#plot fdot vs f
-plt.figure()
-plt.pcolormesh(ff,fd,stats)
-plt.xlabel("Frequency (Hz)",fontsize=18)
-plt.ylabel("Frequency dot",fontsize=18)
-plt.title(f"{observation_id}, 0.3-12 keV")
-plt.colorbar()
-plt.tight_layout(pad=0.5)
-plt.savefig("fdotvf.pdf")
-plt.show()
\ No newline at end of file
+#Default search window around the Her X-1 spin frequency
+FMIN, FMAX = 0.805, 0.81
+FDOTMIN, FDOTMAX = -5e-7, 5e-7
+#Default result files, one per mode, so an adaptive run never replaces the resume file of a uniform one
+RESULT_FILE = 'foldingsearch.fits'
+ADAPTIVE_RESULT_FILE = 'foldingsearch_adaptive.fits'
+
+
+def energy_band_of(filename):
+    #Energy band of the file, recorded with the search results
+    band_match = re.search(r"_E(\d+)_(\d+)", filename)
+    return f"{band_match.group(1)}-{band_match.group(2)}" if band_match else "full"
+
+
+def observation_id_of(filename):
+    # Use a regular expression to find the observation ID
+    match = re.search(r"ni(\d{10})", filename)
+    return match.group(1) if match else None
+
+
+def seeded_window(events, fmin=FMIN, fmax=FMAX, fdotmin=FDOTMIN, fdotmax=FDOTMAX, nharm=2):
+    #Narrow the search window from the averaged power spectrum of the events: the strongest
+    #candidate frequency, and fdot from its drift between segments (kept inside the given fdot range)
+    from power_spectrum import PowerSpectrum
+    gti = events.gti if getattr(events, 'gti', None) is not None else np.array([[events.time[0], events.time[-1]]])
+    spectrum = PowerSpectrum.from_events(events.time, gti, nharm=nharm)
+    if spectrum.nsegments == 0:
+        print("No GTI is long enough for the power spectrum, keeping the search window.")
+        return fmin, fmax, fdotmin, fdotmax
+    frequency, _, significance = spectrum.candidates(1)[0]
+    print(f"Power spectrum candidate: {frequency:.6f} Hz ({significance:.0f} sigma, {spectrum.nsegments} segments)")
+    return spectrum.search_window(gti[0, 0], fdotmin=fdotmin, fdotmax=fdotmax)
+
+
+def fdotvf_search(filename, fmin=FMIN, fmax=FMAX, fdotmin=FDOTMIN, fdotmax=FDOTMAX, oversample=10, nharm=2,
+                  adaptive=False, result_file=None, nproc=None, bootstrap=False, seed=False, orbit=None):
+    """
+    Z_n^2 search over frequency and frequency dot of a calibrated event file.
+    All results go to one self-describing file. In the uniform mode every finished fdot row is
+    written right away, so re-running the same search after a crash or time-out resumes where it
+    stopped. This full-grid search is the default. With adaptive, a coarse grid is searched, only the
+    best candidates are refined, and a high resolution patch around the peak is returned instead of
+    the full oversampled grid; bootstrap adds resampled errors on its peak position. With seed, the
+    window is first narrowed around the power spectrum candidate (see seeded_window). With orbit (a
+    binary_orbit.BinaryOrbit), the orbital delay is removed from the event times first, for files
+    barycentred without the orbit correction; its parameters are recorded with the results.
+    result_file defaults to RESULT_FILE for the uniform mode and ADAPTIVE_RESULT_FILE for the adaptive one.
+
+    Returns:
+    - tuple: (ff, fd, stats, step, fdotsteps, length), as hendrics' folding_search
+    """
+    from hendrics.io import load_events
+    from search_store import resumable_folding_search, save_search_result
+
+    if result_file is None:
+        result_file = ADAPTIVE_RESULT_FILE if adaptive else RESULT_FILE
+    #Load in the event file
+    with stage('load_events'):
+        events = load_events(filename)
+    energy_band = energy_band_of(filename)
+    orbit_description = None
+    if orbit is not None:
+        from binary_orbit import demodulate_events
+        with stage('demodulate'):
+            events = demodulate_events(events, orbit)
+        orbit_description = ' '.join(repr(float(value)) for value in orbit.parameters())
+    if seed:
+        fmin, fmax, fdotmin, fdotmax = seeded_window(events, fmin, fmax, fdotmin, fdotmax, nharm)
+        print(f"Search window: f {fmin:.6f}-{fmax:.6f} Hz, fdot {fdotmin:.3g} to {fdotmax:.3g} Hz/s")
+
+    #The Z_n^2 grid is sharded over all cores, same outputs as hendrics' folding_search with z_n_search
+    if adaptive:
+        from fdot_search import adaptive_zn_search, relative_times
+        best_f, best_fdot, (ff, fd, stats), nevals = adaptive_zn_search(events, fmin, fmax, step=None, oversample=oversample, fdotmin=fdotmin, fdotmax=fdotmax, nharm=nharm, nproc=nproc)
+        #Same length as the uniform grid: the last event time from the start of the first GTI
+        length = relative_times(events)[-1]
+        results = ff, fd, stats, ff[0, 1] - ff[0, 0], fd[1, 0] - fd[0, 0] if len(fd) > 1 else 0, length
+        save_search_result(result_file, ff, fd, stats, {'event_file': filename, 'energy_band': energy_band, 'nharm': nharm,
+                                                        'orbit': orbit_description})
+        if bootstrap:
+            #Bootstrap errors on the peak position, resampling the events on the refined patch
+            from bootstrap import peak_uncertainties
+            f_err, fdot_err, _, _ = peak_uncertainties(relative_times(events), ff[0], fd[:, 0], nreplicates=200, nharm=nharm, nproc=nproc)
+            print(f"Bootstrap errors: f +/- {f_err:.3g} Hz, fdot +/- {fdot_err:.3g} Hz/s")
+    else:
+        results = resumable_folding_search(events, result_file, fmin, fmax, step=None, oversample=oversample, fdotmin=fdotmin, fdotmax=fdotmax, nharm=nharm,
+                                           nproc=nproc, event_file=filename, energy_band=energy_band, orbit=orbit_description)
+
+    #The output of the folding search is saved in result_file. This is useful if you plan to do the 2-D Gaussian
+    #fit for errors, but don't want to rerun the time consuming folding search over and over. Load it back with
+    #ff, fd, stats, meta = search_store.load_search_result(result_file), which memory-maps the stats
+    print(f"Search results saved to {result_file}")
+    return results
+
+
+def best_point(ff, fd, stats):
+    #the maximum Z statistic for F and Fdot
+    indexfmax = np.unravel_index(np.nanargmax(stats), stats.shape)
+    return ff[indexfmax], fd[indexfmax]
+
+
+def plot_fdotvf(ff, fd, stats, observation_id=None, savefile="fdotvf.pdf", show=True):
+    #plot fdot vs f
+    import matplotlib.pyplot as plt
+    with stage('plot'):
+        plt.figure()
+        plt.pcolormesh(ff,fd,stats)
+        plt.xlabel("Frequency (Hz)",fontsize=18)
+        plt.ylabel("Frequency dot",fontsize=18)
+        plt.title(f"{observation_id}, 0.3-12 keV")
+        plt.colorbar()
+        plt.tight_layout(pad=0.5)
+        if savefile:
+            plt.savefig(savefile)
+    if show:
+        plt.show()
+
+
+def main():
+    # User input filename:
+    filename = input('Input the event_nicer_xti_ev_calib.nc file: ')
+    adaptive = input('Use the adaptive coarse-to-fine search? [yes/no] (default: no): ').strip().lower()
+    seed = input('Narrow the search window from the power spectrum first? [yes/no] (default: yes): ').strip().lower()
+
+    #do folding search. Scale the f and fdot range to focus in on your area of interest
+    results = fdotvf_search(filename, adaptive=adaptive == 'yes', seed=seed in ('', 'yes'))
+
+    # Check if a match was found and extract the observation ID
+    observation_id = observation_id_of(filename)
+    if observation_id:
+        print("Observation ID:", observation_id)
+    else:
+        print("No observation ID found in the filename.")
+
+    #assign results to variables
+    ff,fd,stats,step,fdotsteps,length = results
+    print("Done")
+
+    best_f, best_fdot = best_point(ff, fd, stats)
+    print("Best f:", best_f)
+    print("Best fdot:", best_fdot)
+
+    plot_fdotvf(ff, fd, stats, observation_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# Quick-look averaged power spectrum, to find the spin frequency before the Z_n^2
+# search instead of searching a fixed window. The events are binned in segments of
+# fixed length inside the GTIs and every segment is transformed with a real FFT,
+# a chunk of segments at a time, so memory stays bounded whatever the observation
+# length. Only the band of interest of each segment's Leahy-normalized power is
+# kept: its average gives the candidate frequencies, and the drift of the peak
+# from segment to segment gives an estimate of fdot. Together they narrow the
+# f / fdot window handed to plotfdotvf.fdotvf_search.
+import numpy as np
+
+from gti import union
+from instrumentation import instrumented, record
+
+SEGMENT_LENGTH = 512.0  # s
+# Quick-look band, around the Her X-1 spin frequency (0.8078 Hz) with room for drifts
+FMIN, FMAX = 0.5, 1.2
+PAD = 4  # Zero padding of every segment, for the peak position between Fourier frequencies
+CHUNK_SEGMENTS = 32
+# Default separation of the candidates, in Fourier frequencies of a segment (1 / segment_length)
+SEPARATION_BINS = 8
+# A weaker peak is leakage of a stronger candidate if its excess power is below this many times
+# the sidelobe envelope 1 / (pi * offset in Fourier frequencies)^2 of the candidate's excess
+LEAKAGE_MARGIN = 3
+
+
+def segment_starts(gti, segment_length):
+    """Start times of all whole segments of segment_length that fit in the GTIs."""
+    gti = union(gti)
+    counts = np.floor((gti[:, 1] - gti[:, 0]) / segment_length).astype(np.int64)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(gti[:, 0], counts) + within * segment_length
+
+
+def _peak_offset(left, centre, right):
+    # Vertex of the parabola through three equally spaced points, in bins from the centre
+    denominator = left - 2 * centre + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator < 0, 0.5 * (left - right) / denominator, 0.0)
+
+
+class PowerSpectrum:
+    def __init__(self, frequencies, segment_powers, segment_times, segment_counts, segment_length, nharm):
+        # Leahy powers (noise level 2) of every segment, on the frequencies of the band
+        # up to nharm times its top so the harmonics can be summed
+        self.frequencies = frequencies
+        self.segment_powers = segment_powers
+        self.segment_times = segment_times
+        self.segment_counts = segment_counts
+        self.segment_length = segment_length
+        self.nharm = nharm
+
+    @classmethod
+    @instrumented('power_spectrum')
+    def from_events(cls, times, gti, segment_length=SEGMENT_LENGTH, fmin=FMIN, fmax=FMAX, nharm=2, dt=None,
+                    pad=PAD, chunk=CHUNK_SEGMENTS):
+        """
+        Args:
+        - times (array): Sorted event times (may be memory-mapped, only one chunk is binned at a time).
+        - gti (array): (n, 2) GTIs; only whole segments inside them are used.
+        - segment_length (float): Length of the segments in s.
+        - fmin, fmax (float): Band of the candidate frequencies (Hz).
+        - nharm (int): Harmonics summed in the candidate power, as in Z_n^2.
+        - dt (float): Bin time, by default fine enough for the highest harmonic.
+        - pad (int): Zero padding factor of the FFTs.
+        - chunk (int): Segments binned and transformed together.
+        """
+        if dt is None:
+            dt = 1 / (4 * nharm * fmax)
+        nbin = int(round(segment_length / dt))
+        dt = segment_length / nbin
+        nfft = pad * nbin
+        kmin = int(np.ceil(fmin * nfft * dt))
+        kmax = int(np.floor(fmax * nfft * dt))
+        kstop = min(nharm * kmax + 1, nfft // 2 + 1)
+
+        starts = segment_starts(gti, segment_length)
+        record(segments=len(starts))
+        powers = np.empty((len(starts), kstop - kmin))
+        counts = np.zeros(len(starts))
+        for first in range(0, len(starts), chunk):
+            seg = starts[first:first + chunk]
+            lo, hi = np.searchsorted(times, [seg[0], seg[-1] + segment_length])
+            chunk_times = np.asarray(times[lo:hi], dtype=np.float64)
+            index = np.searchsorted(seg, chunk_times, side='right') - 1
+            offset = chunk_times - seg[index]
+            inside = (index >= 0) & (offset < segment_length)
+            bins = np.minimum((offset[inside] / dt).astype(np.int64), nbin - 1)
+            lc = np.bincount(index[inside] * nbin + bins, minlength=len(seg) * nbin).reshape(len(seg), nbin)
+            nphot = lc.sum(axis=1)
+            spectrum = np.fft.rfft(lc, n=nfft, axis=1)[:, kmin:kstop]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                powers[first:first + len(seg)] = np.where(nphot[:, None] > 0,
+                                                          2 * np.abs(spectrum) ** 2 / nphot[:, None], 0)
+            counts[first:first + len(seg)] = nphot
+        frequencies = np.arange(kmin, kstop) / (nfft * dt)
+        return cls(frequencies, powers, starts + segment_length / 2, counts, segment_length, nharm)
+
+    @property
+    def nsegments(self):
+        return len(self.segment_times)
+
+    def _summed(self, powers):
+        # Harmonic sum P(f) + P(2f) + ... for the frequencies of the band, on the padded grid
+        step = self.frequencies[1] - self.frequencies[0]
+        kmin = int(round(self.frequencies[0] / step))
+        nband = int(np.searchsorted(self.frequencies, self.frequencies[-1] / self.nharm, side='right'))
+        total = np.zeros(powers.shape[:-1] + (nband,))
+        for k in range(1, self.nharm + 1):
+            index = k * (np.arange(nband) + kmin) - kmin
+            valid = index < powers.shape[-1]
+            total[..., valid] += powers[..., index[valid]]
+        return self.frequencies[:nband], total
+
+    def power(self):
+        """(frequencies, harmonic-summed Leahy power averaged over the segments); noise level 2 * nharm."""
+        return self._summed(self.segment_powers.mean(axis=0))
+
+    def candidates(self, ncandidates=3, separation=None):
+        """
+        Strongest peaks of the averaged spectrum, at least separation Hz apart (default
+        SEPARATION_BINS / segment_length), leaving out the peaks that the spectral leakage of a
+        stronger candidate explains.
+        Returns:
+        - list: (frequency, averaged summed power, significance in noise standard deviations).
+        """
+        frequencies, power = self.power()
+        separation = SEPARATION_BINS / self.segment_length if separation is None else separation
+        step = frequencies[1] - frequencies[0]
+        # Noise of the average of nsegments sums of nharm Leahy powers (chi^2 with 2 nharm dof)
+        noise_mean = 2 * self.nharm
+        noise_std = 2 * np.sqrt(self.nharm / max(self.nsegments, 1))
+        found = []
+        remaining = power.copy()
+        while len(found) < ncandidates:
+            i = int(np.argmax(remaining))
+            if not np.isfinite(remaining[i]):
+                break
+            remaining[np.abs(frequencies - frequencies[i]) < separation] = -np.inf
+            offset = _peak_offset(*power[[max(i - 1, 0), i, min(i + 1, len(power) - 1)]]) if 0 < i < len(power) - 1 else 0.0
+            frequency = frequencies[i] + offset * step
+            excess = power[i] - noise_mean
+            if any(excess < LEAKAGE_MARGIN * (stronger - noise_mean)
+                   / (np.pi * max(abs(frequency - f) * self.segment_length, 1)) ** 2
+                   for f, stronger, _ in found):
+                continue
+            found.append((frequency, power[i], excess / noise_std))
+        return found
+
+    def drift(self, frequency, width=None, min_power=None):
+        """
+        Peak frequency of every segment near frequency, and a straight-line fit f(t) = f0 + fdot (t - t0)
+        to the segments where the pulsation is detected.
+        Args:
+        - width (float): Half width of the peak search in each segment (default 2 / segment_length).
+        - min_power (float): Summed Leahy power a segment peak needs (default noise mean + 5 noise sigma).
+
+        Returns:
+        - dict: times, frequencies and powers of the detected segment peaks, and fdot, fdot_error,
+          frequency (at the first segment time), frequency_error; fdot is None with fewer than 4 segments.
+        """
+        width = 2 / self.segment_length if width is None else width
+        min_power = 2 * self.nharm + 10 * np.sqrt(self.nharm) if min_power is None else min_power
+        frequencies, summed = self._summed(self.segment_powers)
+        window = np.flatnonzero(np.abs(frequencies - frequency) <= width)
+        rows = np.arange(self.nsegments)
+        peak = window[np.argmax(summed[:, window], axis=1)]
+        peak_power = summed[rows, peak]
+        left = summed[rows, np.maximum(peak - 1, 0)]
+        right = summed[rows, np.minimum(peak + 1, summed.shape[1] - 1)]
+        peak_frequency = frequencies[peak] + _peak_offset(left, peak_power, right) * (frequencies[1] - frequencies[0])
+
+        detected = peak_power >= min_power
+        result = {'times': self.segment_times[detected], 'frequencies': peak_frequency[detected],
+                  'powers': peak_power[detected], 'fdot': None, 'fdot_error': None,
+                  'frequency': frequency, 'frequency_error': width}
+        if detected.sum() >= 4:
+            t0 = self.segment_times[0]
+            coefficients, covariance = np.polyfit(result['times'] - t0, result['frequencies'], 1, cov=True)
+            result.update(fdot=coefficients[0], fdot_error=np.sqrt(covariance[0, 0]),
+                          frequency=coefficients[1], frequency_error=np.sqrt(covariance[1, 1]))
+        elif detected.any():
+            result.update(frequency=np.average(result['frequencies'], weights=result['powers']))
+        return result
+
+    def search_window(self, ref_time, nsigma=5, fdotmin=None, fdotmax=None):
+        """
+        f / fdot window for the Z_n^2 search, centred on the strongest candidate at ref_time
+        (the reference time of the search, the start of the first GTI).
+        The frequency half width covers nsigma errors of the drift fit (at least one Fourier
+        frequency of a segment); the fdot window is nsigma errors around the drift estimate,
+        kept inside [fdotmin, fdotmax] when given, or is [fdotmin, fdotmax] if fdot was not measured.
+        Returns:
+        - tuple: (fmin, fmax, fdotmin, fdotmax)
+        """
+        candidate = self.candidates(1)[0][0]
+        drift = self.drift(candidate)
+        if drift['fdot'] is None:
+            centre = drift['frequency']
+            half_width = 1 / self.segment_length
+            return centre - half_width, centre + half_width, fdotmin, fdotmax
+        centre = drift['frequency'] + drift['fdot'] * (ref_time - self.segment_times[0])
+        half_width = max(nsigma * drift['frequency_error'], 1 / self.segment_length)
+        low = drift['fdot'] - nsigma * drift['fdot_error']
+        high = drift['fdot'] + nsigma * drift['fdot_error']
+        if fdotmin is not None and fdotmax is not None:
+            low, high = max(low, fdotmin), min(high, fdotmax)
+            if high <= low:
+                low, high = fdotmin, fdotmax
+        return centre - half_width, centre + half_width, low, high
+
+
+@instrumented('plot')
+def plot_power_spectrum(spectrum, candidates=None, title=None, savefile=None, show=True):
+    """Averaged harmonic-summed power, with the candidates marked."""
+    import matplotlib.pyplot as plt
+    frequencies, power = spectrum.power()
+    fig = plt.figure(figsize=(10, 5))
+    plt.plot(frequencies, power, color='blue', drawstyle='steps-mid')
+    plt.axhline(2 * spectrum.nharm, color='grey', linestyle=':')
+    for frequency, _, significance in candidates or []:
+        plt.axvline(frequency, color='red', linestyle='--', alpha=0.5)
+        plt.text(frequency, plt.ylim()[1] * 0.95, f" {frequency:.5f} Hz ({significance:.0f} sigma)", color='red')
+    plt.xlabel("Frequency (Hz)", fontsize=16)
+    plt.ylabel(f"Leahy power, {spectrum.nharm} harmonics", fontsize=16)
+    if title:
+        plt.title(title, fontsize=16)
+    plt.tick_params(labelsize=14)
+    plt.tight_layout(pad=0.5)
+    if savefile:
+        plt.savefig(savefile)
+    if show:
+        plt.show()
+    return fig
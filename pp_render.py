@@ -0,0 +1,113 @@
+# Headless batch renderer for the energy-resolved pulse profile plots.
+# One Agg figure (no pyplot, no interactive backend) is styled once, and for every
+# band only the data of its artists is updated before the PNG is written, instead
+# of creating, styling and closing a figure per band. Bands can be spread over
+# worker processes (one figure per worker), or drawn as one stacked multi-band
+# figure. The output keeps the pulse_profiles/herx1_nicer_pp_en_<band>.png layout.
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from instrumentation import instrumented, record
+
+
+def profile_plot_data(profile, profile_err, shift):
+    """Profile and errors normalized by the mean, rolled by shift and tiled over three cycles, as in plotpp.py."""
+    mean_rate = np.mean(profile)
+    profile_shifted = np.roll(profile / mean_rate, shift)
+    profile_err_shifted = np.roll(profile_err / mean_rate, shift)
+    return np.tile(profile_shifted, 3), np.tile(profile_err_shifted, 3)
+
+
+class ProfileRenderer:
+    """A single reusable Agg figure with the style of the energy-resolved pulse profile plots."""
+
+    def __init__(self, pbin, figsize=(10, 5), dpi=100):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.ticker import FormatStrFormatter
+        self.pbin = pbin
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        phase = np.arange(3 * pbin) / pbin
+        zeros = np.zeros(3 * pbin)
+        self.line, _, (self.bars,) = self.ax.errorbar(phase, zeros, zeros, color='blue', drawstyle='steps-mid', label=" ")
+        self.ax.set_xlabel("Phase", fontsize=16)
+        self.ax.set_ylabel("Normalized Count Rate (cts/s)", fontsize=16)
+        self.title = self.ax.set_title(" ", fontsize=16)
+        self.legend = self.ax.legend(loc="upper right")
+        self.ax.tick_params(labelsize=16)
+        self.ax.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))  # y-axis labels to 2 decimal places
+        self.ax.set_xlim([0, 2])
+        self._laid_out = False
+
+    def render(self, profile_extended, profile_err_extended, label, title, filename):
+        phase = np.arange(len(profile_extended)) / self.pbin
+        self.line.set_data(phase, profile_extended)
+        self.bars.set_segments(np.stack([np.column_stack([phase, profile_extended - profile_err_extended]),
+                                         np.column_stack([phase, profile_extended + profile_err_extended])], axis=1))
+        self.legend.get_texts()[0].set_text(label)
+        self.title.set_text(title)
+        low = np.nanmin(profile_extended - profile_err_extended)
+        high = np.nanmax(profile_extended + profile_err_extended)
+        margin = 0.05 * (high - low) or 0.05
+        self.ax.set_ylim(low - margin, high + margin)
+        if not self._laid_out:
+            # The layout depends only on the labels and tick sizes, so it is computed once
+            self.figure.tight_layout(pad=0.5)
+            self._laid_out = True
+        # Straight to the Agg canvas: savefig would draw the figure a second time
+        self.figure.canvas.print_png(filename)
+
+
+def _render_chunk(pbin, items):
+    renderer = ProfileRenderer(pbin)
+    for profile_extended, profile_err_extended, label, title, filename in items:
+        renderer.render(profile_extended, profile_err_extended, label, title, filename)
+    return [item[-1] for item in items]
+
+
+@instrumented('plot')
+def render_profiles(items, pbin, nproc=1):
+    """
+    Render one PNG per item with a reused figure.
+    Args:
+    - items (list): (profile_extended, profile_err_extended, label, title, filename) tuples.
+    - pbin (int): Number of phase bins of the profiles.
+    - nproc (int): Worker processes, each with its own figure (None for all cores).
+
+    Returns:
+    - list: The written files.
+    """
+    record(plots=len(items))
+    nproc = min(nproc or os.cpu_count() or 1, len(items)) if items else 1
+    if nproc <= 1:
+        return _render_chunk(pbin, items)
+    chunks = [items[i::nproc] for i in range(nproc)]
+    with ProcessPoolExecutor(max_workers=nproc) as pool:
+        return [filename for written in pool.map(_render_chunk, [pbin] * nproc, chunks) for filename in written]
+
+
+@instrumented('plot')
+def render_stacked(items, pbin, title, filename, panel_height=1.6):
+    """All bands in one figure, one panel per band stacked with a shared phase axis."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.ticker import FormatStrFormatter
+    figure = Figure(figsize=(10, 1.5 + panel_height * len(items)))
+    FigureCanvasAgg(figure)
+    axes = figure.subplots(len(items), 1, sharex=True, squeeze=False)[:, 0]
+    for ax, (profile_extended, profile_err_extended, label, _, _) in zip(axes, items):
+        ax.errorbar(np.arange(len(profile_extended)) / pbin, profile_extended, profile_err_extended, color='blue',
+                    drawstyle='steps-mid', label=label)
+        ax.legend(loc="upper right")
+        ax.tick_params(labelsize=12)
+        ax.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+    axes[0].set_xlim([0, 2])
+    axes[0].set_title(title, fontsize=16)
+    axes[-1].set_xlabel("Phase", fontsize=16)
+    figure.supylabel("Normalized Count Rate (cts/s)", fontsize=16)
+    figure.tight_layout(pad=0.5)
+    figure.savefig(filename)
+    return filename
@@ -0,0 +1,218 @@
+# Underonly / overonly threshold sweep over the MKF, to choose the nicerl2 SCREEN
+# ranges before running SCREEN instead of by trial and error.
+# The MKF filter columns are read once. Every MKF row (one time step) gets the
+# smallest grid threshold pair that keeps it, the rows are histogrammed on the
+# (underonly, overonly) grid, and a 2-D cumulative sum gives the good exposure,
+# the retained counts and the number of GTIs of every threshold pair at once.
+# The other nimaketime criteria (KP<5, SUN_ANGLE>60, optionally SUNSHINE) are
+# applied to all pairs alike.
+import numpy as np
+
+from gti import as_gti, union, intersection
+from instrumentation import instrumented, record, stage
+
+UNDERONLY, OVERONLY = 'FPM_UNDERONLY_COUNT', 'FPM_OVERONLY_COUNT'
+# Same defaults as pipeline.main() and the nimaketime expression
+DEFAULT_UNDERONLY_RANGE, DEFAULT_OVERONLY_RANGE = '0-500', '0-30'
+KP_MAX, SUN_ANGLE_MIN = 5, 60
+
+
+def parse_range(value_range):
+    low, high = value_range.split('-')
+    return float(low), float(high)
+
+
+def default_grid(values, nsteps=64):
+    """Thresholds at the quantiles of the values, so the grid follows the data."""
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return np.zeros(1)
+    return np.unique(np.quantile(values, np.linspace(0, 1, nsteps)))
+
+
+def _cumulative_histogram(i, j, shape, weights=None):
+    # cumulative[a, b]: sum of the weights of the rows with i <= a and j <= b
+    ok = (i < shape[0]) & (j < shape[1])
+    hist = np.bincount(i[ok] * shape[1] + j[ok], weights=None if weights is None else weights[ok],
+                       minlength=shape[0] * shape[1]).reshape(shape)
+    return hist.cumsum(axis=0).cumsum(axis=1)
+
+
+class ThresholdSweep:
+    def __init__(self, time, dt, base_good, uo_index, oo_index, uo_grid, oo_grid, counts=None):
+        # One entry per MKF row: its time and length, the KP / SUN_ANGLE / SUNSHINE selection,
+        # and the smallest grid index of each threshold that keeps the row (len(grid) if none does)
+        self.time = time
+        self.dt = dt
+        self.base_good = base_good
+        self.uo_index = uo_index
+        self.oo_index = oo_index
+        self.uo_grid = uo_grid
+        self.oo_grid = oo_grid
+        self.counts = counts
+
+    @classmethod
+    @instrumented('threshold_sweep')
+    def from_mkf(cls, mkf_file, uo_grid=None, oo_grid=None, evt_file=None, uo_min=0.0, oo_min=0.0,
+                 kp_max=KP_MAX, sun_angle_min=SUN_ANGLE_MIN, sunshine=None):
+        """
+        Args:
+        - mkf_file (str): MKF filter file (after nicerl2 tasks=MKF).
+        - uo_grid, oo_grid (array): Upper thresholds to try, from the data quantiles if None.
+        - evt_file (str): Event file whose events are counted per MKF row, for the retained counts.
+        - uo_min, oo_min (float): Lower ends of the ranges, the same for every pair.
+        - kp_max, sun_angle_min (float): KP < kp_max and SUN_ANGLE > sun_angle_min, as in the nimaketime expression.
+        - sunshine (int): Keep only SUNSHINE == sunshine (0 for orbit night), all rows if None.
+        """
+        from astropy.io import fits
+        with stage('fits_read'), fits.open(mkf_file, memmap=True) as hdul:
+            data = hdul[1].data
+            names = set(data.columns.names)
+            time = np.array(data['TIME'], dtype=np.float64)
+            uo = np.array(data[UNDERONLY], dtype=np.float64)
+            oo = np.array(data[OVERONLY], dtype=np.float64)
+            base_good = np.isfinite(uo) & np.isfinite(oo) & (uo >= uo_min) & (oo >= oo_min)
+            # Criteria on columns missing from the MKF are skipped
+            if 'KP' in names:
+                base_good &= np.array(data['KP'], dtype=np.float64) < kp_max
+            if 'SUN_ANGLE' in names:
+                base_good &= np.array(data['SUN_ANGLE'], dtype=np.float64) > sun_angle_min
+            if sunshine is not None and 'SUNSHINE' in names:
+                base_good &= np.array(data['SUNSHINE']) == sunshine
+        record(rows=len(time))
+
+        order = np.argsort(time, kind='stable')
+        time, uo, oo, base_good = time[order], uo[order], oo[order], base_good[order]
+        steps = np.diff(time)
+        dt = float(np.median(steps)) if len(steps) else 1.0
+
+        uo_grid = default_grid(uo[base_good]) if uo_grid is None else np.sort(np.asarray(uo_grid, dtype=np.float64))
+        oo_grid = default_grid(oo[base_good]) if oo_grid is None else np.sort(np.asarray(oo_grid, dtype=np.float64))
+        # Smallest threshold >= the row's value; rows failing the other criteria are never kept
+        uo_index = np.where(base_good, np.searchsorted(uo_grid, np.nan_to_num(uo, nan=np.inf)), len(uo_grid))
+        oo_index = np.where(base_good, np.searchsorted(oo_grid, np.nan_to_num(oo, nan=np.inf)), len(oo_grid))
+
+        counts = None
+        if evt_file is not None:
+            with stage('fits_read'), fits.open(evt_file, memmap=True) as hdul:
+                events = np.asarray(hdul['EVENTS'].data['TIME'], dtype=np.float64)
+            row = np.searchsorted(time, events, side='right') - 1
+            inside = (row >= 0) & (events < time[np.maximum(row, 0)] + dt)
+            counts = np.bincount(row[inside], minlength=len(time)).astype(np.float64)
+        return cls(time, dt, base_good, uo_index, oo_index, uo_grid, oo_grid, counts)
+
+    @property
+    def shape(self):
+        return len(self.uo_grid), len(self.oo_grid)
+
+    def exposure(self):
+        """(n_uo, n_oo) good exposure in s of every threshold pair."""
+        return self.dt * _cumulative_histogram(self.uo_index, self.oo_index, self.shape)
+
+    def retained_counts(self):
+        """(n_uo, n_oo) events kept by every threshold pair, None without an event file."""
+        if self.counts is None:
+            return None
+        return _cumulative_histogram(self.uo_index, self.oo_index, self.shape, self.counts)
+
+    def gti_counts(self):
+        """
+        (n_uo, n_oo) number of GTIs of every threshold pair: the kept rows minus the kept rows
+        whose previous row (one step earlier) is also kept.
+        """
+        kept = _cumulative_histogram(self.uo_index, self.oo_index, self.shape)
+        contiguous = np.r_[False, np.isclose(np.diff(self.time), self.dt)]
+        previous = np.flatnonzero(contiguous)
+        both = _cumulative_histogram(np.maximum(self.uo_index[previous], self.uo_index[previous - 1]),
+                                     np.maximum(self.oo_index[previous], self.oo_index[previous - 1]), self.shape)
+        return kept - both
+
+    def gti(self, uo_max, oo_max, gti=None):
+        """
+        GTI of one threshold pair (uo <= uo_max and oo <= oo_max, with the other criteria; thresholds
+        between grid points are rounded down to the grid), optionally intersected with another GTI,
+        e.g. that of the event file.
+        """
+        uo_index = np.searchsorted(self.uo_grid, uo_max, side='right') - 1
+        oo_index = np.searchsorted(self.oo_grid, oo_max, side='right') - 1
+        keep = (self.uo_index <= uo_index) & (self.oo_index <= oo_index)
+        result = union(as_gti(self.time[keep], self.time[keep] + self.dt))
+        return result if gti is None else intersection(result, gti)
+
+    def recommend(self, min_fraction=0.9):
+        """
+        Recommended thresholds: among the pairs that keep at least min_fraction of the exposure
+        of the loosest pair, the one with the lowest count rate (least background) if the events
+        were counted, otherwise the tightest one (smallest thresholds, relative to the grids).
+        Returns:
+        - dict: underonly_range, overonly_range (strings for nicerl2), exposure, fraction, counts, ngti.
+        """
+        exposures = self.exposure()
+        allowed = exposures >= min_fraction * exposures[-1, -1]
+        counts = self.retained_counts()
+        if counts is not None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                score = np.where(exposures > 0, counts / exposures, np.inf)
+        else:
+            score = np.add.outer(np.arange(self.shape[0]) / self.shape[0], np.arange(self.shape[1]) / self.shape[1])
+        i, j = np.unravel_index(np.argmin(np.where(allowed, score, np.inf)), self.shape)
+        return {
+            'underonly_range': f"0-{self.uo_grid[i]:g}",
+            'overonly_range': f"0-{self.oo_grid[j]:g}",
+            'exposure': float(exposures[i, j]),
+            'fraction': float(exposures[i, j] / exposures[-1, -1]) if exposures[-1, -1] else 0.0,
+            'counts': None if counts is None else float(counts[i, j]),
+            'ngti': int(self.gti_counts()[i, j]),
+        }
+
+
+@instrumented('plot')
+def plot_threshold_sweep(sweep, recommendation=None, title=None, savefile=None, show=True):
+    """Exposure heat map over the thresholds (and the retained count rate if the events were counted)."""
+    import matplotlib.pyplot as plt
+    exposures = sweep.exposure()
+    counts = sweep.retained_counts()
+    panels = [(exposures / 1e3, "Good exposure (ks)")]
+    if counts is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            panels.append((np.where(exposures > 0, counts / exposures, np.nan), "Retained count rate (cts/s)"))
+
+    fig, axes = plt.subplots(1, len(panels), figsize=(7 * len(panels), 6), squeeze=False)
+    for ax, (values, label) in zip(axes[0], panels):
+        mesh = ax.pcolormesh(sweep.oo_grid, sweep.uo_grid, values, shading='nearest')
+        fig.colorbar(mesh, ax=ax, label=label)
+        ax.set_xlabel("OVERONLY threshold", fontsize=16)
+        ax.set_ylabel("UNDERONLY threshold", fontsize=16)
+        ax.tick_params(labelsize=14)
+        default_uo, default_oo = parse_range(DEFAULT_UNDERONLY_RANGE)[1], parse_range(DEFAULT_OVERONLY_RANGE)[1]
+        ax.plot(default_oo, default_uo, 'wx', markersize=10, label=f"default {default_uo:g} / {default_oo:g}")
+        if recommendation:
+            uo, oo = parse_range(recommendation['underonly_range'])[1], parse_range(recommendation['overonly_range'])[1]
+            ax.plot(oo, uo, 'r*', markersize=14, label=f"recommended {uo:g} / {oo:g}")
+        ax.set_xlim(sweep.oo_grid[0], sweep.oo_grid[-1])
+        ax.set_ylim(sweep.uo_grid[0], sweep.uo_grid[-1])
+        ax.legend(loc="lower right")
+    if title:
+        fig.suptitle(title, fontsize=16)
+    fig.tight_layout(pad=0.5)
+    if savefile:
+        fig.savefig(savefile)
+    if show:
+        plt.show()
+    return fig
+
+
+def explore_thresholds(mkf_file, evt_file=None, min_fraction=0.9, savefile=None, show=True, **kwargs):
+    """Sweep, print the recommendation and plot the heat map. Returns (sweep, recommendation)."""
+    sweep = ThresholdSweep.from_mkf(mkf_file, evt_file=evt_file, **kwargs)
+    recommendation = sweep.recommend(min_fraction)
+    loosest = sweep.exposure()[-1, -1]
+    print(f"{len(sweep.uo_grid)} x {len(sweep.oo_grid)} threshold pairs, up to {loosest:.0f} s of good time")
+    line = (f"Recommended: underonly_range={recommendation['underonly_range']} "
+            f"overonly_range={recommendation['overonly_range']}, {recommendation['exposure']:.0f} s "
+            f"({100 * recommendation['fraction']:.1f}%) in {recommendation['ngti']} GTIs")
+    if recommendation['counts'] is not None:
+        line += f", {recommendation['counts']:.0f} counts"
+    print(line)
+    plot_threshold_sweep(sweep, recommendation, title=mkf_file.split('/')[-1], savefile=savefile, show=show)
+    return sweep, recommendation
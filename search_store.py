@@ -0,0 +1,171 @@
+# Single self-describing, resumable container for the f-fdot search results,
+# replacing the three foldingsearch_*.data pickles. It is a FITS file with the
+# search metadata in the primary header, the trial frequencies and fdots, a
+# per-row completion flag and the stats image. The stats image is allocated on
+# disk up front and every fdot row is written in place as soon as it is done,
+# so an interrupted search resumes at the first missing row.
+import os
+import time
+import numpy as np
+from astropy.io import fits
+
+from fdot_search import relative_times, search_grid, zn_search_grid
+from instrumentation import instrumented, stage
+
+# Header keyword -> metadata name
+META_KEYWORDS = {
+    'EVTFILE': 'event_file',
+    'EBAND': 'energy_band',
+    'NHARM': 'nharm',
+    'REFTIME': 'ref_time',
+    'FMIN': 'fmin',
+    'FMAX': 'fmax',
+    'FSTEP': 'step',
+    'FDOTMIN': 'fdotmin',
+    'FDOTMAX': 'fdotmax',
+    'FDOTSTEP': 'fdotstep',
+    'LENGTH': 'length',
+    'ORBIT': 'orbit',
+}
+
+
+def _create_store(filename, frequencies, fdots, meta):
+    primary = fits.PrimaryHDU()
+    for keyword, name in META_KEYWORDS.items():
+        if meta.get(name) is not None:
+            primary.header[keyword] = meta[name]
+    hdus = [primary,
+            fits.ImageHDU(np.asarray(frequencies, dtype=np.float64), name='FREQUENCY'),
+            fits.ImageHDU(np.asarray(fdots, dtype=np.float64), name='FDOT'),
+            fits.ImageHDU(np.zeros(len(fdots), dtype=np.uint8), name='ROWDONE')]
+    fits.HDUList(hdus).writeto(filename, overwrite=True)
+
+    # Append the stats image without building it in memory: write its header,
+    # then extend the file to the full (block-padded) size of the data
+    stats_header = fits.ImageHDU(np.zeros((1, 1)), name='STATS').header
+    stats_header['NAXIS1'] = len(frequencies)
+    stats_header['NAXIS2'] = len(fdots)
+    header_bytes = stats_header.tostring().encode('ascii')
+    data_bytes = len(frequencies) * len(fdots) * 8
+    padded = -(-data_bytes // 2880) * 2880
+    with open(filename, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        f.write(header_bytes)
+        f.truncate(f.tell() + padded)
+
+
+class SearchStore:
+    """
+    Resumable f-fdot search result file.
+    Open with SearchStore.open(filename, frequencies, fdots, meta) to create it or resume
+    a compatible one; write rows with write_row(row, stats_row); close() when done.
+    An unfinished file of a different search is never replaced, so it can still be resumed.
+    """
+
+    def __init__(self, filename, flush_interval=10.0):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self._hdul = fits.open(filename, mode='update', memmap=True)
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def open(cls, filename, frequencies, fdots, meta):
+        if os.path.exists(filename):
+            existing = read_metadata(filename)
+            with fits.open(filename, memmap=True) as hdul:
+                same_grid = (np.array_equal(hdul['FREQUENCY'].data, frequencies)
+                             and np.array_equal(hdul['FDOT'].data, fdots))
+                unfinished = not hdul['ROWDONE'].data.all()
+            same_meta = all(existing.get(name) == meta.get(name) for name in ('event_file', 'energy_band', 'nharm', 'orbit'))
+            if same_grid and same_meta:
+                store = cls(filename)
+                print(f"Resuming {filename}: {len(store.pending_rows())} of {len(fdots)} fdot rows left")
+                return store
+            if unfinished:
+                raise FileExistsError(f"{filename} holds an unfinished, different search; resume it, "
+                                      f"or remove it or choose another result file to start this one")
+            print(f"{filename} was written for a different search, starting over.")
+        _create_store(filename, frequencies, fdots, meta)
+        return cls(filename)
+
+    def pending_rows(self):
+        return np.flatnonzero(self._hdul['ROWDONE'].data == 0)
+
+    def write_row(self, row, stats_row):
+        self._hdul['STATS'].data[row] = stats_row
+        self._hdul['ROWDONE'].data[row] = 1
+        # Flushing every row would make small rows disk-bound, so flush on a timer
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._hdul.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self._hdul.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_metadata(filename):
+    header = fits.getheader(filename)
+    return {name: header[keyword] for keyword, name in META_KEYWORDS.items() if keyword in header}
+
+
+def load_search_result(filename):
+    """
+    Lazily rebuild ff, fd and stats from a search result file.
+    stats is memory-mapped from the file (rows that never finished are NaN) and ff, fd are
+    broadcast views of the trial axes, so nothing of size nfdot x nfreq is read up front.
+    Returns:
+    - tuple: (ff, fd, stats, metadata)
+    """
+    with stage('fits_read'):
+        hdul = fits.open(filename, memmap=True)
+        frequencies = hdul['FREQUENCY'].data
+        fdots = hdul['FDOT'].data
+        done = hdul['ROWDONE'].data.astype(bool)
+        stats = hdul['STATS'].data
+        if not done.all():
+            stats = np.where(done[:, None], stats, np.nan)
+    shape = (len(fdots), len(frequencies))
+    ff = np.broadcast_to(frequencies[None, :], shape)
+    fd = np.broadcast_to(fdots[:, None], shape)
+    return ff, fd, stats, read_metadata(filename)
+
+
+def save_search_result(filename, ff, fd, stats, meta):
+    """Write an already computed (ff, fd, stats) grid, e.g. the patch of the adaptive search."""
+    with SearchStore.open(filename, ff[0], fd[:, 0], meta) as store:
+        for row in store.pending_rows():
+            store.write_row(row, stats[row])
+
+
+@instrumented()
+def resumable_folding_search(events, filename, fmin, fmax, step=None, oversample=2, fdotmin=0, fdotmax=0,
+                             nharm=2, nproc=None, event_file=None, energy_band=None, orbit=None):
+    """
+    folding_search_parallel that streams every finished fdot row into a SearchStore file
+    and, if the file already holds part of the same search, only computes the missing rows.
+    orbit describes the binary orbit removed from the event times, if any (see plotfdotvf.fdotvf_search).
+    Returns:
+    - tuple: (ff, fd, stats, step, fdotstep, length)
+    """
+    times = relative_times(events)
+    frequencies, fdots, step, fdotstep, length = search_grid(times, fmin, fmax, step, oversample, fdotmin, fdotmax)
+    meta = {'event_file': event_file, 'energy_band': energy_band, 'nharm': nharm, 'orbit': orbit,
+            'ref_time': float(events.time[0] - times[0]), 'fmin': fmin, 'fmax': fmax, 'step': step,
+            'fdotmin': fdotmin, 'fdotmax': fdotmax, 'fdotstep': fdotstep, 'length': length}
+
+    with SearchStore.open(filename, frequencies, fdots, meta) as store:
+        rows = store.pending_rows()
+        print(f"Searching {len(frequencies)} frequencies and {len(rows)} fdots on {nproc or os.cpu_count()} processes")
+        zn_search_grid(times, frequencies, fdots, nharm=nharm, nproc=nproc, rows=rows, on_row=store.write_row)
+
+    ff, fd, stats, _ = load_search_result(filename)
+    return ff, fd, stats, step, fdotstep, length
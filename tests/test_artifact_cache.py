@@ -0,0 +1,51 @@
+import os
+import json
+
+from artifact_cache import ArtifactCache
+
+
+def test_store_does_not_evict_the_new_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'), max_bytes=1500)
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    src.mkdir()
+    dst.mkdir()
+    (src / 'b.bin').write_bytes(b'x' * 1000)
+    cache.copy(str(src / 'b.bin'), str(dst))
+    # Older than the entry already cached, as an archived event file would be
+    (src / 'a.evt').write_bytes(b'y' * 1000)
+    os.utime(src / 'a.evt', (1e9, 1e9))
+    dest = cache.copy(str(src / 'a.evt'), str(dst))
+    assert os.path.exists(dest)
+    assert cache.fetch(cache.key('copy', [], [str(src / 'a.evt')]), str(tmp_path / 'again.evt'))
+
+
+def test_stale_digests_are_pruned(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    path = tmp_path / 'a.evt'
+    path.write_bytes(b'a')
+    cache.file_digest(str(path))
+    path.write_bytes(b'changed')
+    os.utime(path, (2e9, 2e9))
+    ArtifactCache(str(tmp_path / 'cache')).file_digest(str(path))
+    with open(cache.digest_index) as f:
+        assert len(json.load(f)) == 1
+
+
+def test_shared_product_stays_writable(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    product = tmp_path / 'product.evt'
+    product.write_bytes(b'events')
+    cache.store('a' * 64, str(product))
+    with open(product, 'ab') as f:
+        f.write(b' more')
+
+
+def test_evict_skips_in_flight_stores(tmp_path):
+    from artifact_cache import TMP_PREFIX
+    cache = ArtifactCache(str(tmp_path / 'cache'), max_bytes=10)
+    in_flight = os.path.join(cache.objects_dir, 'ab', TMP_PREFIX + 'x')
+    os.makedirs(os.path.dirname(in_flight))
+    with open(in_flight, 'wb') as f:
+        f.write(b'x' * 100)
+    cache.evict()
+    assert os.path.exists(in_flight)
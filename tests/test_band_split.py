@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from band_split import split_event_file
+
+BANDS = [(3, 10), (10, 20)]
+
+
+@pytest.fixture
+def evt_file(tmp_path):
+    # Small synthetic event file: PI on the band edges, and a GTI extension
+    time = np.arange(8, dtype=np.float64)
+    pi = np.array([30, 50, 100, 101, 150, 200, 201, 20], dtype=np.int16)
+    events = fits.BinTableHDU.from_columns([fits.Column(name='TIME', format='D', array=time),
+                                            fits.Column(name='PI', format='I', array=pi)], name='EVENTS')
+    gti = fits.BinTableHDU.from_columns([fits.Column(name='START', format='D', array=[0.0]),
+                                         fits.Column(name='STOP', format='D', array=[8.0])], name='GTI')
+    filename = tmp_path / 'ni0000000000.evt'
+    fits.HDUList([fits.PrimaryHDU(), events, gti]).writeto(filename)
+    return str(filename)
+
+
+def test_write_only(evt_file):
+    paths, events = split_event_file(evt_file, BANDS)
+    assert events == {}
+    assert sorted(paths) == BANDS
+    with fits.open(paths[(3, 10)]) as hdul:
+        assert list(hdul['EVENTS'].data['PI']) == [30, 50, 100]
+        assert len(hdul['GTI'].data) == 1
+    assert os.path.basename(paths[(10, 20)]) == 'ni0000000000_E10_20.evt'
+
+
+def test_write_and_return_events(evt_file):
+    paths, events = split_event_file(evt_file, BANDS, write=True, return_events=True)
+    assert sorted(paths) == sorted(events) == BANDS
+    assert all(os.path.exists(path) for path in paths.values())
+    assert list(events[(3, 10)]['PI']) == [30, 50, 100]
+    # Both ends are inclusive, rows stay in time order
+    assert list(events[(10, 20)]['PI']) == [100, 101, 150, 200]
+    assert list(events[(10, 20)]['TIME']) == [2, 3, 4, 5]
@@ -0,0 +1,25 @@
+from batch_pipeline import (ObsContext, POST_BARYCENTRE_STAGES, PRE_BARYCENTRE_STAGES, load_config,
+                            missing_inputs, stage_order)
+
+
+def test_default_stages_run_without_missing_inputs(tmp_path):
+    config = load_config()
+    config['datapath'] = str(tmp_path)
+    ctx = ObsContext(config, '3602020101', None)
+    assert stage_order(config['stages']) == PRE_BARYCENTRE_STAGES
+    assert missing_inputs(ctx, config['stages']) == {}
+
+
+def test_post_barycentre_stages_need_the_corrected_file(tmp_path):
+    config = load_config()
+    config['datapath'] = str(tmp_path)
+    ctx = ObsContext(config, '3602020101', None)
+    assert stage_order(POST_BARYCENTRE_STAGES) == POST_BARYCENTRE_STAGES
+    assert set(missing_inputs(ctx, POST_BARYCENTRE_STAGES)) == {'calibrate'}
+
+    ctx_dir = tmp_path / '3602020101' / 'xti' / 'analysis'
+    ctx_dir.mkdir(parents=True)
+    (ctx_dir / f"{ctx.base_filename}.evt").write_bytes(b'')
+    assert missing_inputs(ctx, POST_BARYCENTRE_STAGES) == {}
+    # Rerunning niextract in the same batch would leave the corrected file stale
+    assert set(missing_inputs(ctx, PRE_BARYCENTRE_STAGES + POST_BARYCENTRE_STAGES)) == {'calibrate'}
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from binary_orbit import SECONDS_PER_DAY, load_orbit
+
+MJDREF = 56658.000777592593  # NICER
+
+
+def test_delay_at_mid_eclipse_is_a1sini():
+    orbit = load_orbit()
+    t_pi2 = 46359.87194
+    delay = orbit.delay((t_pi2 - MJDREF) * SECONDS_PER_DAY, MJDREF)
+    assert np.isclose(delay, orbit.a1sini, atol=1e-6)
+
+
+def test_delay_at_ascending_node_is_zero_and_increasing():
+    orbit = load_orbit()
+    t0 = (orbit.t0 - MJDREF) * SECONDS_PER_DAY
+    delay = orbit.delay(np.array([t0, t0 + 60.0]), MJDREF)
+    assert np.isclose(delay[0], 0.0, atol=1e-6)
+    assert delay[1] > delay[0]
+
+
+def test_search_removes_the_orbit(tmp_path):
+    pytest.importorskip('hendrics')
+    from hendrics.io import HEN_FILE_EXTENSION, save_events
+    from plotfdotvf import best_point, fdotvf_search
+    from search_store import read_metadata
+    from test_fdot_search import synthetic_events
+
+    # Pulses emitted at 0.8078 Hz, observed with the orbital delay of the latest Her X-1 orbit
+    orbit = load_orbit()
+    events = synthetic_events(fdot0=0.0)
+    events.mjdref = MJDREF
+    events.time = events.time + orbit.delay(events.time, MJDREF)
+    filename = str(tmp_path / f"orbit_ev{HEN_FILE_EXTENSION}")
+    save_events(events, filename)
+
+    window = dict(fmin=0.8070, fmax=0.8086, fdotmin=0.0, fdotmax=0.0, oversample=4, nproc=1)
+    ff, fd, stats, step, *_ = fdotvf_search(filename, result_file=str(tmp_path / 'plain.fits'), **window)
+    assert abs(best_point(ff, fd, stats)[0] - 0.8078) > 2 * step
+    ff, fd, stats, step, *_ = fdotvf_search(filename, result_file=str(tmp_path / 'orbit.fits'), orbit=orbit, **window)
+    assert abs(best_point(ff, fd, stats)[0] - 0.8078) <= step
+    assert read_metadata(str(tmp_path / 'orbit.fits'))['orbit'].split() == [repr(float(v)) for v in orbit.parameters()]
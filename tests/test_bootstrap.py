@@ -0,0 +1,21 @@
+import numpy as np
+
+from bootstrap import circular_mean_std, profile_uncertainties
+
+
+def test_harmonic_phase_spread_does_not_depend_on_the_wrap():
+    phase = np.arange(64) / 64
+    spreads = []
+    for shift in (0.1, 0.2495):  # Second harmonic maximum away from and next to its wrap at 0.5
+        profile = 1000 * (1 + 0.3 * np.cos(2 * np.pi * 2 * (phase - shift)))
+        spreads.append(profile_uncertainties(profile, 500, seed=1)['harmonic_phases'][1][1])
+    assert spreads[1] < 0.01
+    assert np.isclose(spreads[0], spreads[1], rtol=0.3)
+
+
+def test_circular_mean_std_per_period():
+    periods = np.array([1, 0.5])
+    # Both columns straddle their wrap point
+    mean, std = circular_mean_std(np.array([[0.98, 0.49], [0.02, 0.01]]), periods)
+    assert np.allclose(np.minimum(mean, periods - mean), 0)
+    assert np.allclose(std, [0.02, 0.01], rtol=0.01)
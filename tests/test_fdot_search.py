@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from fdot_search import folding_search_parallel, relative_times, search_grid
+
+
+def synthetic_events(f0=0.8078, fdot0=5e-8, length=4000.0, ntrials=20000, pulsed_fraction=0.5, seed=3):
+    # Sinusoidally pulsed events by rejection sampling, in one GTI starting before the first event
+    from stingray import EventList
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.uniform(0, length, ntrials))
+    phase = f0 * times + 0.5 * fdot0 * times ** 2
+    keep = rng.uniform(0, 1, times.size) < (1 + pulsed_fraction * np.cos(2 * np.pi * phase)) / (1 + pulsed_fraction)
+    times = 1e8 + times[keep]
+    return EventList(times, gti=np.array([[1e8 - 10.0, 1e8 + length + 10.0]]))
+
+
+def test_grid_includes_upper_ends():
+    times = np.array([5.0, 100.0])
+    frequencies, fdots, step, fdotstep, length = search_grid(times, 1.0, 1.01, oversample=1, fdotmin=-1e-4, fdotmax=1e-4)
+    assert length == 100.0
+    assert np.isclose(frequencies[-1], 1.01)
+    assert np.isclose(fdots[-1], 1e-4)
+
+
+def test_grid_and_peak_match_hendrics():
+    pytest.importorskip('hendrics')
+    from hendrics.efsearch import folding_search, z_n_search
+    events = synthetic_events()
+    window = dict(fmin=0.8070, fmax=0.8086, oversample=2, fdotmin=-2e-7, fdotmax=2e-7)
+
+    ff_h, fd_h, stats_h, step_h, fdotstep_h, length_h = folding_search(
+        events, window['fmin'], window['fmax'], oversample=2, func=z_n_search, fdotmin=window['fdotmin'],
+        fdotmax=window['fdotmax'], nharm=2, nbin=512)
+    ff, fd, stats, step, fdotstep, length = folding_search_parallel(events, nharm=2, nproc=1, **window)
+
+    assert length == pytest.approx(length_h)
+    assert step == pytest.approx(step_h)
+    assert fdotstep == pytest.approx(fdotstep_h)
+    assert np.allclose(ff, ff_h) and np.allclose(fd, fd_h)
+    assert np.unravel_index(np.argmax(stats), stats.shape) == np.unravel_index(np.argmax(stats_h), stats_h.shape)
+    # hendrics folds into phase bins and refers the phases to the first event, not to the GTI
+    # start, so the values agree closely but not exactly
+    assert np.corrcoef(stats.ravel(), stats_h.ravel())[0, 1] > 0.99
+    assert relative_times(events)[0] > 0
@@ -0,0 +1,43 @@
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from mkf_viewer import MKFViewer, minmax_decimate, read_mkf_columns
+
+
+@pytest.fixture
+def mkf_file(tmp_path):
+    # Small synthetic MKF: 1 s rows with an SAA gap (NaN) and one spike
+    time = np.arange(20000, dtype=np.float64)
+    overonly = np.full(time.size, 1.0)
+    overonly[5000:5100] = np.nan
+    overonly[12345] = 80.0
+    columns = [fits.Column(name='TIME', format='D', array=time),
+               fits.Column(name='FPM_OVERONLY_COUNT', format='E', array=overonly),
+               fits.Column(name='FPM_UNDERONLY_COUNT', format='E', array=np.full(time.size, 100.0))]
+    filename = tmp_path / 'ni0000000000.mkf'
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns(columns, name='PREFILTER')]).writeto(filename)
+    return str(filename)
+
+
+def test_read_mkf_columns(mkf_file):
+    hdul, time, columns = read_mkf_columns(mkf_file, ['FPM_OVERONLY_COUNT'])
+    with hdul:
+        assert list(columns) == ['FPM_OVERONLY_COUNT']
+        assert len(time) == len(columns['FPM_OVERONLY_COUNT']) == 20000
+
+
+def test_minmax_decimate_keeps_extremes(mkf_file):
+    hdul, time, columns = read_mkf_columns(mkf_file, ['FPM_OVERONLY_COUNT'])
+    with hdul:
+        x, y = minmax_decimate(np.asarray(time), np.asarray(columns['FPM_OVERONLY_COUNT']), time[0], time[-1], 100)
+        assert len(x) <= 200
+        assert np.nanmax(y) == 80.0
+
+
+def test_viewer_builds(mkf_file):
+    viewer = MKFViewer(mkf_file, ['FPM_OVERONLY_COUNT', 'FPM_UNDERONLY_COUNT'], thresholds={'FPM_OVERONLY_COUNT': 30})
+    assert len(viewer.axes) == 2
+    viewer.hdul.close()
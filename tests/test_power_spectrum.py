@@ -0,0 +1,23 @@
+import numpy as np
+
+from power_spectrum import PowerSpectrum
+
+
+def pulsed_events(length=20000, rate=200, seed=0):
+    # A strong drifting pulsation at 0.8078 Hz and a weak one at 1.0 Hz
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.uniform(0, length, rng.poisson(rate * length)))
+    phase = 0.8078 * times + 0.5 * 5e-8 * times ** 2
+    rate_shape = 1 + 0.8 * np.cos(2 * np.pi * phase) + 0.05 * np.cos(2 * np.pi * 1.0 * times)
+    return times[rng.uniform(size=times.size) < rate_shape / 1.85], np.array([[0.0, length]])
+
+
+def test_candidates_skip_leakage_sidelobes():
+    times, gti = pulsed_events()
+    spectrum = PowerSpectrum.from_events(times, gti)
+    # Even with the narrow separation, the sidelobes of the strong peak are not candidates
+    for separation in (None, 2 / spectrum.segment_length):
+        (strong, _, _), (weak, _, significance), *_ = spectrum.candidates(3, separation=separation)
+        assert abs(strong - 0.8078) < 2 / spectrum.segment_length
+        assert abs(weak - 1.0) < 1 / spectrum.segment_length
+        assert significance > 5
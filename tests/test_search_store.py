@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from search_store import SearchStore, load_search_result, save_search_result
+
+META = {'event_file': 'ni3602020101_nicer_xti_ev_calib.nc', 'energy_band': 'full', 'nharm': 2}
+
+
+def test_unfinished_search_is_not_replaced(tmp_path):
+    filename = str(tmp_path / 'foldingsearch.fits')
+    with SearchStore.open(filename, np.arange(5.0), np.arange(3.0), META) as store:
+        store.write_row(0, np.ones(5))
+
+    # A different (e.g. adaptive) search must not take over the resume file
+    ff, fd = np.meshgrid(np.arange(4.0), np.arange(2.0))
+    with pytest.raises(FileExistsError):
+        save_search_result(filename, ff, fd, np.zeros((2, 4)), META)
+
+    with SearchStore.open(filename, np.arange(5.0), np.arange(3.0), META) as store:
+        assert list(store.pending_rows()) == [1, 2]
+        for row in store.pending_rows():
+            store.write_row(row, np.ones(5))
+
+    # Once finished, it can be replaced
+    save_search_result(filename, ff, fd, np.zeros((2, 4)), META)
+    assert load_search_result(filename)[2].shape == (2, 4)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from timing_store import TimingParameterStore
+
+
+def write_table(path, rows):
+    path.write_text("obs_id_gti,tstart,fr,frdot,fddot,valid_tstart,valid_tstop\n"
+                    + "".join(f"{key},0,0.8078,0,,{start},{stop}\n" for key, start, stop in rows))
+    return TimingParameterStore(str(path))
+
+
+def test_covering_disjoint(tmp_path):
+    store = write_table(tmp_path / 'timing_parameters.txt', [('A', 0, 10), ('B', 20, 30)])
+    assert list(store.covering([-1, 5, 15, 25, 31])) == [None, 'A', None, 'B', None]
+
+
+def test_covering_nested_and_overlapping(tmp_path):
+    store = write_table(tmp_path / 'timing_parameters.txt',
+                        [('A', 0, 100), ('B', 10, 20), ('C', 30, 40), ('D', 35, 60), ('E', 50, 55)])
+    times = [5, 15, 25, 38, 45, 52, 58, 80, 101]
+    expected = ['A', 'B', 'A', 'D', 'D', 'E', 'D', 'A', None]
+    assert list(store.covering(times)) == expected
+    assert store.for_time(50.0)['fr'] == 0.8078
+
+
+def test_covering_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(1)
+    starts = rng.uniform(0, 1000, 40)
+    stops = starts + rng.exponential(100, 40)
+    store = write_table(tmp_path / 'timing_parameters.txt',
+                        [(f"id{i}", start, stop) for i, (start, stop) in enumerate(zip(starts, stops))])
+    times = rng.uniform(-50, 1200, 500)
+    for time, found in zip(times, store.covering(times)):
+        inside = np.flatnonzero((starts <= time) & (time <= stops))
+        assert found == (None if not len(inside) else f"id{inside[np.argmax(starts[inside])]}")
+
+
+def test_update(tmp_path):
+    store = write_table(tmp_path / 'timing_parameters.txt', [('A', 0, 10)])
+    store.update('A', fr=0.8079, fddot=1e-15)
+    assert store.get('A')['fr'] == 0.8079
+    assert store.get('A')['fddot'] == 1e-15
+    with pytest.raises(KeyError):
+        store.update('B', fr=0.8079)
+    assert store.get('B') is None
+    store.update('B', tstart=100, fr=0.8079, frdot=1e-12)
+    assert store.get('B') == {'tstart': 100.0, 'fr': 0.8079, 'frdot': 1e-12}
@@ -0,0 +1,191 @@
+# Indexed store for timing_parameters.txt.
+# The CSV is parsed once (lazily, on first use) into an in-memory table indexed by
+# obs_id_gti, and re-read only when the file changes on disk. Besides tstart, fr
+# and frdot, rows may carry fddot and a validity interval (valid_tstart,
+# valid_tstop) as extra columns. Updates are written atomically under a file
+# lock, so fitted values can be written back while parallel jobs read.
+import os
+import csv
+import fcntl
+import tempfile
+import contextlib
+import numpy as np
+
+TIMING_FILE = "timing_parameters.txt"
+# Positional meaning of the first columns, whatever the header calls them
+BASE_COLUMNS = ['obs_id_gti', 'tstart', 'fr', 'frdot']
+OPTIONAL_COLUMNS = ['fddot', 'valid_tstart', 'valid_tstop']
+
+
+class TimingParameterStore:
+    def __init__(self, filename):
+        self.filename = filename
+        self._stamp = None
+        self._header = None
+        self._rows = []
+        self._index = {}
+
+    ### Loading
+
+    def _file_stamp(self):
+        st = os.stat(self.filename)
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _read(self):
+        with open(self.filename, mode='r', newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            rows = [row for row in reader if row]
+        return header, rows
+
+    def _columns(self, header):
+        # The first four columns keep their historical positional meaning
+        names = list(BASE_COLUMNS) + [name.strip() for name in header[len(BASE_COLUMNS):]]
+        return names
+
+    def _ensure_loaded(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        header, rows = self._read()
+        names = self._columns(header)
+        self._header = header
+        self._rows = [dict(zip(names, row)) for row in rows]
+        self._index = {}
+        for i, row in enumerate(self._rows):
+            # Like the old linear scan, the first row of an ID wins
+            self._index.setdefault(row['obs_id_gti'], i)
+        self._build_validity_index()
+        self._stamp = stamp
+
+    def _build_validity_index(self):
+        starts, stops, rows = [], [], []
+        for i, row in enumerate(self._rows):
+            if row.get('valid_tstart') and row.get('valid_tstop'):
+                starts.append(float(row['valid_tstart']))
+                stops.append(float(row['valid_tstop']))
+                rows.append(i)
+        order = np.argsort(starts, kind='stable')
+        self._valid_starts = np.asarray(starts, dtype=np.float64)[order]
+        self._valid_stops = np.asarray(stops, dtype=np.float64)[order]
+        self._valid_ids = np.array([self._rows[i]['obs_id_gti'] for i in rows], dtype=object)[order]
+        # For every interval, the latest-starting earlier one that ends later (-1 if none): the only
+        # earlier intervals that can still contain a time this one ends before
+        self._valid_previous = np.full(len(order), -1, dtype=np.int64)
+        stack = []
+        for j, stop in enumerate(self._valid_stops):
+            while stack and self._valid_stops[stack[-1]] <= stop:
+                stack.pop()
+            if stack:
+                self._valid_previous[j] = stack[-1]
+            stack.append(j)
+
+    @staticmethod
+    def _params(row):
+        params = {
+            'tstart': float(row['tstart']),
+            'fr': float(row['fr']),
+            'frdot': float(row['frdot'])
+        }
+        for name in OPTIONAL_COLUMNS:
+            if row.get(name):
+                params[name] = float(row[name])
+        return params
+
+    ### Queries
+
+    def get(self, obs_id_gti):
+        """Timing parameters of one ID, or None if it is not in the file."""
+        self._ensure_loaded()
+        i = self._index.get(obs_id_gti)
+        return None if i is None else self._params(self._rows[i])
+
+    def get_many(self, obs_id_gtis):
+        """Bulk lookup: {obs_id_gti: parameters or None}, with a single freshness check."""
+        self._ensure_loaded()
+        return {key: (None if self._index.get(key) is None else self._params(self._rows[self._index[key]]))
+                for key in obs_id_gtis}
+
+    def ids(self):
+        self._ensure_loaded()
+        return list(self._index)
+
+    def covering(self, times):
+        """
+        For every time, the ID of the ephemeris whose [valid_tstart, valid_tstop] contains it
+        (the latest-starting one if several do, also with nested or overlapping intervals), or None.
+        """
+        self._ensure_loaded()
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        candidate = np.searchsorted(self._valid_starts, times, side='right') - 1
+        # Step back from the latest interval starting before the time to earlier ones that end later
+        pending = candidate >= 0
+        pending[pending] = times[pending] > self._valid_stops[candidate[pending]]
+        while pending.any():
+            candidate[pending] = self._valid_previous[candidate[pending]]
+            pending &= candidate >= 0
+            pending[pending] = times[pending] > self._valid_stops[candidate[pending]]
+        ok = candidate >= 0
+        result = np.full(times.shape, None, dtype=object)
+        result[ok] = self._valid_ids[candidate[ok]]
+        return result
+
+    def for_time(self, time):
+        obs_id_gti = self.covering([time])[0]
+        return None if obs_id_gti is None else self.get(obs_id_gti)
+
+    ### Updates
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def update(self, obs_id_gti, **values):
+        """
+        Set the given columns of obs_id_gti (adding the row, or new columns, if needed),
+        re-reading the file under the lock and replacing it atomically. A new row needs
+        tstart, fr and frdot; updating an unknown ID without them raises KeyError.
+        """
+        missing = [name for name in BASE_COLUMNS[1:] if name not in values]
+        with self._locked():
+            header, rows = self._read()
+            names = self._columns(header)
+            for name in values:
+                if name not in names:
+                    names.append(name)
+                    header.append(name)
+            table = [dict(zip(names, row)) for row in rows]
+            for row in table:
+                if row['obs_id_gti'] == obs_id_gti:
+                    row.update({name: repr(float(value)) for name, value in values.items()})
+                    break
+            else:
+                if missing:
+                    raise KeyError(f"{obs_id_gti} is not in {self.filename}; a new row needs {', '.join(missing)}")
+                table.append({'obs_id_gti': obs_id_gti, **{name: repr(float(value)) for name, value in values.items()}})
+
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)), suffix='.tmp')
+            with os.fdopen(fd, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(header)
+                for row in table:
+                    writer.writerow([row.get(name, '') for name in names])
+            os.chmod(tmp, os.stat(self.filename).st_mode & 0o777)
+            os.replace(tmp, self.filename)
+        self._stamp = None
+
+
+_stores = {}
+
+
+def timing_store(data_path):
+    """The shared store of data_path/timing_parameters.txt."""
+    filename = os.path.join(data_path, TIMING_FILE)
+    if filename not in _stores:
+        _stores[filename] = TimingParameterStore(filename)
+    return _stores[filename]